@@ -25,5 +25,8 @@ from .statistic import *
 from .lens_distortion import *
 from .parameter_set import *
 from .gps import *
+from .heightmap import *
+from .topview import *
+from .fleet import *
 
 __version__ = "1.1"
@@ -18,17 +18,14 @@
 # along with cameratransform. If not, see <https://opensource.org/licenses/MIT>
 
 import numpy as np
-import pandas as pd
 import os
 import json
 import itertools
-import matplotlib.pyplot as plt
-import cv2
-from scipy import stats
-from .parameter_set import ParameterSet, ClassWithParameterSet, Parameter, TYPE_GPS
+from .parameter_set import ParameterSet, ClassWithParameterSet, Parameter, TYPE_GPS, TYPE_EXTRINSIC, TYPE_DISTORTION
 from .projection import RectilinearProjection, EquirectangularProjection, CylindricalProjection, CameraProjection
-from .spatial import SpatialOrientation
-from .lens_distortion import NoDistortion, LensDistortion, ABCDistortion, BrownLensDistortion
+from .spatial import SpatialOrientation, rotationMatrix
+from .lens_distortion import NoDistortion, LensDistortion, ABCDistortion, BrownLensDistortion, OpenCVLensDistortion
+from .heightmap import HeightMap
 from . import gps
 from . import ray
 
@@ -39,6 +36,7 @@ EQUIRECTANGULAR = 2
 NODISTORTION = 0
 ABCDDISTORTION = 1
 BROWNLENSDISTORTION = 2
+OPENCVLENSDISTORTION = 3
 
 def _getSensorFromDatabase(model):
     """
@@ -202,14 +200,120 @@ class CameraGroup(ClassWithParameterSet):
     def getBaseline(self):
         return np.sqrt((self[0].pos_x_m-self[1].pos_x_m)**2 + (self[0].pos_y_m-self[1].pos_y_m)**2)
 
-    def spaceFromImages(self, points1, points2):
-        p1, v1 = self.cameras[0].getRay(points1)
-        p2, v2 = self.cameras[1].getRay(points2)
-        return ray.intersectionOfTwoLines(p1, v1, p2, v2)
+    def spaceFromImages(self, *points):
+        """
+        Convert points from the **image** coordinate systems of the cameras to the **space** coordinate system. The
+        points are the least squares intersection of the rays of the cameras, see :py:meth:`CameraGroup.triangulate`.
+
+        Parameters
+        ----------
+        points : ndarray
+            the points in the **image** coordinates of each camera, one argument per camera, dimensions (2), (Nx2). If
+            less arguments than cameras are given, the points are triangulated with the first cameras of the group.
+
+        Returns
+        -------
+        points : ndarray
+            the points in the **space** coordinate system, dimensions (3), (Nx3)
+        """
+        points = np.asarray(points, dtype=float)
+        if len(points) > len(self):
+            raise ValueError("The points can only be given for the %d cameras of the group." % len(self))
+        # the remaining cameras do not see the points
+        missing = np.full((len(self) - len(points),) + points.shape[1:], np.nan)
+        points_space, error = self.triangulate(np.concatenate((points, missing)))
+        return points_space
+
+    def triangulate(self, points, visibility=None):
+        """
+        Triangulate points seen by multiple cameras of the group. Each point is the least squares intersection of the
+        rays of the cameras where it is visible, all points are solved in one batch.
+
+        Parameters
+        ----------
+        points : ndarray
+            the points in the **image** coordinates of each camera (nan for points not visible in a camera),
+            dimensions (Kx2), (KxNx2)
+        visibility : ndarray, optional
+            whether the points are visible in the cameras, dimensions (K), (KxN). Default: all points that are not nan.
+
+        Returns
+        -------
+        points : ndarray
+            the points in the **space** coordinate system, nan for points visible in less than two cameras,
+            dimensions (3), (Nx3)
+        error : ndarray
+            the root mean square reprojection error in pixels of the points in the cameras where they are visible,
+            dimensions scalar, (N)
+
+        Examples
+        --------
+
+        >>> import cameratransform as ct
+        >>> cam_group = ct.CameraGroup(ct.RectilinearProjection(focallength_px=3863, image=(4608, 3456)),
+        >>>                            [ct.SpatialOrientation(pos_x_m=x, elevation_m=10) for x in [-1, 0, 1]])
+
+        triangulate a point seen by all three cameras:
+
+        >>> cam_group.triangulate([[2350, 1600], [2320, 1600], [2290, 1600]])
+        (array([  0.53 128.65   3.03]), 0.00)
+
+        or a point that is not visible in the last camera:
+
+        >>> cam_group.triangulate([[2350, 1600], [2320, 1600], [np.nan, np.nan]])
+        (array([  0.53 128.65   3.03]), 0.00)
+        """
+        points = np.asarray(points, dtype=float)
+        return_single = len(points.shape) == 2
+        if return_single:
+            points = points[:, None, :]
+        if len(points) != len(self):
+            raise ValueError("The points have to be given for each of the %d cameras." % len(self))
+        if visibility is None:
+            visibility = np.ones(points.shape[:2], dtype=bool)
+        visibility = np.broadcast_to(np.asarray(visibility, dtype=bool).reshape(len(self), -1), points.shape[:2])
+        visibility = visibility & np.all(np.isfinite(points), axis=2)
+
+        # the rays of all points in all cameras
+        origins = np.zeros(points.shape[:2] + (3,))
+        directions = np.zeros(points.shape[:2] + (3,))
+        for index, cam in enumerate(self):
+            origins[index], directions[index] = cam.getRay(points[index])
+        points_space = ray.intersectionOfLines(origins, directions, visibility)
+
+        # the reprojection error of the points in the cameras where they are visible
+        squared_error = np.zeros(points.shape[:2])
+        for index, cam in enumerate(self):
+            squared_error[index] = np.sum((cam.imageFromSpace(points_space, hide_backpoints=False) - points[index]) ** 2, axis=1)
+        with np.errstate(invalid="ignore"):
+            error = np.sqrt(np.sum(np.where(visibility, squared_error, 0), axis=0) / np.sum(visibility, axis=0))
+        error[np.isnan(points_space[:, 0])] = np.nan
+
+        if return_single:
+            return points_space[0], error[0]
+        return points_space, error
+
+    def discanteBetweenRays(self, points1, points2, camera_indices=(0, 1)):
+        """
+        The distance between the rays of corresponding points in two cameras of the group.
+
+        Parameters
+        ----------
+        points1 : ndarray
+            the points in the **image** coordinates of the first camera, dimensions (2), (Nx2)
+        points2 : ndarray
+            the points in the **image** coordinates of the second camera, dimensions (2), (Nx2)
+        camera_indices : tuple, optional
+            the indices of the two cameras in the group, default (0, 1)
 
-    def discanteBetweenRays(self, points1, points2):
-        p1, v1 = self.cameras[0].getRay(points1, normed=True)
-        p2, v2 = self.cameras[1].getRay(points2, normed=True)
+        Returns
+        -------
+        distance : ndarray
+            the distances of the rays, dimensions () or (N)
+        """
+        index1, index2 = camera_indices
+        p1, v1 = self.cameras[index1].getRay(points1, normed=True)
+        p2, v2 = self.cameras[index2].getRay(points2, normed=True)
         return ray.distanceOfTwoLines(p1, v1, p2, v2)
 
     def imagesFromSpace(self, points):
@@ -226,51 +330,375 @@ class CameraGroup(ClassWithParameterSet):
 
     def addBaselineInformation(self, target_baseline, uncertainty=6):
         def baselineInformation(target_baseline=target_baseline, uncertainty=uncertainty):
+            from scipy import stats
             # baseline
             return np.sum(stats.norm(loc=target_baseline, scale=uncertainty).logpdf(self.getBaseline()))
         self.log_prob.append(baselineInformation)
 
-    def addPointCorrespondenceInformation(self, corresponding1, corresponding2, uncertainty=1):
-        def pointCorrespondenceInformation(corresponding1=corresponding1, corresponding2=corresponding2):
-            sum = 0
-            corresponding = [corresponding1, corresponding2]
+    def addPointCorrespondenceInformation(self, corresponding1, corresponding2=None, uncertainty=1, visibility=None):
+        """
+        Add a term to the camera probability used for fitting, which is based on the distances of corresponding points
+        to their epipolar lines (see :py:meth:`CameraGroup.epipolarDistances`).
+
+        Parameters
+        ----------
+        corresponding1 : ndarray
+            the points in the **image** coordinates of the first camera, dimensions (Nx2), or the points in the
+            **image** coordinates of all cameras, dimensions (KxNx2)
+        corresponding2 : ndarray, optional
+            the corresponding points in the **image** coordinates of the second camera, dimensions (Nx2)
+        uncertainty : number, optional
+            the uncertainty of the distances in pixels, default 1
+        visibility : ndarray, optional
+            whether the points are visible in the cameras, dimensions (KxN). Default: all points that are not nan.
+        """
+        points = self._getCorrespondingPoints(corresponding1, corresponding2)
+        pairs = list(itertools.combinations(range(len(self)), 2))
+        valid = self._getPairVisibility(points, visibility, pairs)
+
+        def pointCorrespondenceInformation():
+            distances = self.epipolarDistances(points, pairs=pairs)[valid]
+            # the log probability of normal distributed distances
+            return np.sum(-0.5 * (distances / uncertainty) ** 2) - len(distances) * np.log(uncertainty * np.sqrt(2 * np.pi))
+
+        self.log_prob.append(pointCorrespondenceInformation)
+
+    def pointCorrespondenceError(self, corresponding1, corresponding2=None, visibility=None):
+        """
+        The distances of corresponding points to their epipolar lines.
+
+        Parameters
+        ----------
+        corresponding1 : ndarray
+            the points in the **image** coordinates of the first camera, dimensions (Nx2), or the points in the
+            **image** coordinates of all cameras, dimensions (KxNx2)
+        corresponding2 : ndarray, optional
+            the corresponding points in the **image** coordinates of the second camera, dimensions (Nx2)
+        visibility : ndarray, optional
+            whether the points are visible in the cameras, dimensions (KxN). Default: all points that are not nan.
+
+        Returns
+        -------
+        distances : list, ndarray
+            for two cameras, a list with the distances in the image of the second and the first camera, dimensions
+            2x(N). For K cameras, the distances for all pairs of cameras, see :py:meth:`CameraGroup.epipolarDistances`.
+        """
+        points = self._getCorrespondingPoints(corresponding1, corresponding2)
+        pairs = list(itertools.combinations(range(len(self)), 2))
+        distances = self.epipolarDistances(points, pairs=pairs)
+        distances[~self._getPairVisibility(points, visibility, pairs)] = np.nan
+        if corresponding2 is not None:
+            return [distances[0, 1], distances[0, 0]]
+        return distances
+
+    def _getCorrespondingPoints(self, corresponding1, corresponding2=None):
+        if corresponding2 is not None:
+            return np.array([corresponding1, corresponding2], dtype=float)
+        return np.asarray(corresponding1, dtype=float)
+
+    def _getPairVisibility(self, points, visibility, pairs):
+        # whether the points are visible in both cameras of each pair, dimensions (Px2xN)
+        if visibility is None:
+            visibility = np.ones(points.shape[:2], dtype=bool)
+        visibility = np.asarray(visibility, dtype=bool) & np.all(np.isfinite(points), axis=2)
+        i, j = np.array(pairs).T
+        return np.repeat((visibility[i] & visibility[j])[:, None, :], 2, axis=1)
+
+    def getFundamentalMatrices(self, pairs=None):
+        """
+        The fundamental matrices F of pairs of cameras, calculated from the current parameters of the cameras. For
+        corresponding points x_i and x_j (in homogeneous **image** coordinates without lens distortion) of the cameras
+        i and j, x_j^T F x_i = 0. Only valid for cameras with a :py:class:`RectilinearProjection`.
+
+        Parameters
+        ----------
+        pairs : list, optional
+            the pairs of camera indices (i, j), default: all pairs of cameras.
+
+        Returns
+        -------
+        F : ndarray
+            the fundamental matrices, dimensions (Px3x3)
+        """
+        if pairs is None:
+            pairs = list(itertools.combinations(range(len(self)), 2))
+        i, j = np.array(pairs).reshape(-1, 2).T
+        # the inverse of the matrices mapping camera coordinates to homogeneous image coordinates
+        K_inv = []
+        for cam in self:
+            K = np.array([[cam.projection.focallength_x_px, 0, -cam.projection.center_x_px],
+                          [0, -cam.projection.focallength_y_px, -cam.projection.center_y_px],
+                          [0, 0, -1]])
+            K_inv.append(np.linalg.inv(K))
+        K_inv = np.array(K_inv)
+        R = np.array([cam.orientation.R for cam in self])
+        t = np.array([cam.orientation.t for cam in self])
+
+        # the relative pose of camera j with respect to camera i
+        R_ij = R[j] @ R[i].transpose(0, 2, 1)
+        t_ij = np.einsum("pab,pb->pa", R[j], t[i] - t[j])
+        # the essential matrices E = [t]x R
+        t_cross = np.zeros((len(i), 3, 3))
+        t_cross[:, 0, 1], t_cross[:, 0, 2] = -t_ij[:, 2], t_ij[:, 1]
+        t_cross[:, 1, 0], t_cross[:, 1, 2] = t_ij[:, 2], -t_ij[:, 0]
+        t_cross[:, 2, 0], t_cross[:, 2, 1] = -t_ij[:, 1], t_ij[:, 0]
+        E = t_cross @ R_ij
+        return K_inv[j].transpose(0, 2, 1) @ E @ K_inv[i]
+
+    def epipolarDistances(self, points, pairs=None):
+        """
+        The symmetric epipolar distances of corresponding points for pairs of cameras, i.e. the distance of a point in
+        one image to the epipolar line of the corresponding point of the other image. For cameras with a
+        :py:class:`RectilinearProjection` all pairs are calculated in one batch using the fundamental matrices.
+
+        Parameters
+        ----------
+        points : ndarray
+            the corresponding points in the **image** coordinates of all cameras, dimensions (KxNx2)
+        pairs : list, optional
+            the pairs of camera indices (i, j), default: all pairs of cameras.
+
+        Returns
+        -------
+        distances : ndarray
+            the distances in pixels in the image of camera i and in the image of camera j for each pair, dimensions
+            (Px2xN)
+        """
+        points = np.asarray(points, dtype=float)
+        if pairs is None:
+            pairs = list(itertools.combinations(range(len(self)), 2))
+        i, j = np.array(pairs).reshape(-1, 2).T
+
+        # other projections do not have straight epipolar lines, use the rays there
+        if not all(isinstance(cam.projection, RectilinearProjection) for cam in self):
+            return self._epipolarDistancesFromRays(points, i, j)
+
+        # remove the lens distortion and convert to homogeneous coordinates
+        points_h = np.ones(points.shape[:2] + (3,))
+        for index, cam in enumerate(self):
+            points_h[index, :, :2] = cam.lens.imageFromDistorted(points[index])
+
+        F = self.getFundamentalMatrices(np.array([i, j]).T)
+        # the epipolar lines in image j of the points in image i and vice versa
+        lines_j = np.einsum("pab,pnb->pna", F, points_h[i])
+        lines_i = np.einsum("pba,pnb->pna", F, points_h[j])
+        residual = np.abs(np.einsum("pna,pna->pn", points_h[j], lines_j))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.array([residual / np.linalg.norm(lines_i[..., :2], axis=-1),
+                             residual / np.linalg.norm(lines_j[..., :2], axis=-1)]).transpose(1, 0, 2)
+
+    def _epipolarDistancesFromRays(self, points, i, j):
+        distances = np.zeros((len(i), 2, points.shape[1]))
+        for pair, (index1, index2) in enumerate(zip(i, j)):
             # iterate over cam1 -> cam2 and cam2 -> cam1
-            for i in [0, 1]:
+            for k, (source, target) in enumerate([(index2, index1), (index1, index2)]):
                 # get the ray from the correspondences in the first camera's image
-                world_epipole, world_ray = self[i].getRay(corresponding[i])
+                world_epipole, world_ray = self[source].getRay(points[source])
                 # project them to the image of the second camera
-                p1 = self[1 - i].imageFromSpace(world_epipole + world_ray * 1)
-                p2 = self[1 - i].imageFromSpace(world_epipole + world_ray * 2)
+                p1 = self[target].imageFromSpace(world_epipole + world_ray * 1, hide_backpoints=False)
+                p2 = self[target].imageFromSpace(world_epipole + world_ray * 2, hide_backpoints=False)
                 # find the perpendicular point from the epipolar lines to the correspondes point
-                perpendicular_point = ray.getClosestPointFromLine(p1, p2 - p1, corresponding[1 - i])
+                perpendicular_point = ray.getClosestPointFromLine(p1, p2 - p1, points[target])
                 # calculate the distances
-                distances = np.linalg.norm(perpendicular_point - corresponding[1 - i], axis=-1)
-                # sum the logprob of these distances
-                sum += np.sum(stats.norm(loc=0, scale=uncertainty).logpdf(distances))
-            # return the sum of the logprobs
-            return sum
+                distances[pair, k] = np.linalg.norm(perpendicular_point - points[target], axis=-1)
+        return distances
 
-        self.log_prob.append(pointCorrespondenceInformation)
+    def bundleAdjustment(self, points, visibility=None, parameters=None, points_space=None, iterations=100,
+                         tolerance=1e-10, verbose=False):
+        """
+        Jointly refine the parameters of the cameras and the **space** positions of points seen by multiple cameras, by
+        minimizing the reprojection errors of the points (bundle adjustment). The minimization uses the
+        Levenberg-Marquardt algorithm with a sparse Jacobian, where the points are eliminated from the normal
+        equations using the Schur complement. Therefore, only a small system with the size of the number of camera
+        parameters has to be solved in each iteration.
 
-    def pointCorrespondenceError(self, corresponding1, corresponding2):
-        sum = 0
-        corresponding = [corresponding1, corresponding2]
-        distances_list = []
-        # iterate over cam1 -> cam2 and cam2 -> cam1
-        for i in [0, 1]:
-            # get the ray from the correspondences in the first camera's image
-            world_epipole, world_ray = self[i].getRay(corresponding[i])
-            # project them to the image of the second camera
-            p1 = self[1 - i].imageFromSpace(world_epipole + world_ray * 1, hide_backpoints=False)
-            p2 = self[1 - i].imageFromSpace(world_epipole + world_ray * 2, hide_backpoints=False)
-            # find the perpendicular point from the epipolar lines to the correspondes point
-            perpendicular_point = ray.getClosestPointFromLine(p1, p2 - p1, corresponding[1 - i])
-            # calculate the distances
-            distances = np.linalg.norm(perpendicular_point - corresponding[1 - i], axis=-1)
-            # sum the logprob of these distances
-            distances_list.append(distances)
-        # return the sum of the logprobs
-        return distances_list
+        Parameters
+        ----------
+        points : ndarray
+            the points in the **image** coordinates of each camera (nan for points not visible in a camera),
+            dimensions (KxNx2)
+        visibility : ndarray, optional
+            whether the points are visible in the cameras, dimensions (KxN). Default: all points that are not nan.
+        parameters : list, optional
+            the names of the parameters of the group to refine. Default: the extrinsic parameters of all but the first
+            camera (which fixes the coordinate system).
+        points_space : ndarray, optional
+            the initial **space** positions of the points, dimensions (Nx3). Default: the points are triangulated,
+            see :py:meth:`CameraGroup.triangulate`.
+        iterations : int, optional
+            the maximal number of iterations, default 100
+        tolerance : number, optional
+            stop when the relative change of the cost is smaller, default 1e-10
+        verbose : bool, optional
+            whether to print the cost in every iteration.
+
+        Returns
+        -------
+        result : OptimizeResult
+            x are the refined parameter values (in the order of parameter_names), points the refined **space**
+            positions of the points (nan for points visible in less than two cameras), and error the root mean square
+            reprojection error in pixels.
+        """
+        from scipy import sparse
+        from scipy.optimize import OptimizeResult
+
+        points = np.asarray(points, dtype=float)
+        if visibility is None:
+            visibility = np.ones(points.shape[:2], dtype=bool)
+        visibility = np.asarray(visibility, dtype=bool) & np.all(np.isfinite(points), axis=2)
+        if points_space is None:
+            points_space, error = self.triangulate(points, visibility)
+        points_space = np.array(points_space, dtype=float)
+        # only points seen by at least two cameras are constrained
+        valid_points = np.all(np.isfinite(points_space), axis=1) & (np.sum(visibility, axis=0) >= 2)
+        visibility = visibility & valid_points
+        X = points_space[valid_points]
+        point_index = np.cumsum(valid_points) - 1
+
+        if parameters is None:
+            parameters = [name for name in self.parameters.parameters
+                          if name.startswith("C") and not name.startswith("C0_") and
+                          self.parameters.parameters[name].type & TYPE_EXTRINSIC]
+        parameters = list(parameters)
+
+        # the observations, ordered by camera
+        observation_camera, observation_point = np.where(visibility)
+        observation_point = point_index[observation_point]
+        observed = points[visibility]
+        camera_slices = [slice(start, end) for start, end in
+                         zip(np.searchsorted(observation_camera, np.arange(len(self))),
+                             np.searchsorted(observation_camera, np.arange(len(self)), side="right"))]
+
+        # the cameras that depend on each parameter (parameter objects can be shared by multiple cameras)
+        camera_parameters = [set(id(p) for part in (cam.projection, cam.orientation, cam.lens)
+                                 for p in part.parameters.parameters.values()) for cam in self]
+        affected = [[k for k in range(len(self)) if id(self.parameters.parameters[name]) in camera_parameters[k]]
+                    for name in parameters]
+
+        def project(k, X):
+            return self[k].imageFromSpace(X, hide_backpoints=False)
+
+        def residuals(X, cameras=None):
+            r = np.zeros((len(observed), 2))
+            for k in range(len(self)) if cameras is None else cameras:
+                index = camera_slices[k]
+                r[index] = project(k, X[observation_point[index]]) - observed[index]
+            return r
+
+        def setValues(values):
+            self.parameters.set_fit_parameters(parameters, values)
+
+        def jacobian(values, X):
+            # the derivatives by the camera parameters, only the rows of the affected cameras are non-zero
+            J_camera = np.zeros((len(observed), 2, len(parameters)))
+            for j, name in enumerate(parameters):
+                step = 1e-6 * max(1, abs(values[j]))
+                shifted = np.array(values, dtype=float)
+                shifted[j] = values[j] + step
+                setValues(shifted)
+                r_plus = residuals(X, affected[j])
+                shifted[j] = values[j] - step
+                setValues(shifted)
+                r_minus = residuals(X, affected[j])
+                J_camera[:, :, j] = (r_plus - r_minus) / (2 * step)
+            setValues(values)
+
+            # the derivatives by the point positions, a 2x3 block for every observation
+            J_points = np.zeros((len(observed), 2, 3))
+            for k in range(len(self)):
+                index = camera_slices[k]
+                X_k = X[observation_point[index]]
+                step = 1e-6 * np.maximum(1, np.abs(X_k))
+                for axis in range(3):
+                    shift = np.zeros_like(X_k)
+                    shift[:, axis] = step[:, axis]
+                    J_points[index, :, axis] = (project(k, X_k + shift) - project(k, X_k - shift)) / (2 * step[:, axis, None])
+            return J_camera, J_points
+
+        def solve(J_camera, J_points, r, damping):
+            M, N = len(parameters), len(X)
+            # the sparse Jacobians of the camera parameters and of the points
+            J_c = sparse.csr_matrix(J_camera.reshape(-1, M))
+            rows = np.repeat(np.arange(2 * len(observed)), 3)
+            columns = (3 * np.repeat(observation_point, 2)[:, None] + np.arange(3)).ravel()
+            J_p = sparse.csr_matrix((J_points.ravel(), (rows, columns)), shape=(2 * len(observed), 3 * N))
+            r = r.ravel()
+
+            # the blocks of the normal equations J^T J
+            U = (J_c.T @ J_c).toarray()
+            W = J_c.T @ J_p
+            V = np.zeros((N, 3, 3))
+            np.add.at(V, observation_point, np.einsum("oia,oib->oab", J_points, J_points))
+            g_c = J_c.T @ r
+            g_p = J_p.T @ r
+
+            # Levenberg-Marquardt damping of the diagonal
+            U[np.diag_indices(M)] *= 1 + damping
+            V[:, np.arange(3), np.arange(3)] *= 1 + damping
+            V[:, np.arange(3), np.arange(3)] += 1e-12
+            V_inv = np.linalg.inv(V)
+            V_inv_sparse = sparse.bsr_matrix((V_inv, np.arange(N), np.arange(N + 1)), shape=(3 * N, 3 * N))
+
+            # eliminate the points with the Schur complement and solve the reduced system for the camera parameters
+            WV_inv = W @ V_inv_sparse
+            if M:
+                S = U - (WV_inv @ W.T).toarray()
+                delta_c = np.linalg.lstsq(S, -g_c + WV_inv @ g_p, rcond=None)[0]
+            else:
+                delta_c = np.zeros(0)
+            delta_p = -V_inv_sparse @ (g_p + W.T @ delta_c)
+            return delta_c, delta_p.reshape(N, 3)
+
+        values = np.array([getattr(self.parameters, name) for name in parameters], dtype=float)
+        r = residuals(X)
+        cost = 0.5 * np.sum(r ** 2)
+        initial_cost = cost
+        damping = 1e-3
+        success = False
+        message = "Maximum number of iterations reached."
+        nit = 0
+        for iteration in range(iterations):
+            nit = iteration + 1
+            J_camera, J_points = jacobian(values, X)
+            while True:
+                delta_c, delta_p = solve(J_camera, J_points, r, damping)
+                setValues(values + delta_c)
+                r_new = residuals(X + delta_p)
+                cost_new = 0.5 * np.sum(r_new ** 2)
+                if cost_new < cost:
+                    break
+                # reject the step and increase the damping
+                damping *= 10
+                if damping > 1e16:
+                    break
+            if verbose:
+                print("iteration %d: cost %f, damping %g" % (iteration, min(cost, cost_new), damping))
+            if not cost_new < cost:
+                # the damping got too large without reducing the cost, only a cost at the numerical precision is
+                # converged
+                setValues(values)
+                if cost <= np.finfo(float).eps * initial_cost:
+                    success = True
+                    message = "The cost is reduced to the numerical precision."
+                else:
+                    message = "The cost could not be reduced further."
+                break
+            values = values + delta_c
+            X = X + delta_p
+            r = r_new
+            damping = max(damping / 10, 1e-12)
+            converged = cost - cost_new < tolerance * cost
+            cost = cost_new
+            if converged:
+                success = True
+                message = "The relative reduction of the cost is smaller than the tolerance."
+                break
+
+        points_space = np.full(points_space.shape, np.nan)
+        points_space[valid_points] = X
+        return OptimizeResult(x=values, parameter_names=parameters, points=points_space, cost=cost,
+                              error=np.sqrt(2 * cost / max(1, len(observed))), nit=nit, success=success,
+                              message=message)
 
     def getLogProbability(self):
         """
@@ -280,6 +708,7 @@ class CameraGroup(ClassWithParameterSet):
         return prob if not np.isnan(prob) else -np.inf
 
     def setCameraParametersByPointCorrespondence(self, corresponding1, corresponding2, baseline):
+        import cv2
         cam1 = self[0]
         cam2 = self[1]
         f, cx, cy = cam1.focallength_x_px, cam1.center_x_px, cam1.center_y_px
@@ -308,6 +737,8 @@ class CameraGroup(ClassWithParameterSet):
         cam2.parameters.set_fit_parameters(data.keys(), data.values())
 
     def plotEpilines(self, corresponding1, corresponding2, im1, im2):
+        import cv2
+        import matplotlib.pyplot as plt
         cam1 = self[0]
         cam2 = self[1]
         F, mask = cv2.findFundamentalMat(corresponding1, corresponding2)#, method=cv2.FM_8POINT)
@@ -365,6 +796,7 @@ class CameraGroup(ClassWithParameterSet):
         plt.show()
 
     def plotMyEpiploarLines(self, corresponding1, corresponding2, im1=None, im2=None):
+        import matplotlib.pyplot as plt
         cam1 = self[0]
         cam2 = self[1]
 
@@ -410,14 +842,37 @@ class Camera(ClassWithParameterSet):
     This class is the core of the CameraTransform package and represents a camera. Each camera has a projection
     (subclass of :py:class:`CameraProjection`), a spatial orientation (:py:class:`SpatialOrientation`) and optionally
     a lens distortion (subclass of :py:class:`LensDistortion`).
+
+    The conversions between **space** and **gps** coordinates use a spherical earth by default. Set
+    :py:attr:`earth_model` to "wgs84" to use the WGS84 ellipsoid instead (see :py:class:`LocalFrame`).
     """
+    earth_model = "sphere"
+
     map = None
     last_extent = None
     last_scaling = None
+    last_Z = None
+    last_Z_version = None
+    last_state = None
+    last_border = None
+    last_border_state = None
+    local_frame = None
+
+    ray_table = None
+    ray_table_state = None
+    ray_table_dtype = None
+    ray_table_filename = None
+
+    last_viewshed = None
+    last_viewshed_state = None
+
+    last_frustum = None
+    last_frustum_state = None
 
     map_undistort = None
     last_extent_undistort = None
     last_scaling_undistort = None
+    last_state_undistort = None
 
     R_earth = 6371e3
 
@@ -430,7 +885,11 @@ class Camera(ClassWithParameterSet):
         if lens is None:
             lens = NoDistortion()
         self.lens = lens
-        self.lens.setProjection(projection)
+        self._initParameters()
+
+    def _initParameters(self):
+        # link the lens to the projection and gather the parameters of all parts of the camera
+        self.lens.setProjection(self.projection)
 
         params = dict(gps_lat=Parameter(0, default=0, type=TYPE_GPS), gps_lon=Parameter(0, default=0, type=TYPE_GPS))
         params.update(self.projection.parameters.parameters)
@@ -438,6 +897,10 @@ class Camera(ClassWithParameterSet):
         params.update(self.lens.parameters.parameters)
         self.parameters = ParameterSet(**params)
 
+    def _getParameterState(self):
+        # the current state of the camera, used as a key for cached data that depends on the camera parameters
+        return (type(self.projection), type(self.lens)) + self.parameters.get_state()
+
     def __str__(self):
         string = "CameraTransform(\n"
         string += str(self.lens)
@@ -475,10 +938,10 @@ class Camera(ClassWithParameterSet):
         """
         # if it is a string
         if isinstance(lat, str):
-            try:
-                lat, lon, elevation = gps.gpsFromString(lat, height=elevation)
-            except ValueError:
-                lat, lon = gps.gpsFromString(lat, height=elevation)
+            position = gps.gpsFromString(lat, height=elevation)
+            lat, lon = position[:2]
+            if len(position) == 3:
+                elevation = position[2]
         else:
             # if it is a tuple
             try:
@@ -510,6 +973,7 @@ class Camera(ClassWithParameterSet):
         only_plot : bool, optional
             when true, the information will be ignored for fitting and only be used to plot.
         """
+        from scipy import stats
         if not only_plot:
             if not isinstance(variation, (float, int)):
                 self.additional_parameters += [variation]
@@ -535,6 +999,7 @@ class Camera(ClassWithParameterSet):
             self.log_prob.append(heigthInformation)
 
         def plotHeightPoints(points_feet=points_feet, points_head=points_head, color=plot_color):
+            import matplotlib.pyplot as plt
             p, = plt.plot(points_feet[..., 0], points_feet[..., 1], "_", label="feet", color=color)
 
             # get the feet positions in the world
@@ -586,6 +1051,7 @@ class Camera(ClassWithParameterSet):
             uncertainties = uncertainties[..., None]
 
         def landmarkInformation(lm_points_image=lm_points_image, lm_points_space=lm_points_space, uncertainties=uncertainties):
+            from scipy import stats
             origins, lm_rays = self.getRay(lm_points_image, normed=True)
             nearest_point = ray.getClosestPointFromLine(origins, lm_rays, lm_points_space)
             distance_from_camera = np.linalg.norm(nearest_point-np.array([self.pos_x_m, self.pos_y_m, self.elevation_m]), axis=-1)
@@ -601,6 +1067,7 @@ class Camera(ClassWithParameterSet):
             self.log_prob.append(landmarkInformation)
 
         def plotLandmarkPoints(lm_points_image=lm_points_image, lm_points_space=lm_points_space, color=plot_color):
+            import matplotlib.pyplot as plt
             lm_projected_image = self.imageFromSpace(lm_points_space)
 
             p, = plt.plot(lm_points_image[..., 0], lm_points_image[..., 1], "+", label="landmarks fitted", color=color)
@@ -633,6 +1100,7 @@ class Camera(ClassWithParameterSet):
         horizon = np.array(horizon)
 
         def horizonInformation(horizon=horizon, uncertainty=uncertainty):
+            from scipy import stats
             # evaluate the horizon at the provided x coordinates
             image_horizon = self.getImageHorizon(horizon[..., 0])
             # calculate the difference of the provided to the estimated horizon in y pixels
@@ -646,6 +1114,7 @@ class Camera(ClassWithParameterSet):
             self.log_prob.append(horizonInformation)
 
         def plotHorizonPoints(horizon=horizon, color=plot_color):
+            import matplotlib.pyplot as plt
             image_horizon = self.getImageHorizon(horizon[..., 0])
             if 0:
                 p, = plt.plot(image_horizon[..., 0], image_horizon[..., 1], "+", label="horizon fitted", color=color)
@@ -740,19 +1209,26 @@ class Camera(ClassWithParameterSet):
         Returns
         -------
         border : ndarray
-            the border of the image in **space** coordinates, dimensions (Nx3)
+            the border of the image in **image** coordinates, dimensions (Nx2)
         """
         w, h = self.projection.parameters.image_width_px, self.projection.parameters.image_height_px
-        border = []
-        for y in np.arange(0, h, resolution):
-            border.append([0, y])
-        for x in np.arange(0, w, resolution):
-            border.append([x, h])
-        for y in np.arange(h, 0, -resolution):
-            border.append([w, y])
-        for x in np.arange(w, 0, -resolution):
-            border.append([x, 0])
-        return np.array(border)
+        # the left, bottom, right and top edge of the image
+        y = np.arange(0, h, resolution)
+        x = np.arange(0, w, resolution)
+        y_back = np.arange(h, 0, -resolution)
+        x_back = np.arange(w, 0, -resolution)
+        return np.concatenate((np.array([np.zeros_like(y), y]).T,
+                               np.array([x, np.full_like(x, h)]).T,
+                               np.array([np.full_like(y_back, w), y_back]).T,
+                               np.array([x_back, np.zeros_like(x_back)]).T))
+
+    def _getGroundBorder(self, Z=0):
+        # the image border projected to the ground, cached as long as the camera parameters do not change
+        state = (Z,) + self._getParameterState()
+        if self.last_border is None or self.last_border_state != state:
+            self.last_border = self.spaceFromImage(self.getImageBorder(), Z=Z)
+            self.last_border_state = state
+        return self.last_border
 
     def getCameraCone(self, project_to_ground=False, D=1):
         """
@@ -766,44 +1242,32 @@ class Camera(ClassWithParameterSet):
         """
         w, h = self.projection.parameters.image_width_px, self.projection.parameters.image_height_px
         if project_to_ground:
-            border = []
-            corner_indices = [0]
-            for y in range(h):
-                border.append([0, y])
-            corner_indices.append(len(border))
-            for x in range(w):
-                border.append([x, h])
-            corner_indices.append(len(border))
-            for y in np.arange(h, 0, -1):
-                border.append([w, y])
-            corner_indices.append(len(border))
-            for x in np.arange(w, 0, -1):
-                border.append([x, 0])
-            corner_indices.append(len(border))
-            border = list(self.spaceFromImage(border, Z=0))
+            y = np.arange(h)
+            x = np.arange(w)
+            y_back = np.arange(h, 0, -1)
+            x_back = np.arange(w, 0, -1)
+            edges = [np.array([np.zeros_like(y), y]).T,
+                     np.array([x, np.full_like(x, h)]).T,
+                     np.array([np.full_like(y_back, w), y_back]).T,
+                     np.array([x_back, np.zeros_like(x_back)]).T]
+            # the corners are the start points of the edges (and the end of the border)
+            corner_indices = np.cumsum([0] + [len(edge) for edge in edges])
+            border = self.spaceFromImage(np.concatenate(edges), Z=0)
         else:
-            border = []
-            corner_indices = [0]
-            border.append([0, h])
-            corner_indices.append(len(border))
-            border.append([w, h])
-            corner_indices.append(len(border))
-            border.append([w, 0])
-            corner_indices.append(len(border))
-            border.append([0, 0])
-            corner_indices.append(len(border))
-            border.append([0, h])
-            corner_indices.append(len(border))
-            border = list(self.spaceFromImage(border, D=D))
+            corner_indices = np.arange(6)
+            border = self.spaceFromImage([[0, h], [w, h], [w, 0], [0, 0], [0, h]], D=D)
 
+        # add a line from the origin to every corner, separated by nan values (the last corner index refers to the
+        # first of these nan values)
         origin = self.orientation.spaceFromCamera([0, 0, 0])
-        for corner_index in corner_indices:
-            border.append([np.nan, np.nan, np.nan])
-            border.append(origin)
-            border.append(border[corner_index])
-        return np.array(border)
-
-    def imageFromSpace(self, points, hide_backpoints=True):
+        corners = np.vstack((border, [np.nan, np.nan, np.nan]))[corner_indices]
+        lines = np.zeros((len(corner_indices), 3, 3))
+        lines[:, 0] = np.nan
+        lines[:, 1] = origin
+        lines[:, 2] = corners
+        return np.vstack((border, lines.reshape(-1, 3)))
+
+    def imageFromSpace(self, points, hide_backpoints=True, clip_to_image=False):
         """
         Convert points (Nx3) from the **space** coordinate system to the **image** coordinate system.
 
@@ -811,6 +1275,11 @@ class Camera(ClassWithParameterSet):
         ----------
         points : ndarray
             the points in **space** coordinates to transform, dimensions (3), (Nx3)
+        hide_backpoints : bool, optional
+            whether to return nan for points behind the camera, default True
+        clip_to_image : bool, optional
+            whether to return nan for points which are not in the image, default False. Points outside of the field
+            of view of the camera are sorted out before projecting them, see :py:meth:`visible`.
 
         Returns
         -------
@@ -837,9 +1306,81 @@ class Camera(ClassWithParameterSet):
         """
         # ensure that the points are provided as an array
         points = np.array(points)
+        if clip_to_image:
+            return self._imageFromSpaceClipped(points)
         # project the points from the space to the camera and from the camera to the image
         return self.lens.distortedFromImage(self.projection.imageFromCamera(self.orientation.cameraFromSpace(points), hide_backpoints=hide_backpoints))
 
+    def _getFrustumPlanes(self):
+        # the normals of the planes through the camera position which enclose the field of view (pointing inwards),
+        # only for rectilinear projections, where the field of view is a pyramid
+        state = self._getParameterState()
+        if self.last_frustum_state != state:
+            self.last_frustum_state = state
+            self.last_frustum = None
+            if isinstance(self.projection, RectilinearProjection):
+                # the bounding box of the image border without the lens distortion, with a margin of a pixel
+                border = self.lens.imageFromDistorted(self.getImageBorder().astype(float))
+                x_min, y_min = np.min(border, axis=0) - 1
+                x_max, y_max = np.max(border, axis=0) + 1
+                corners = [[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]]
+                rays = self.orientation.spaceFromCamera(self.projection.getRay(corners), direction=True)
+                normals = np.cross(rays, np.roll(rays, -1, axis=0))
+                # the normals have to point towards the center of the field of view
+                normals *= np.sign(normals @ np.mean(rays, axis=0))[:, None]
+                if np.all(np.isfinite(normals)):
+                    self.last_frustum = normals
+        return self.last_frustum
+
+    def _imageFromSpaceClipped(self, points):
+        # the image points of the points in the image, nan for the other points
+        flat_points = points.reshape(-1, 3)
+        image_points = np.full((len(flat_points), 2), np.nan)
+        normals = self._getFrustumPlanes()
+        if normals is not None:
+            # a cheap test with the planes of the field of view, only the points inside are projected
+            with np.errstate(invalid="ignore"):
+                candidates = np.nonzero(np.all(flat_points @ normals.T >= self.orientation.t @ normals.T, axis=1))[0]
+            flat_points = flat_points[candidates]
+        else:
+            candidates = slice(None)
+        # points behind the camera stay nan, also with lens distortions that map nan values to the image center
+        projected = self.projection.imageFromCamera(self.orientation.cameraFromSpace(flat_points))
+        projected = np.where(np.isnan(projected), np.nan, self.lens.distortedFromImage(projected))
+        with np.errstate(invalid="ignore"):
+            inside = (projected[:, 0] >= 0) & (projected[:, 0] <= self.image_width_px) & \
+                     (projected[:, 1] >= 0) & (projected[:, 1] <= self.image_height_px)
+        image_points[candidates] = np.where(inside[:, None], projected, np.nan)
+        return image_points.reshape(points.shape[:-1] + (2,))
+
+    def visible(self, points):
+        """
+        Whether points (Nx3) in the **space** coordinate system are in the image of the camera. Only the points in the
+        field of view of the camera are projected to the image, points outside of it are sorted out with the planes
+        that enclose the field of view (for rectilinear projections). This is much faster if only a small part of the
+        points is visible.
+
+        Parameters
+        ----------
+        points : ndarray
+            the points in **space** coordinates, dimensions (3), (Nx3)
+
+        Returns
+        -------
+        visible : ndarray
+            whether the points are in the image (and in front of the camera), dimensions () or (N)
+
+        Examples
+        --------
+
+        >>> import cameratransform as ct
+        >>> cam = ct.Camera(ct.RectilinearProjection(focallength_px=3729, image=(4608, 2592)),
+        >>>                    ct.SpatialOrientation(elevation_m=15.4, tilt_deg=85))
+        >>> cam.visible([[-4.17, 45.32, 0.], [-4.17, -45.32, 0.]])
+        [ True False]
+        """
+        return ~np.isnan(self.imageFromSpace(points, clip_to_image=True)[..., 0])
+
     def getRay(self, points, normed=False):
         """
         As the transformation from the **image** coordinate system to the **space** coordinate system is not unique,
@@ -887,11 +1428,164 @@ class Camera(ClassWithParameterSet):
         offset = self.orientation.spaceFromCamera([0, 0, 0])
         # get the direction fo the ray from the points
         # the projection provides the ray in camera coordinates, which we convert to the space coordinates
-        direction = self.orientation.spaceFromCamera(self.projection.getRay(self.lens.imageFromDistorted(points), normed=normed), direction=True)
+        if self.ray_table_dtype is not None:
+            rays = self._getRayFromTable(points, normed=normed)
+        else:
+            rays = self.projection.getRay(self.lens.imageFromDistorted(points), normed=normed)
+        direction = self.orientation.spaceFromCamera(rays, direction=True)
         # return the offset point and the direction of the ray
         return offset, direction
 
-    def spaceFromImage(self, points, X=None, Y=None, Z=0, D=None, mesh=None):
+    def enableRayTable(self, dtype=np.float64, filename=None):
+        """
+        Use a table of the rays of all pixels of the image for :py:meth:`getRay` and therefore for
+        :py:meth:`spaceFromImage`. The rays of image points are then bilinearly interpolated from the table instead of
+        being calculated with the lens distortion and the projection. This is faster for cameras with lens distortion,
+        which has to be inverted numerically, and especially for integer pixel positions, which are taken from the table
+        without interpolation. Without lens distortion the direct calculation is already fast. The table holds the rays
+        in **camera** coordinates, it is built on the first use and rebuilt when the intrinsic or lens parameters of the
+        camera change, a change of the orientation does not require a new table. Points outside of the image are still
+        calculated directly.
+
+        For the :py:class:`RectilinearProjection` without lens distortion the interpolation is exact.
+
+        Parameters
+        ----------
+        dtype : dtype, optional
+            the data type of the table, e.g. np.float32 to half its size, default np.float64
+        filename : str, optional
+            a .npy file to store the table in as a memory mapped array, instead of keeping it in memory.
+        """
+        self.ray_table_dtype = np.dtype(dtype)
+        self.ray_table_filename = filename
+        self.ray_table = None
+        self.ray_table_state = None
+
+    def disableRayTable(self):
+        """
+        Calculate the rays of image points directly again and release the table of :py:meth:`enableRayTable`.
+        """
+        self.ray_table_dtype = None
+        self.ray_table_filename = None
+        self.ray_table = None
+        self.ray_table_state = None
+
+    def _getRayTable(self):
+        # the table only depends on the intrinsic and the lens parameters
+        state = (type(self.projection), type(self.lens)) + self.projection.parameters.get_state() + \
+                self.lens.parameters.get_state()
+        if self.ray_table is None or self.ray_table_state != state:
+            width, height = int(round(self.image_width_px)), int(round(self.image_height_px))
+            # the rays at the integer pixel positions, including the right and bottom border of the image
+            shape = (height + 1, width + 1, 3)
+            if self.ray_table_filename is not None:
+                table = np.lib.format.open_memmap(self.ray_table_filename, mode="w+", dtype=self.ray_table_dtype, shape=shape)
+            else:
+                table = np.empty(shape, dtype=self.ray_table_dtype)
+            x = np.arange(width + 1)
+            chunk_size = max(1, 2 ** 18 // len(x))
+            for start in range(0, height + 1, chunk_size):
+                y = np.arange(start, min(start + chunk_size, height + 1))
+                points = np.array(np.meshgrid(x, y)).transpose(1, 2, 0).reshape(-1, 2)
+                table[y[0]:y[-1] + 1] = self.projection.getRay(self.lens.imageFromDistorted(points)).reshape(len(y), len(x), 3)
+            self.ray_table = table
+            self.ray_table_state = state
+        return self.ray_table
+
+    def _getRayFromTable(self, points, normed=False):
+        table = self._getRayTable()
+        height, width = table.shape[0] - 1, table.shape[1] - 1
+        points = np.asarray(points, dtype=float)
+        flat = points.reshape(-1, 2)
+        x, y = flat[:, 0], flat[:, 1]
+        inside = (x >= 0) & (x <= width) & (y >= 0) & (y <= height)
+        all_inside = np.all(inside)
+        if not all_inside:
+            x, y = x[inside], y[inside]
+
+        table = table.reshape(-1, 3)
+        col = x.astype(int)
+        row = y.astype(int)
+        if np.array_equal(col, x) and np.array_equal(row, y):
+            # integer pixel positions can be taken directly from the table
+            rays_inside = table.take(row * (width + 1) + col, axis=0)
+        else:
+            # the index of the top left pixel in the flattened table and the position relative to it
+            col = np.minimum(col, width - 1)
+            row = np.minimum(row, height - 1)
+            index = row * (width + 1) + col
+            fx = (x - col).astype(table.dtype)[:, None]
+            fy = (y - row).astype(table.dtype)[:, None]
+            # bilinear interpolation between the four neighbouring pixels
+            top = table.take(index, axis=0)
+            top += (table.take(index + 1, axis=0) - top) * fx
+            bottom = table.take(index + width + 1, axis=0)
+            bottom += (table.take(index + width + 2, axis=0) - bottom) * fx
+            rays_inside = top + (bottom - top) * fy
+
+        if all_inside:
+            rays = rays_inside.astype(float)
+        else:
+            # points outside of the table are calculated directly
+            rays = np.empty((len(flat), 3))
+            rays[inside] = rays_inside
+            rays[~inside] = self.projection.getRay(self.lens.imageFromDistorted(flat[~inside]))
+        if normed:
+            rays /= np.linalg.norm(rays, axis=-1)[:, None]
+        return rays.reshape(points.shape[:-1] + (3,))
+
+    def _isUndistortedRectilinear(self):
+        # a rectilinear projection without lens distortion (or with all distortion coefficients being 0) maps planes
+        # in space to the image with a homography
+        # (the parameters of the lens also contain the intrinsic parameters it shares with the projection)
+        return isinstance(self.projection, RectilinearProjection) and \
+            all(getattr(self.lens.parameters, name) == 0 for name, parameter in self.lens.parameters.parameters.items()
+                if parameter.type == TYPE_DISTORTION)
+
+    def getGroundHomography(self, Z=0):
+        """
+        The homography H between the plane at the height Z in **space** coordinates and the **image**. A point (x, y)
+        on the plane is mapped to the image by H @ (x, y, 1), followed by the division by the third component, which
+        is positive for points in front of the camera. Only available for cameras with a
+        :py:class:`RectilinearProjection` without lens distortion, as only for these the mapping is exact.
+
+        Parameters
+        ----------
+        Z : number, optional
+            the height of the plane in **space** coordinates, default 0
+
+        Returns
+        -------
+        H : ndarray
+            the homography from homogeneous **space** coordinates (x, y, 1) of the plane to homogeneous **image**
+            coordinates, dimensions (3x3)
+
+        Examples
+        --------
+
+        >>> import cameratransform as ct
+        >>> cam = ct.Camera(ct.RectilinearProjection(focallength_px=3729, image=(4608, 2592)),
+        >>>                    ct.SpatialOrientation(elevation_m=15.4, tilt_deg=85))
+
+        project a point on the ground to the image:
+
+        >>> H = cam.getGroundHomography()
+        >>> p = H @ [-4.17, 45.32, 1]
+        >>> p[:2] / p[2]
+        [1969.52 2209.73]
+        """
+        if not self._isUndistortedRectilinear():
+            raise ValueError("The ground homography is only available for a RectilinearProjection without lens distortion.")
+        # the matrix mapping camera coordinates to homogeneous image coordinates
+        K = np.array([[self.projection.focallength_x_px, 0, -self.projection.center_x_px],
+                      [0, -self.projection.focallength_y_px, -self.projection.center_y_px],
+                      [0, 0, -1]])
+        # the points (x, y, Z) of the plane in camera coordinates: R @ (x, y, Z) - R @ t
+        R = self.orientation.R
+        M = np.array([R[:, 0], R[:, 1], R[:, 2] * Z - R @ self.orientation.t]).T
+        return K @ M
+
+    def spaceFromImage(self, points, X=None, Y=None, Z=0, D=None, mesh=None, dem=None):
         """
         Convert points (Nx2) from the **image** coordinate system to the **space** coordinate system. This is not a unique
         transformation, therefore an additional constraint has to be provided. The X, Y, or Z coordinate(s) of the target
@@ -909,9 +1603,13 @@ class Camera(ClassWithParameterSet):
             the Z coordinate in **space** coordinates of the target points, dimensions scalar, (N), default 0
         D : number, ndarray, optional
             the distance in **space** coordinates of the target points from the camera, dimensions scalar, (N)
-        mesh : ndarray, optional
+        mesh : ndarray, :py:class:`~cameratransform.ray.BoundingVolumeHierarchy`, optional
             project the image coordinates onto the mesh in **space** coordinates. The mesh is a list of M triangles,
-            consisting of three 3D points each. Dimensions, (3x3), (Mx3x3)
+            consisting of three 3D points each. Dimensions, (3x3), (Mx3x3). For large meshes, build a
+            :py:class:`~cameratransform.ray.BoundingVolumeHierarchy` of the mesh once and provide it instead.
+        dem : :py:class:`~cameratransform.HeightMap`, optional
+            project the image coordinates onto the terrain given by a digital elevation model.
+
         Returns
         -------
         points : ndarray
@@ -952,11 +1650,16 @@ class Camera(ClassWithParameterSet):
         >>> cam.spaceFromImage([[1968 , 2291], [1650, 2189]], Y=[43, 45])
         [[-3.98 43.00 -0.20]
          [-8.09 45.00 0.37]]
+
+        or project the points onto the terrain of a digital elevation model:
+
+        >>> dem = ct.HeightMap(heights, extent=[-500, 500, 0, 1000])
+        >>> cam.spaceFromImage([[1968 , 2291], [1650, 2189]], dem=dem)
         """
         # ensure that the points are provided as an array
         points = np.array(points)
         # get the index which coordinate to force to the given value
-        given = np.array([X, Y, Z])
+        given = [X, Y, Z]
         if X is not None:
             index = 0
         elif Y is not None:
@@ -968,7 +1671,30 @@ class Camera(ClassWithParameterSet):
         if mesh is not None:
             # get the rays from the image points
             offset, direction = self.getRay(points)
+            if isinstance(mesh, ray.BoundingVolumeHierarchy):
+                return mesh.intersect(offset, direction)
             return ray.ray_intersect_triangle(offset, direction, mesh)
+        # if a height map is provided, intersect the rays with the terrain
+        if dem is not None:
+            offset, direction = self.getRay(points)
+            return dem.intersect(offset, direction)
+        # points on a horizontal plane can be directly obtained with the inverse of the ground homography
+        if index == 2 and D is None and np.ndim(Z) == 0 and Z != self.orientation.t[2] and self._isUndistortedRectilinear():
+            # H = K @ R @ [e_x, e_y, w] with w = (0, 0, Z) - t, its inverse is multiplied with w_z, as this keeps it
+            # regular when the camera is close to the plane (the sign keeps the points in front of the camera positive)
+            w = np.array([0, 0, Z]) - self.orientation.t
+            B_inv = np.array([[w[2], 0, -w[0]], [0, w[2], -w[1]], [0, 0, 1]]) * np.sign(w[2])
+            K = np.array([[self.projection.focallength_x_px, 0, -self.projection.center_x_px],
+                          [0, -self.projection.focallength_y_px, -self.projection.center_y_px],
+                          [0, 0, -1]])
+            H_inv = B_inv @ self.orientation.R.T @ np.linalg.inv(K)
+            points = np.dot(points, H_inv[:, :2].T) + H_inv[:, 2]
+            # the third component is positive for points in front of the camera, the other points are ignored
+            w = points[..., 2:]
+            w[~(w > 0)] = np.nan
+            points[..., :2] /= w
+            points[..., 2:] = np.where(np.isnan(w), np.nan, Z)
+            return points
         # transform to a given distance
         if D is not None:
             # get the rays from the image points (in this case it has to be normed)
@@ -979,7 +1705,7 @@ class Camera(ClassWithParameterSet):
             # get the rays from the image points
             offset, direction = self.getRay(points)
             # solve the line equation for the factor (how many times the direction vector needs to be added to the origin point)
-            factor = (given[index] - offset[..., index]) / direction[..., index]
+            factor = (np.asarray(given[index]) - offset[..., index]) / direction[..., index]
 
         if not isinstance(factor, np.ndarray):
             # if factor is not an array, we don't need to specify the broadcasting
@@ -991,6 +1717,199 @@ class Camera(ClassWithParameterSet):
         points[factor < 0] = np.nan
         return points
 
+    def _getFrameParameters(self, frame_parameters):
+        # the parameters of every frame, parameters that are not given are taken from the camera
+        names = ["elevation_m", "tilt_deg", "roll_deg", "heading_deg", "pos_x_m", "pos_y_m", "focallength_x_px",
+                 "focallength_y_px"]
+        for name in frame_parameters:
+            if name not in names:
+                raise ValueError("The parameter %s can not be set per frame, use one of %s." % (name, ", ".join(names)))
+        values = np.broadcast_arrays(*[np.asarray(frame_parameters.get(name, getattr(self, name)), dtype=float)
+                                       for name in names])
+        if values[0].ndim != 1:
+            raise ValueError("The frame parameters have to be given as arrays with one value per frame.")
+        values = dict(zip(names, values))
+
+        # the rotation matrices and positions of all frames
+        R = rotationMatrix(values["tilt_deg"], values["roll_deg"], values["heading_deg"])
+        t = np.array([values["pos_x_m"], values["pos_y_m"], values["elevation_m"]]).T
+        # the zoom of every frame relative to the focal length of the camera
+        zoom = np.array([values["focallength_x_px"] / self.focallength_x_px,
+                         values["focallength_y_px"] / self.focallength_y_px]).T
+        return R, t, zoom
+
+    def imageFromSpaceFrames(self, points, hide_backpoints=True, **frame_parameters):
+        """
+        Convert points from the **space** coordinate system to the **image** coordinate system for multiple frames of a
+        camera which changes its orientation and focal length from frame to frame, e.g. a pan-tilt-zoom camera. The
+        parameters of all frames are given as arrays and all frames are projected at once, the parameters of the camera
+        are not changed.
+
+        A different focal length scales the undistorted image around the center of the image. Lens distortions that
+        are relative to the focal length (e.g. :py:class:`~cameratransform.BrownLensDistortion`) are scaled with it,
+        the others (e.g. :py:class:`~cameratransform.ABCDistortion`) are applied to the scaled image.
+
+        Parameters
+        ----------
+        points : ndarray
+            the points in **space** coordinates to transform, dimensions (Nx3) (the same points for every frame), (FxNx3)
+        hide_backpoints : bool, optional
+            whether to return nan for points behind the camera, default True
+        **frame_parameters : ndarray
+            the parameters for every frame, dimensions (F). Possible parameters are: elevation_m, tilt_deg, roll_deg,
+            heading_deg, pos_x_m, pos_y_m, focallength_x_px, focallength_y_px. Parameters which are not given are taken
+            from the camera.
+
+        Returns
+        -------
+        points : ndarray
+            the points in the **image** coordinate system, dimensions (FxNx2)
+
+        Examples
+        --------
+
+        >>> import cameratransform as ct
+        >>> cam = ct.Camera(ct.RectilinearProjection(focallength_px=3729, image=(4608, 2592)),
+        >>>                    ct.SpatialOrientation(elevation_m=15.4, tilt_deg=85))
+
+        project a point for three frames with different heading and focal length:
+
+        >>> cam.imageFromSpaceFrames([[-4.17, 45.32, 0.]], heading_deg=[0, 1, 2],
+        >>>                          focallength_x_px=[3729, 4000, 4500], focallength_y_px=[3729, 4000, 4500])
+        [[[1969.52 2209.73]]
+         [[1876.48 2278.41]]
+         [[1745.44 2404.22]]]
+        """
+        R, t, zoom = self._getFrameParameters(frame_parameters)
+        points = np.asarray(points, dtype=float)
+        points = np.broadcast_to(points, (len(R),) + points.shape[-2:])
+        # the points in the camera coordinates of every frame
+        points = np.einsum("fij,fnj->fni", R, points - t[:, None, :])
+        # project with the intrinsic parameters of the camera and scale with the zoom of the frame
+        center = np.array([self.center_x_px, self.center_y_px])
+        image = self.projection.imageFromCamera(points.reshape(-1, 3), hide_backpoints=hide_backpoints)
+        if self.lens.focallength_relative:
+            # the distortion scales with the focal length, the distorted image can be scaled
+            image = self.lens.distortedFromImage(image).reshape(points.shape[:2] + (2,))
+            return (image - center) * zoom[:, None, :] + center
+        # the distortion does not depend on the focal length, it is applied to the scaled image
+        image = (image.reshape(points.shape[:2] + (2,)) - center) * zoom[:, None, :] + center
+        return self.lens.distortedFromImage(image.reshape(-1, 2)).reshape(points.shape[:2] + (2,))
+
+    def getRayFrames(self, points, normed=False, **frame_parameters):
+        """
+        The rays of **image** points for multiple frames of a camera which changes its orientation and focal length from
+        frame to frame (see :py:meth:`imageFromSpaceFrames`).
+
+        Parameters
+        ----------
+        points : ndarray
+            the points in **image** coordinates for which to get the rays, dimensions (Nx2) (the same points for every
+            frame), (FxNx2)
+        normed : bool, optional
+            whether to norm the rays, default False
+        **frame_parameters : ndarray
+            the parameters for every frame, dimensions (F), see :py:meth:`imageFromSpaceFrames`.
+
+        Returns
+        -------
+        offset : ndarray
+            the origins of the camera in every frame in **space** coordinates, dimensions (Fx3)
+        rays : ndarray
+            the rays in the **space** coordinate system, dimensions (FxNx3)
+        """
+        R, t, zoom = self._getFrameParameters(frame_parameters)
+        points = np.asarray(points, dtype=float)
+        points = np.broadcast_to(points, (len(R),) + points.shape[-2:])
+        # undo the zoom of the frame to get the points in the image of the camera, before or after removing the lens
+        # distortion (see imageFromSpaceFrames)
+        center = np.array([self.center_x_px, self.center_y_px])
+        if self.lens.focallength_relative:
+            points = (points - center) / zoom[:, None, :] + center
+            points = self.lens.imageFromDistorted(points.reshape(-1, 2)).reshape(points.shape)
+        else:
+            points = self.lens.imageFromDistorted(points.reshape(-1, 2)).reshape(points.shape)
+            points = (points - center) / zoom[:, None, :] + center
+        rays = self.projection.getRay(points.reshape(-1, 2), normed=normed)
+        # rotate the rays from the camera coordinates of every frame to the space coordinates
+        direction = np.einsum("fji,fnj->fni", R, rays.reshape(points.shape[:2] + (3,)))
+        return t, direction
+
+    def spaceFromImageFrames(self, points, X=None, Y=None, Z=0, D=None, **frame_parameters):
+        """
+        Convert points from the **image** coordinate system to the **space** coordinate system for multiple frames of a
+        camera which changes its orientation and focal length from frame to frame, e.g. to project the detections of a
+        pan-tilt-zoom camera to the ground for a whole video at once (see :py:meth:`imageFromSpaceFrames`). As for
+        :py:meth:`spaceFromImage` one of the X, Y or Z coordinates or the distance D of the target points has to be
+        given.
+
+        Parameters
+        ----------
+        points : ndarray
+            the points in **image** coordinates to transform, dimensions (Nx2) (the same points for every frame), (FxNx2)
+        X : number, ndarray, optional
+            the X coordinate in **space** coordinates of the target points, dimensions scalar, (FxN)
+        Y : number, ndarray, optional
+            the Y coordinate in **space** coordinates of the target points, dimensions scalar, (FxN)
+        Z : number, ndarray, optional
+            the Z coordinate in **space** coordinates of the target points, dimensions scalar, (FxN), default 0
+        D : number, ndarray, optional
+            the distance in **space** coordinates of the target points from the camera, dimensions scalar, (FxN)
+        **frame_parameters : ndarray
+            the parameters for every frame, dimensions (F), see :py:meth:`imageFromSpaceFrames`.
+
+        Returns
+        -------
+        points : ndarray
+            the points in the **space** coordinate system, dimensions (FxNx3)
+
+        Examples
+        --------
+
+        >>> import cameratransform as ct
+        >>> cam = ct.Camera(ct.RectilinearProjection(focallength_px=3729, image=(4608, 2592)),
+        >>>                    ct.SpatialOrientation(elevation_m=15.4, tilt_deg=85))
+
+        project the detections of three frames to the ground:
+
+        >>> cam.spaceFromImageFrames([[[1969.52, 2209.73]], [[1876.48, 2278.41]], [[1745.44, 2404.22]]],
+        >>>                          heading_deg=[0, 1, 2], focallength_x_px=[3729, 4000, 4500],
+        >>>                          focallength_y_px=[3729, 4000, 4500])
+        [[[-4.17 45.32 0.00]]
+         [[-4.17 45.32 0.00]]
+         [[-4.17 45.32 0.00]]]
+        """
+        # get the index which coordinate to force to the given value
+        given = [X, Y, Z]
+        if X is not None:
+            index = 0
+        elif Y is not None:
+            index = 1
+        elif Z is not None:
+            index = 2
+
+        if D is not None:
+            # the factor of normed rays is the distance
+            offset, direction = self.getRayFrames(points, normed=True, **frame_parameters)
+            factor = np.broadcast_to(D, direction.shape[:2])
+        else:
+            offset, direction = self.getRayFrames(points, **frame_parameters)
+            # solve the line equation for the factor
+            with np.errstate(divide="ignore", invalid="ignore"):
+                factor = (np.asarray(given[index]) - offset[:, None, index]) / direction[..., index]
+        points = offset[:, None, :] + direction * factor[..., None]
+        # ignore points that are behind the camera
+        points[factor < 0] = np.nan
+        return points
+
+    def _getLocalFrame(self):
+        # the tangent plane at the gps position of the camera, only recreated when the position changes
+        gps0 = (self.gps_lat, self.gps_lon, self.elevation_m)
+        if self.local_frame is None or tuple(self.local_frame.gps0) != gps0 or \
+                self.local_frame.earth_model != self.earth_model:
+            self.local_frame = gps.LocalFrame(gps0, earth_model=self.earth_model)
+        return self.local_frame
+
     def gpsFromSpace(self, points):
         """
         Convert points (Nx3) from the **space** coordinate system to the **gps** coordinate system.
@@ -1005,7 +1924,7 @@ class Camera(ClassWithParameterSet):
         points : ndarray
             the points in the **gps** coordinate system, dimensions (3), (Nx3)
         """
-        return gps.gpsFromSpace(points, np.array([self.gps_lat, self.gps_lon, self.elevation_m]))
+        return self._getLocalFrame().gpsFromSpace(points)
 
     def spaceFromGPS(self, points):
         """
@@ -1021,7 +1940,7 @@ class Camera(ClassWithParameterSet):
         points : ndarray
             the points in the **space** coordinate system, dimensions (3), (Nx3)
         """
-        return gps.spaceFromGPS(points, np.array([self.gps_lat, self.gps_lon, self.elevation_m]))
+        return self._getLocalFrame().spaceFromGPS(points)
 
     def gpsFromImage(self, points, X=None, Y=None, Z=0, D=None):
         """
@@ -1095,7 +2014,8 @@ class Camera(ClassWithParameterSet):
         # if we have cached the map, use the cached map
         if self.map_undistort is not None and \
                 self.last_extent_undistort == extent and \
-                self.last_scaling_undistort == scaling:
+                self.last_scaling_undistort == scaling and \
+                self.last_state_undistort == self._getParameterState():
             return self.map_undistort
 
         # get a mesh grid
@@ -1113,6 +2033,7 @@ class Camera(ClassWithParameterSet):
 
         self.last_extent_undistort = extent
         self.last_scaling_undistort = scaling
+        self.last_state_undistort = self._getParameterState()
 
         # return the calculated map
         return self.map_undistort
@@ -1144,6 +2065,8 @@ class Camera(ClassWithParameterSet):
         image : ndarray
             the undistorted image
         """
+        import cv2
+        import matplotlib.pyplot as plt
         # check if the size of the image matches the size of the camera
         if not skip_size_check:
             assert image.shape[1] == self.image_width_px, "The with of the image (%d) does not match the image width of the camera (%d)" % (image.shape[1], self.image_width_px)
@@ -1164,50 +2087,238 @@ class Camera(ClassWithParameterSet):
             plt.imshow(image, extent=extent, alpha=alpha)
         return image
 
-    def _getMap(self, extent=None, scaling=None, Z=0):
-        # if no extent is given, take the maximum extent from the image border
+    def _getTopViewExtent(self, extent=None, scaling=None, Z=0):
+        # if no extent is given, take the maximum extent from the image border (on the plane Z=0 for terrain heights)
         if extent is None:
-            border = self.getImageBorder()
+            border = self._getGroundBorder(Z if np.ndim(Z) == 0 and not isinstance(Z, HeightMap) else 0)
             extent = [np.nanmin(border[:, 0]), np.nanmax(border[:, 0]),
                       np.nanmin(border[:, 1]), np.nanmax(border[:, 1])]
 
-        # if we have cached the map, use the cached map
-        if self.map is not None and \
-                all(self.last_extent == np.array(extent)) and \
-                (self.last_scaling == scaling):
-            return self.map
-
         # if no scaling is given, scale so that the resulting image has an equal amount of pixels as the original image
         if scaling is None:
             scaling = np.sqrt((extent[1] - extent[0]) * (extent[3] - extent[2])) / \
                       np.sqrt((self.projection.parameters.image_width_px * self.projection.parameters.image_height_px))
 
-        # get a mesh grid
-        mesh = np.array(np.meshgrid(np.arange(extent[0], extent[1], scaling),
-                                    np.arange(extent[2], extent[3], scaling)))
-
-        # convert it to a list of points Nx2
-        mesh_points = mesh.reshape(2, mesh.shape[1] * mesh.shape[2]).T
-        mesh_points = np.hstack((mesh_points, Z*np.ones((mesh_points.shape[0], 1))))
+        # align the grid to multiples of the scaling, so that the grids of overlapping extents share their points
+        extent = [np.round(extent[0] / scaling) * scaling, extent[1], np.round(extent[2] / scaling) * scaling, extent[3]]
+        return extent, scaling
 
+    def _projectGrid(self, rows, columns, x0, top, scaling, Z):
+        # the image positions of the given (broadcastable) rows and columns of a top view grid, dimensions (2x...)
+        points = np.empty(np.broadcast(rows, columns).shape + (3,))
+        points[..., 0] = (x0 + columns) * scaling
+        points[..., 1] = (top - rows) * scaling
+        points[..., 2] = self._getGridHeights(Z, rows, columns, x0, top, scaling)
         # transform the space points to the image
-        mesh_points_shape = self.imageFromSpace(mesh_points)
+        return self.imageFromSpace(points.reshape(-1, 3)).T.reshape((2,) + points.shape[:-1])
+
+    def _getTopViewGrid(self, extent, scaling):
+        # the grid points are integer multiples of the scaling, the first row of the map has the largest y coordinate
+        x0 = int(np.round(extent[0] / scaling))
+        width = max(int(np.ceil((extent[1] - extent[0]) / scaling)), 0)
+        height = max(int(np.ceil((extent[3] - extent[2]) / scaling)), 0)
+        top = int(np.round(extent[2] / scaling)) + height - 1
+        return x0, top, width, height
+
+    def _getGridHeights(self, Z, rows, columns, x0, top, scaling):
+        # the heights of the points of a top view grid, given by their (broadcastable) rows and columns
+        if isinstance(Z, HeightMap):
+            if rows.shape[-1:] == (1,) and columns.shape[:1] == (1,):
+                # a block of the grid
+                return Z.getHeightGrid((x0 + columns[0]) * scaling, (top - rows[:, 0]) * scaling)
+            return Z._getHeight((x0 + columns) * scaling, (top - rows) * scaling)
+        if np.ndim(Z) == 2:
+            # a raster aligned with the grid, fractional rows and columns use the nearest cell
+            rows = np.clip(np.round(rows).astype(int), 0, Z.shape[0] - 1)
+            columns = np.clip(np.round(columns).astype(int), 0, Z.shape[1] - 1)
+            return Z[rows, columns]
+        return float(Z)
 
-        # reshape the map and cache it
-        self.map = mesh_points_shape.T.reshape(mesh.shape).astype(np.float32)[:, ::-1, :]
+    def _getMap(self, extent=None, scaling=None, Z=0):
+        extent, scaling = self._getTopViewExtent(extent, scaling, Z)
+        x0, top, width, height = self._getTopViewGrid(extent, scaling)
+        if np.ndim(Z) == 2:
+            Z = np.array(Z, dtype=np.float32)
+            if Z.shape != (height, width):
+                raise ValueError("The raster of Z values has to have the shape of the top view %s, not %s." %
+                                 (str((height, width)), str(Z.shape)))
+
+        # the cached map can be used if the heights of the grid points did not change
+        cached = self.map is not None and \
+            (self.last_scaling == scaling) and \
+            (self.last_state == self._getParameterState())
+        if isinstance(Z, HeightMap) or isinstance(self.last_Z, HeightMap):
+            # height maps are compared by identity, their version tells whether the heights have been updated
+            same_heights = Z is self.last_Z and Z.version == self.last_Z_version
+        elif np.ndim(Z) == 0 and np.ndim(self.last_Z) == 0:
+            same_heights = Z == self.last_Z
+        else:
+            # rasters are compared point by point
+            same_heights = None
+        if cached and same_heights and all(self.last_extent == np.array(extent)):
+            return self.map
+
+        new_map = np.zeros((2, height, width), dtype=np.float32)
+
+        def project(rows, columns):
+            return self._projectGrid(rows, columns, x0, top, scaling, Z)
+
+        def projectBlock(rows, columns):
+            if rows[0] < rows[1] and columns[0] < columns[1]:
+                new_map[:, rows[0]:rows[1], columns[0]:columns[1]] = \
+                    project(np.arange(*rows)[:, None], np.arange(*columns)[None, :])
+
+        # the rows and columns of the map that are already in the cached map (e.g. when the extent is panned)
+        row_start = row_end = column_start = column_end = 0
+        if cached and same_heights is not False:
+            row_offset = int(np.round(self.last_extent[2] / scaling)) + self.map.shape[1] - 1 - top
+            column_offset = x0 - int(np.round(self.last_extent[0] / scaling))
+            row_start, row_end = max(0, -row_offset), min(height, self.map.shape[1] - row_offset)
+            column_start, column_end = max(0, -column_offset), min(width, self.map.shape[2] - column_offset)
+        if row_start < row_end and column_start < column_end:
+            # copy the overlap and only project the newly exposed strips
+            new_map[:, row_start:row_end, column_start:column_end] = \
+                self.map[:, row_start + row_offset:row_end + row_offset, column_start + column_offset:column_end + column_offset]
+            projectBlock((0, row_start), (0, width))
+            projectBlock((row_end, height), (0, width))
+            projectBlock((row_start, row_end), (0, column_start))
+            projectBlock((row_start, row_end), (column_end, width))
+            if same_heights is None:
+                # and the points of the overlap with a different height
+                heights = np.broadcast_to(Z, (height, width))[row_start:row_end, column_start:column_end]
+                last_heights = np.broadcast_to(self.last_Z, self.map.shape[1:])[row_start + row_offset:row_end + row_offset,
+                                                                                 column_start + column_offset:column_end + column_offset]
+                rows, columns = np.nonzero(heights != last_heights)
+                if len(rows):
+                    new_map[:, rows + row_start, columns + column_start] = project(rows + row_start, columns + column_start)
+        else:
+            projectBlock((0, height), (0, width))
 
+        # cache the map
+        self.map = new_map
         self.last_extent = extent
         self.last_scaling = scaling
+        self.last_Z = Z
+        self.last_Z_version = getattr(Z, "version", None)
+        self.last_state = self._getParameterState()
 
         # return the calculated map
         return self.map
 
-    def getTopViewOfImage(self, image, extent=None, scaling=None, do_plot=False, alpha=None, Z=0., skip_size_check=False):
+    def viewshed(self, dem, extent=None, scaling=None, chunk_size=2**22):
+        """
+        The visibility of the cells of a top view grid on the terrain of a digital elevation model: a cell is visible
+        if it is in the field of view of the camera and the line of sight from the camera to the cell is not blocked
+        by the terrain. The grid is the same as for :py:meth:`getTopViewOfImage`, so the result can be used as a mask
+        of a top view. The result is cached as long as the camera parameters, the grid and the height map do not
+        change (heights modified in place have to be announced with :py:meth:`~cameratransform.HeightMap.update`).
+
+        The occlusion is calculated with a radial sweep: the terrain is sampled on rays starting below the camera with
+        a step of half a cell of the height map. The maximal elevation angle of the terrain along the rays is the
+        horizon of the camera and a cell is visible if it is above the horizon of the samples in front of it.
+
+        Parameters
+        ----------
+        dem : :py:class:`~cameratransform.HeightMap`
+            the terrain.
+        extent : list, optional
+            the extent of the grid in m: [x_min, x_max, y_min, y_max], see :py:meth:`getTopViewOfImage`.
+        scaling : number, optional
+            the side length of the cells of the grid in m, see :py:meth:`getTopViewOfImage`.
+        chunk_size : int, optional
+            the number of terrain samples to process at once, to limit the memory usage.
+
+        Returns
+        -------
+        visible : ndarray
+            whether the cells are visible for the camera, the first row has the largest y coordinate, dimensions (HxW)
+
+        Examples
+        --------
+
+        >>> import cameratransform as ct
+        >>> cam = ct.Camera(ct.RectilinearProjection(focallength_px=3729, image=(4608, 2592)),
+        >>>                    ct.SpatialOrientation(elevation_m=15.4, tilt_deg=85))
+        >>> dem = ct.HeightMap("terrain.npy", extent=[-500, 500, 0, 1000])
+
+        the visible cells in front of the camera:
+
+        >>> visible = cam.viewshed(dem, [-50, 50, 0, 100], scaling=0.5)
+
+        or project the image on the terrain and hide the occluded cells:
+
+        >>> top_view = cam.getTopViewOfImage(image, [-50, 50, 0, 100], scaling=0.5, Z=dem, hide_occluded=True)
+        """
+        extent, scaling = self._getTopViewExtent(extent, scaling, dem)
+        # the height map is compared by identity and by its version, which is increased when its heights are updated
+        state = (tuple(extent), scaling, dem, dem.version) + self._getParameterState()
+        if self.last_viewshed_state == state:
+            return self.last_viewshed
+
+        x0, top, width, height = self._getTopViewGrid(extent, scaling)
+        x = (x0 + np.arange(width)) * scaling
+        y = (top - np.arange(height)) * scaling
+        heights = dem.getHeightGrid(x, y)
+        origin = self.orientation.t
+
+        # the rays of the sweep start below the camera and are sampled with half the cell size of the height map
+        step = 0.5 * min(dem.cell_x, dem.cell_y)
+        corners = np.array([[x[0], y[0]], [x[0], y[-1]], [x[-1], y[0]], [x[-1], y[-1]]]) if width and height else origin[None, :2]
+        radius_max = np.max(np.linalg.norm(corners - origin[:2], axis=1)) + scaling
+        radii = np.arange(1, int(np.ceil(radius_max / step)) + 2) * step
+        # neighbouring rays are at most one step apart
+        ray_count = max(int(np.ceil(2 * np.pi * radius_max / step)), 4)
+
+        # the ray and the position on the ray of the cells
+        dx, dy = x[None, :] - origin[0], y[:, None] - origin[1]
+        ray_index = np.round(np.arctan2(dy, dx) / (2 * np.pi) * ray_count).astype(int) % ray_count
+        position = np.hypot(dx, dy) / step - 1
+        sample_index = np.floor(position).astype(int)
+        fraction = position - sample_index
+        # cells closer than a step to the camera are not occluded
+        visible = sample_index < 1
+
+        rays_per_chunk = max(chunk_size // len(radii), 1)
+        for start in range(0, ray_count, rays_per_chunk):
+            angles = np.arange(start, min(start + rays_per_chunk, ray_count)) * 2 * np.pi / ray_count
+            terrain = dem._getHeight(origin[0] + np.cos(angles)[:, None] * radii, origin[1] + np.sin(angles)[:, None] * radii)
+            # the elevation angle (as a slope) of the terrain seen from the camera, outside of the terrain nothing occludes
+            slope = np.nan_to_num((terrain - origin[2]) / radii, nan=-np.inf)
+            horizon = np.maximum.accumulate(slope, axis=1)
+            index = np.where(~visible & (ray_index >= start) & (ray_index < start + len(angles)))
+            ray, sample, f = ray_index[index] - start, sample_index[index], fraction[index]
+            # the slope of the cell on its ray compared to the horizon of the samples at least a step in front of it
+            with np.errstate(invalid="ignore"):
+                cell_slope = slope[ray, sample] * (1 - f) + slope[ray, sample + 1] * f
+            visible[index] = cell_slope >= horizon[ray, sample - 1]
+
+        # the cells also have to be on the terrain and in the field of view of the camera
+        visible &= ~np.isnan(heights)
+        rows_per_chunk = max(chunk_size // max(width, 1), 1)
+        for start in range(0, height, rows_per_chunk):
+            points = np.empty((min(rows_per_chunk, height - start), width, 3))
+            points[..., 0] = x
+            points[..., 1] = y[start:start + rows_per_chunk, None]
+            points[..., 2] = heights[start:start + rows_per_chunk]
+            image_points = self.imageFromSpace(points.reshape(-1, 3)).reshape(points.shape[:2] + (2,))
+            with np.errstate(invalid="ignore"):
+                visible[start:start + rows_per_chunk] &= (image_points[..., 0] >= 0) & (image_points[..., 0] <= self.image_width_px) & \
+                                                         (image_points[..., 1] >= 0) & (image_points[..., 1] <= self.image_height_px)
+
+        self.last_viewshed = visible
+        self.last_viewshed_state = state
+        return visible
+
+    def getTopViewOfImage(self, image, extent=None, scaling=None, do_plot=False, alpha=None, Z=0., skip_size_check=False,
+                          hide_occluded=False):
         """
         Project an image to a top view projection. This will be done using a grid with the dimensions of the extent
         ([x_min, x_max, y_min, y_max]) in meters and the scaling, giving a resolution. For convenience, the image can
         be plotted directly. The projected grid is cached, so if the function is called a second time with the same
-        parameters, the second call will be faster.
+        parameters, the second call will be faster. When only the extent changes (e.g. when panning the top view),
+        only the part of the grid that is not covered by the cached grid is projected. For a
+        :py:class:`RectilinearProjection` without lens distortion the image is directly warped with the ground
+        homography (see :py:meth:`getGroundHomography`) and no grid is stored.
 
         Parameters
         ----------
@@ -1216,6 +2327,7 @@ class Camera(ClassWithParameterSet):
         extent : list, optional
             the extent of the resulting top view in meters: [x_min, x_max, y_min, y_max]. If no extent is given a suitable
             extent is guessed. If a horizon is visible in the image, the guessed extent will in most cases be too streched.
+            x_min and y_min are rounded to multiples of the scaling.
         scaling : number, optional
             the scaling factor, how many meters is the side length of each pixel in the top view. If no scaling factor is
             given, a good scaling factor is guessed, trying to get about the same number of pixels in the top view as in
@@ -1224,35 +2336,61 @@ class Camera(ClassWithParameterSet):
             whether to directly plot the resulting image in a matplotlib figure.
         alpha : number, optional
             an alpha value used when plotting the image. Useful if multiple images should be overlaid.
-        Z : number, optional
-            the "height" of the plane on which to project.
+        Z : number, ndarray, :py:class:`~cameratransform.HeightMap`, optional
+            the "height" of the plane on which to project. For a terrain, the heights can be given as a raster with the
+            shape of the top view (the first row having the largest y coordinate) or as a height map, which is sampled
+            at the pixels of the top view.
         skip_size_check : bool, optional
             if true, the size of the image is not checked to match the size of the cameras image.
+        hide_occluded : bool, optional
+            if true, the parts of the terrain that are hidden from the camera by the terrain are removed, see
+            :py:meth:`viewshed`. Only possible if Z is a :py:class:`~cameratransform.HeightMap`.
 
         Returns
         -------
         image : ndarray
             the top view projected image
         """
+        import cv2
+        import matplotlib.pyplot as plt
+        if hide_occluded and not isinstance(Z, HeightMap):
+            raise ValueError("Hiding occluded parts of the top view requires a HeightMap as Z.")
         # check if the size of the image matches the size of the camera
         if not skip_size_check:
             assert image.shape[1] == self.image_width_px, "The with of the image (%d) does not match the image width of the camera (%d)" % (image.shape[1], self.image_width_px)
             assert image.shape[0] == self.image_height_px, "The height of the image (%d) does not match the image height of the camera (%d)." % (image.shape[0], self.image_height_px)
-        # get the mapping
-        x, y = self._getMap(extent=extent, scaling=scaling, Z=Z)
+        extent, scaling = self._getTopViewExtent(extent, scaling, Z)
         # ensure that the image has an alpha channel (to enable alpha for the points outside the image)
         if len(image.shape) == 2:
             pass
         elif image.shape[2] == 3:
             image = np.dstack((image, np.ones(shape=(image.shape[0], image.shape[1], 1), dtype="uint8") * 255))
-        image = cv2.remap(image, x, y,
-                          interpolation=cv2.INTER_NEAREST,
-                          borderValue=[0, 1, 0, 0])  # , borderMode=cv2.BORDER_TRANSPARENT)
+        if self._isUndistortedRectilinear() and np.ndim(Z) == 0 and not isinstance(Z, HeightMap):
+            # the pixel positions of the top view (the first row has the largest y coordinate)
+            x = np.arange(extent[0], extent[1], scaling)
+            y = np.arange(extent[2], extent[3], scaling)
+            # the matrix from the pixels of the top view to the plane and from the plane to the image
+            M = self.getGroundHomography(Z) @ np.array([[scaling, 0, x[0]], [0, -scaling, y[-1]], [0, 0, 1]])
+            image_top = cv2.warpPerspective(image, M, (len(x), len(y)),
+                                            flags=cv2.INTER_NEAREST | cv2.WARP_INVERSE_MAP,
+                                            borderValue=[0, 1, 0, 0])
+            # the homography also maps points behind the camera to the image, these have to be removed
+            behind = M[2, 0] * np.arange(len(x))[None, :] + M[2, 1] * np.arange(len(y))[:, None] + M[2, 2] <= 0
+            image_top[behind] = 0 if len(image_top.shape) == 2 else [0, 1, 0, 0][:image_top.shape[2]]
+            image = image_top
+        else:
+            # get the mapping
+            x, y = self._getMap(extent=extent, scaling=scaling, Z=Z)
+            image = cv2.remap(image, x, y,
+                              interpolation=cv2.INTER_NEAREST,
+                              borderValue=[0, 1, 0, 0])  # , borderMode=cv2.BORDER_TRANSPARENT)
+        if hide_occluded:
+            image[~self.viewshed(Z, extent, scaling)] = 0 if len(image.shape) == 2 else [0, 1, 0, 0][:image.shape[2]]
         if do_plot:
-            plt.imshow(image, extent=self.last_extent, alpha=alpha)
+            plt.imshow(image, extent=extent, alpha=alpha)
         return image
 
-    def generateLUT(self, undef_value=0, whole_image=False):
+    def generateLUT(self, undef_value=0, whole_image=False, method="corners", chunk_size=None, out=None):
         """
         Generate LUT to calculate area covered by one pixel in the image dependent on y position in the image
 
@@ -1262,42 +2400,71 @@ class Camera(ClassWithParameterSet):
             what values undefined positions should have, default=0
         whole_image : bool, optional
             whether to generate the look up table for the whole image or just for a y slice
+        method : str, optional
+            "corners" (default) projects the corners of the pixels to the ground and calculates the area of the
+            resulting quadrilaterals, "jacobian" calculates the area from the derivatives of the rays of the pixels.
+        chunk_size : int, optional
+            the number of image rows to process at once, default: rows with about 250000 pixels.
+        out : ndarray, optional
+            an array (e.g. a memory mapped array) to store the result in, dimensions (HxW) or (H).
 
         Returns
         -------
         LUT: ndarray
-            same length as image height
+            same length as image height, or the same dimensions as the image (HxW) for whole_image. The area in m² as
+            float32 values.
         """
+        if method not in ["corners", "jacobian"]:
+            raise ValueError("Unknown method %s, use either 'corners' or 'jacobian'." % method)
 
-        def get_square(points):
-            p0 = points + np.array([-0.5, -0.5])
-            p1 = points + np.array([+0.5, -0.5])
-            p2 = points + np.array([+0.5, +0.5])
-            p3 = points + np.array([-0.5, +0.5])
-            squares = np.array([p0, p1, p2, p3])
-
-            if len(squares.shape) == 3:
-                return squares.transpose(1, 0, 2)
-            return squares
-
+        # the x positions of the pixel corners, the corners are shared by the neighbouring pixels
         if whole_image:
-            x = np.arange(0, self.image_width_px)
-            y = np.arange(0, self.image_height_px)
-            xv, yv = np.meshgrid(x, y)
-            points = np.array([xv.flatten(), yv.flatten()]).T
+            x = np.arange(0, self.image_width_px + 1) - 0.5
         else:
-            y = np.arange(self.image_height_px)
-            x = self.image_width_px / 2 * np.ones(len(y))
-            points = np.array([x, y]).T
-
-        squares = get_square(points).reshape(-1, 2)
-        squares_space = self.spaceFromImage(squares, Z=0).reshape(-1, 4, 3)
-        A = ray.areaOfQuadrilateral(squares_space)
-
-        if whole_image:
-            A = A.reshape(self.image_height_px, self.image_width_px)
-        A[np.isnan(A)] = undef_value
-        return A
+            x = self.image_width_px / 2 + np.array([-0.5, 0.5])
+        if chunk_size is None:
+            chunk_size = max(1, 2 ** 18 // len(x))
+        if out is None:
+            out = np.zeros((self.image_height_px, self.image_width_px) if whole_image else self.image_height_px,
+                           dtype=np.float32)
+        # a view on the output with one column per pixel of the grid
+        out_rows = out.reshape(self.image_height_px, len(x) - 1)
+
+        for start in range(0, self.image_height_px, chunk_size):
+            end = min(start + chunk_size, self.image_height_px)
+            # the grid of the corners of the pixels of the rows in this chunk
+            y = np.arange(start, end + 1) - 0.5
+            corners = np.array(np.meshgrid(x, y)).transpose(1, 2, 0).reshape(-1, 2)
+
+            if method == "corners":
+                corners_space = self.spaceFromImage(corners, Z=0).reshape(len(y), len(x), 3)
+                # the corners of each pixel, in the order of ray.areaOfQuadrilateral
+                quadrilaterals = np.stack((corners_space[:-1, :-1, :2], corners_space[:-1, 1:, :2],
+                                           corners_space[1:, 1:, :2], corners_space[1:, :-1, :2]), axis=-2)
+                area = ray.areaOfQuadrilateral(quadrilaterals)
+            else:
+                origin, direction = self.getRay(corners)
+                direction = direction.reshape(len(y), len(x), 3)
+                # the ray through the center of the pixel and its derivatives in x and y direction
+                center = 0.25 * (direction[:-1, :-1] + direction[:-1, 1:] + direction[1:, :-1] + direction[1:, 1:])
+                d_x = 0.5 * (direction[:-1, 1:] - direction[:-1, :-1] + direction[1:, 1:] - direction[1:, :-1])
+                d_y = 0.5 * (direction[1:, :-1] - direction[:-1, :-1] + direction[1:, 1:] - direction[:-1, 1:])
+                area = self._getGroundAreaOfRays(origin, center, d_x, d_y, Z=0)
+
+            out_rows[start:end] = np.where(np.isnan(area), undef_value, area)
+
+        return out
+
+    def _getGroundAreaOfRays(self, origin, direction, direction_dx, direction_dy, Z=0):
+        # the area of the ground (at height Z) covered by a pixel, given the ray of the pixel and its derivatives.
+        # The ground point is P = origin + t * direction with t = (Z - origin_z) / direction_z, the area element
+        # |dP/dx x dP/dy| then simplifies to t^2 |direction . (direction_dx x direction_dy)| / |direction_z|
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = (Z - origin[..., 2]) / direction[..., 2]
+            area = t ** 2 * np.abs(ray.my_inner(direction, np.cross(direction_dx, direction_dy))) / np.abs(direction[..., 2])
+        # points behind the camera are not on the ground
+        area[~(t > 0)] = np.nan
+        return area
 
     def rotateSpace(self, delta_heading):
         """
@@ -1326,6 +2493,7 @@ class Camera(ClassWithParameterSet):
         """
         keys = self.parameters.parameters.keys()
         export_dict = {key: getattr(self, key) for key in keys}
+        export_dict["earth_model"] = self.earth_model
 
         # check projections and save
         if isinstance(self.projection, RectilinearProjection):
@@ -1342,6 +2510,8 @@ class Camera(ClassWithParameterSet):
             export_dict["lens"] = ABCDDISTORTION
         elif isinstance(self.lens, BrownLensDistortion):
             export_dict["lens"] = BROWNLENSDISTORTION
+        elif isinstance(self.lens, OpenCVLensDistortion):
+            export_dict["lens"] = OPENCVLENSDISTORTION
 
         with open(filename, "w") as fp:
             fp.write(json.dumps(export_dict, indent=4))
@@ -1358,7 +2528,9 @@ class Camera(ClassWithParameterSet):
         with open(filename, "r") as fp:
             variables = json.loads(fp.read())
 
+        reinit_parameters = False
         if "projection" in variables.keys():
+            reinit_parameters = True
             if variables["projection"] == RECTILINEAR:
                 self.projection = RectilinearProjection()
             elif variables["projection"] == CYLINDRICAL:
@@ -1368,14 +2540,21 @@ class Camera(ClassWithParameterSet):
             variables.pop("projection")
 
         if "lens" in variables.keys():
+            reinit_parameters = True
             if variables["lens"] == NODISTORTION:
                 self.lens = NoDistortion()
             elif variables["lens"] == ABCDDISTORTION:
                 self.lens = ABCDistortion()
             elif variables["lens"] == BROWNLENSDISTORTION:
                 self.lens = BrownLensDistortion()
+            elif variables["lens"] == OPENCVLENSDISTORTION:
+                self.lens = OpenCVLensDistortion()
             variables.pop("lens")
 
+        # the new projection or lens objects have to be linked to the parameters of the camera
+        if reinit_parameters:
+            self._initParameters()
+
         for key in variables:
             setattr(self, key, variables[key])
 
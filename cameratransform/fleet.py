@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# fleet.py
+
+# Copyright (c) 2017-2019, Richard Gerum
+#
+# This file is part of the cameratransform package.
+#
+# cameratransform is free software: you can redistribute it and/or modify
+# it under the terms of the MIT licence.
+#
+# cameratransform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the license
+# along with cameratransform. If not, see <https://opensource.org/licenses/MIT>
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+def getCoverage(cameras, extent, scaling, Z=0, tile_size=512, executor=None):
+    """
+    The coverage of the ground by a group of cameras which share the same **space** coordinate system (e.g. cameras
+    with the same gps reference position). For every cell of a top view grid (see
+    :py:meth:`~cameratransform.Camera.getTopViewOfImage`), the number of cameras that see the cell, the best
+    resolution in m per pixel and the camera providing it are calculated. The resolution is the square root of the
+    ground area of the pixel in which the cell is seen (as in :py:meth:`~cameratransform.Camera.generateLUT`), on a
+    horizontal plane at the height of the cell.
+
+    The grid is processed in tiles on a thread pool.
+
+    Parameters
+    ----------
+    cameras : list of :py:class:`~cameratransform.Camera`
+        the cameras.
+    extent : list
+        the extent of the grid in m: [x_min, x_max, y_min, y_max].
+    scaling : number
+        the side length of the cells of the grid in m.
+    Z : number, ndarray, :py:class:`~cameratransform.HeightMap`, optional
+        the height of the ground plane or the terrain, see :py:meth:`~cameratransform.Camera.getTopViewOfImage`,
+        default 0
+    tile_size : int, optional
+        the side length of the tiles in cells, default 512
+    executor : :py:class:`concurrent.futures.Executor`, optional
+        the executor to process the tiles. Default: a thread pool for this call.
+
+    Returns
+    -------
+    count : ndarray
+        the number of cameras that see the cells, the first row has the largest y coordinate, dimensions (HxW)
+    resolution : ndarray
+        the best resolution of the cells in m per pixel, nan for cells not seen by any camera, dimensions (HxW)
+    camera_index : ndarray
+        the index of the camera with the best resolution, -1 for cells not seen by any camera, dimensions (HxW)
+
+    Examples
+    --------
+
+    >>> import cameratransform as ct
+    >>> cameras = [ct.Camera(ct.RectilinearProjection(focallength_px=3729, image=(4608, 2592)),
+    >>>                      ct.SpatialOrientation(elevation_m=15.4, tilt_deg=85, pos_x_m=x)) for x in [-50, 0, 50]]
+
+    the coverage in front of the cameras with a cell size of 1 m:
+
+    >>> count, resolution, camera_index = ct.getCoverage(cameras, [-200, 200, 0, 400], scaling=1)
+    """
+    camera = cameras[0]
+    x0, top, width, height = camera._getTopViewGrid(extent, scaling)
+    count = np.zeros((height, width), dtype=np.int32)
+    resolution = np.full((height, width), np.nan, dtype=np.float32)
+    camera_index = np.full((height, width), -1, dtype=np.int32)
+
+    def processTile(row, column):
+        # the points of the tile, the tiles do not overlap, so they can be written to the result directly
+        rows = np.arange(row, min(row + tile_size, height))
+        columns = np.arange(column, min(column + tile_size, width))
+        points = np.empty((len(rows), len(columns), 3))
+        points[..., 0] = (x0 + columns) * scaling
+        points[..., 1] = (top - rows[:, None]) * scaling
+        points[..., 2] = camera._getGridHeights(Z, rows[:, None], columns[None, :], x0, top, scaling)
+        tile = (slice(rows[0], rows[-1] + 1), slice(columns[0], columns[-1] + 1))
+        count[tile], resolution[tile], camera_index[tile] = \
+            [value.reshape(points.shape[:2]) for value in _getCoverageOfPoints(cameras, points.reshape(-1, 3))]
+
+    tiles = [(row, column) for row in range(0, height, tile_size) for column in range(0, width, tile_size)]
+    if executor is None:
+        with ThreadPoolExecutor() as executor:
+            list(executor.map(lambda tile: processTile(*tile), tiles))
+    else:
+        # wait for all tiles and raise the errors of the tiles
+        for future in [executor.submit(processTile, *tile) for tile in tiles]:
+            future.result()
+    return count, resolution, camera_index
+
+
+def _getCoverageOfPoints(cameras, points):
+    # the number of cameras seeing the points, the best resolution and the camera with the best resolution
+    count = np.zeros(len(points), dtype=np.int32)
+    resolution = np.full(len(points), np.inf)
+    camera_index = np.full(len(points), -1, dtype=np.int32)
+    for index, camera in enumerate(cameras):
+        # the clipped projection keeps the points behind the camera nan, also with lens distortions
+        image_points = camera.imageFromSpace(points, clip_to_image=True)
+        inside = np.nonzero(~np.isnan(image_points[:, 0]))[0]
+        if len(inside) == 0:
+            continue
+        count[inside] += 1
+
+        # the ray of the pixel and its derivatives in x and y direction give the ground area of the pixel
+        image_points = image_points[inside]
+        n = len(inside)
+        origin, rays = camera.getRay(np.concatenate((image_points, image_points + [1, 0], image_points + [0, 1])))
+        area = camera._getGroundAreaOfRays(origin, rays[:n], rays[n:2 * n] - rays[:n], rays[2 * n:] - rays[:n],
+                                           Z=points[inside, 2])
+        with np.errstate(invalid="ignore"):
+            pixel_size = np.sqrt(area)
+            better = pixel_size < resolution[inside]
+        resolution[inside[better]] = pixel_size[better]
+        camera_index[inside[better]] = index
+    resolution[camera_index == -1] = np.nan
+    return count, resolution, camera_index
+
+
+class FootprintIndex(object):
+    """
+    A spatial index of the footprints of a group of cameras which share the same **space** coordinate system (e.g.
+    cameras with the same gps reference position), to find the cameras which see given points. The footprint of a
+    camera is the bounding box (in x and y) of its field of view, limited to a range of heights of the points and a
+    maximal distance along the viewing direction of the camera. The footprints are stored in a regular grid, so that
+    a query only projects the points to the cameras whose footprint contains them.
+
+    The footprints are calculated from the rays of the image border (see
+    :py:meth:`~cameratransform.Camera.getImageBorder`), they are exact for rectilinear projections without lens
+    distortion. They are recalculated when the parameters of a camera change.
+
+    Parameters
+    ----------
+    cameras : list of :py:class:`~cameratransform.Camera`
+        the cameras.
+    z_range : tuple, optional
+        the range of heights (min, max) of the points to query, points outside of this range may not be found. Default:
+        (0, 0), points on the ground plane.
+    max_distance : number, optional
+        the maximal distance of the points along the viewing direction of the cameras, points farther away may not
+        be found. Default: the distance of the cameras to the horizon (see
+        :py:meth:`~cameratransform.Camera.distanceToHorizon`).
+    cell_size : number, optional
+        the side length of the cells of the grid in m. Default: the median size of the footprints.
+
+    Examples
+    --------
+
+    >>> import cameratransform as ct
+    >>> cameras = [ct.Camera(ct.RectilinearProjection(focallength_px=3729, image=(4608, 2592)),
+    >>>                      ct.SpatialOrientation(elevation_m=15.4, tilt_deg=85, pos_x_m=x)) for x in [-50, 0, 50]]
+    >>> index = ct.FootprintIndex(cameras)
+
+    find the cameras which see two points on the ground:
+
+    >>> point_index, camera_index, image_points = index.query([[-4.17, 45.32, 0.], [40.1, 120.7, 0.]])
+    >>> point_index
+    [0 0 1 1]
+    >>> camera_index
+    [0 1 1 2]
+    """
+    footprints = None
+    states = None
+    grid_origin = None
+    grid_shape = None
+    grid_cell_size = None
+
+    def __init__(self, cameras, z_range=(0, 0), max_distance=None, cell_size=None):
+        self.cameras = list(cameras)
+        self.z_range = z_range
+        self.max_distance = max_distance
+        self.cell_size = cell_size
+
+    def _getFootprint(self, camera):
+        # the bounding box of the field of view of the camera between the two heights and up to the maximal distance
+        border = camera.getImageBorder(resolution=max(camera.image_width_px, camera.image_height_px) / 16)
+        origin, rays = camera.getRay(border, normed=True)
+        forward = camera.getRay([camera.center_x_px, camera.center_y_px], normed=True)[1]
+        max_distance = self.max_distance if self.max_distance is not None else camera.distanceToHorizon()
+        # the distance along the viewing direction limits the rays (rays not in front of the camera by their length),
+        # the field of view is a pyramid with the camera at its apex
+        depth = rays @ forward
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t_min = np.zeros(len(rays))
+            t_max = np.where(depth > 0, max_distance / depth, max_distance)
+            base = origin + t_max[:, None] * rays
+            # the edges of the base of the pyramid between the two heights
+            start, end = base, np.roll(base, -1, axis=0)
+            edge_points = []
+            for z in self.z_range:
+                fraction = (z - start[:, 2]) / (end[:, 2] - start[:, 2])
+                crossing = (fraction >= 0) & (fraction <= 1)
+                edge_points.append(start[crossing, :2] + fraction[crossing, None] * (end[crossing, :2] - start[crossing, :2]))
+            # the part of the rays between the two heights
+            t_low = (self.z_range[0] - origin[2]) / rays[:, 2]
+            t_high = (self.z_range[1] - origin[2]) / rays[:, 2]
+            t_min = np.fmax(t_min, np.fmin(t_low, t_high))
+            t_max = np.fmin(t_max, np.fmax(t_low, t_high))
+        valid = t_min <= t_max
+        points = np.concatenate([origin[:2] + t_min[valid, None] * rays[valid, :2],
+                                 origin[:2] + t_max[valid, None] * rays[valid, :2]] + edge_points)
+        if len(points) == 0:
+            return np.full(4, np.nan)
+        return np.array([np.min(points[:, 0]), np.max(points[:, 0]), np.min(points[:, 1]), np.max(points[:, 1])])
+
+    def update(self):
+        """
+        Recalculate the footprints of the cameras whose parameters have changed and rebuild the grid.
+        """
+        states = [camera._getParameterState() for camera in self.cameras]
+        if self.states == states:
+            return
+        footprints = np.zeros((len(self.cameras), 4))
+        for index, (camera, state) in enumerate(zip(self.cameras, states)):
+            if self.states is not None and self.states[index] == state:
+                footprints[index] = self.footprints[index]
+            else:
+                footprints[index] = self._getFootprint(camera)
+        self.footprints = footprints
+        self.states = states
+
+        # the grid covers all footprints
+        valid = np.nonzero(~np.isnan(footprints[:, 0]))[0]
+        cell_size = self.cell_size
+        if cell_size is None:
+            cell_size = np.median(np.maximum(footprints[valid, 1] - footprints[valid, 0],
+                                             footprints[valid, 3] - footprints[valid, 2])) if len(valid) else 1
+            cell_size = max(cell_size, 1e-3)
+        self.grid_cell_size = cell_size
+        self.grid_origin = np.min(footprints[valid][:, [0, 2]], axis=0) if len(valid) else np.zeros(2)
+        first = np.floor((footprints[valid][:, [0, 2]] - self.grid_origin) / cell_size).astype(int)
+        last = np.floor((footprints[valid][:, [1, 3]] - self.grid_origin) / cell_size).astype(int)
+        self.grid_shape = tuple(np.max(last, axis=0) + 1) if len(valid) else (0, 0)
+
+        # the cameras of the cells, sorted by the flat index of the cells
+        cells, camera_indices = [], []
+        for camera_index, (x0, y0), (x1, y1) in zip(valid, first, last):
+            x, y = np.meshgrid(np.arange(x0, x1 + 1), np.arange(y0, y1 + 1))
+            cells.append((x * self.grid_shape[1] + y).ravel())
+            camera_indices.append(np.full(x.size, camera_index))
+        cells = np.concatenate(cells) if cells else np.zeros(0, dtype=int)
+        order = np.argsort(cells, kind="stable")
+        self.cell_cameras = np.concatenate(camera_indices)[order] if camera_indices else np.zeros(0, dtype=int)
+        self.cell_start = np.searchsorted(cells[order], np.arange(self.grid_shape[0] * self.grid_shape[1] + 1))
+
+    def getCandidates(self, points):
+        """
+        The cameras whose footprint contains the points, without projecting the points.
+
+        Parameters
+        ----------
+        points : ndarray
+            the points in **space** coordinates, dimensions (Nx3)
+
+        Returns
+        -------
+        point_index : ndarray
+            the indices of the points, dimensions (M)
+        camera_index : ndarray
+            the indices of the cameras whose footprint contains the points, dimensions (M)
+        """
+        self.update()
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        # the cell of the points
+        with np.errstate(invalid="ignore"):
+            cell = np.floor((points[:, :2] - self.grid_origin) / self.grid_cell_size)
+            inside = np.all((cell >= 0) & (cell < self.grid_shape), axis=1)
+        point_index = np.nonzero(inside)[0]
+        cell = (cell[inside, 0] * self.grid_shape[1] + cell[inside, 1]).astype(int)
+
+        # all pairs of the points with the cameras of their cell
+        start, count = self.cell_start[cell], self.cell_start[cell + 1] - self.cell_start[cell]
+        offset = np.arange(np.sum(count)) - np.repeat(np.cumsum(count) - count, count)
+        point_index = np.repeat(point_index, count)
+        camera_index = self.cell_cameras[np.repeat(start, count) + offset]
+
+        # the cells are larger than the footprints
+        footprint = self.footprints[camera_index]
+        x, y = points[point_index, 0], points[point_index, 1]
+        inside = (x >= footprint[:, 0]) & (x <= footprint[:, 1]) & (y >= footprint[:, 2]) & (y <= footprint[:, 3])
+        return point_index[inside], camera_index[inside]
+
+    def query(self, points):
+        """
+        Find the cameras which see the points. Only the cameras whose footprint contains a point project it to their
+        image.
+
+        Parameters
+        ----------
+        points : ndarray
+            the points in **space** coordinates, dimensions (3), (Nx3)
+
+        Returns
+        -------
+        point_index : ndarray
+            the indices of the points, sorted, dimensions (M)
+        camera_index : ndarray
+            the indices of the cameras which see the points, dimensions (M)
+        image_points : ndarray
+            the points in the **image** coordinates of the cameras, dimensions (Mx2)
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        point_index, camera_index = self.getCandidates(points)
+        image_points = np.full((len(point_index), 2), np.nan)
+        visible = np.zeros(len(point_index), dtype=bool)
+        # project the candidates camera by camera
+        order = np.argsort(camera_index, kind="stable")
+        bounds = np.searchsorted(camera_index[order], np.arange(len(self.cameras) + 1))
+        for index, camera in enumerate(self.cameras):
+            pairs = order[bounds[index]:bounds[index + 1]]
+            if len(pairs) == 0:
+                continue
+            # the clipped projection keeps the points behind the camera nan, also with lens distortions
+            projected = camera.imageFromSpace(points[point_index[pairs]], clip_to_image=True)
+            visible[pairs] = ~np.isnan(projected[:, 0])
+            image_points[pairs] = projected
+        # sort the pairs by the points
+        order = np.lexsort((camera_index, point_index))
+        order = order[visible[order]]
+        return point_index[order], camera_index[order], image_points[order]
+
+    def queryGPS(self, points):
+        """
+        Find the cameras which see the points given in **gps** coordinates, see :py:meth:`query`. The gps reference of
+        the first camera is used to convert the points to **space** coordinates.
+
+        Parameters
+        ----------
+        points : ndarray
+            the points in **gps** coordinates, dimensions (3), (Nx3)
+
+        Returns
+        -------
+        point_index : ndarray
+            the indices of the points, sorted, dimensions (M)
+        camera_index : ndarray
+            the indices of the cameras which see the points, dimensions (M)
+        image_points : ndarray
+            the points in the **image** coordinates of the cameras, dimensions (Mx2)
+        """
+        return self.query(self.cameras[0].spaceFromGPS(np.asarray(points, dtype=float).reshape(-1, 3)))
@@ -154,6 +154,19 @@ def formatGPS(lat, lon, format=None, asLatex=False):
     # return the results
     return result
 
+_gps_regex_list = [r"(?P<deg>[\d+-]+)°\s*(?P<min>\d+)('|′|´|′)\s*(?P<sec>[\d.]+)(''|\"| |´´|″)\s*",
+                   r"(?P<deg>[\d+-]+)°\s*(?P<min>[\d.]+)('|′|´|′)?\s*",
+                   r"(?P<deg>[\d.+-]+)°\s*"]
+# the compiled patterns for latitude and longitude pairs and for single coordinates
+_gps_patterns = [re.compile(r"\s*" + string.replace("<", "<lat_") + r"(?P<lat_sign>N|S)?" + r"\s*,?\s*" +
+                            string.replace("<", "<lon_") + r"(?P<lon_sign>W|E)?" + r"\s*") for string in _gps_regex_list]
+_gps_patterns_single = [re.compile(r"\s*" + string + r"(?P<sign>N|S|W|E)?" + r"\s*") for string in _gps_regex_list]
+# the patterns for pairs, to be applied to many lines of text at once (each matching a full line, either as a gps pair
+# or as unmatched)
+_gps_patterns_lines = [re.compile("^(?:" + pattern.pattern.replace(r"\s", r"[^\S\n]") + ".*|(?P<unmatched>.*))$", re.M)
+                       for pattern in _gps_patterns]
+
+
 def processDegree(data):
     # start with a value of 0
     value = 0
@@ -248,12 +261,8 @@ def gpsFromString(gps_string, height=None):
             return data
         else:
             return np.hstack((data, [height]))
-    regex_list = [r"(?P<deg>[\d+-]+)°\s*(?P<min>\d+)('|′|´|′)\s*(?P<sec>[\d.]+)(''|\"| |´´|″)\s*",
-                  r"(?P<deg>[\d+-]+)°\s*(?P<min>[\d.]+)('|′|´|′)?\s*",
-                  r"(?P<deg>[\d.+-]+)°\s*"]
-    for string in regex_list:
-        pattern = "\s*"+string.replace("<", "<lat_")+"(?P<lat_sign>N|S)?"+"\s*,?\s*"+string.replace("<", "<lon_")+"(?P<lon_sign>W|E)?"+"\s*"
-        match = re.match(pattern, gps_string)
+    for pattern in _gps_patterns:
+        match = pattern.match(gps_string)
         if match:
             data = match.groupdict()
             gps = []
@@ -265,15 +274,108 @@ def gpsFromString(gps_string, height=None):
             else:
                 return np.array(gps + [height])
     # if not, try only a single coordinate
-    for string in regex_list:
-        pattern = "\s*"+string+"(?P<sign>N|S|W|E)?"+"\s*"
-        match = re.match(pattern, gps_string)
+    for pattern in _gps_patterns_single:
+        match = pattern.match(gps_string)
         if match:
             data = match.groupdict()
             value = processDegree(data)
             return value
 
 
+def gpsFromStrings(gps_strings, height=None):
+    """
+    Read a batch of gps coordinates from text strings, e.g. a column of a csv file. The strings can have the same
+    formats as for :py:func:`gpsFromString`, but have to contain both latitude and longitude. Strings that cannot be
+    parsed do not raise an exception, but are reported in the returned mask.
+
+    Parameters
+    ----------
+    gps_strings : list, ndarray, pandas.Series
+        the strings of the points, containing both latitude and longitude, dimensions (N)
+    height : number, ndarray, optional
+        the height of the gps points, dimensions scalar, (N)
+
+    Returns
+    -------
+    points : ndarray
+        the lat, lon, (height) of the points, nan for the strings that could not be parsed, dimensions (Nx2), (Nx3)
+    failed : ndarray
+        whether the string could not be parsed, dimensions (N)
+
+    Examples
+    --------
+
+    >>> import cameratransform as ct
+    >>> points, failed = ct.gpsFromStrings(["66°39'56.12862''S  140°01'20.39562'' E", "-66.66631645° 140.01932141°", "x"])
+    >>> points
+    array([[-66.66559128, 140.02233212],
+           [-66.66631645, 140.01932141],
+           [         nan,          nan]])
+    >>> failed
+    array([False, False,  True])
+    """
+    gps_strings = list(gps_strings)
+    count = len(gps_strings)
+    groups = {key: np.full(count, "", dtype=object) for key in _gps_patterns[0].groupindex}
+    unmatched = np.array([isinstance(gps_string, str) for gps_string in gps_strings], dtype=bool)
+    failed = ~unmatched
+
+    # try the patterns one after the other on the strings that did not match yet
+    for pattern in _gps_patterns_lines:
+        index = np.where(unmatched)[0]
+        if len(index) == 0:
+            break
+        # apply the pattern to all strings at once, one string per line
+        lines = "\n".join([gps_strings[i] for i in index])
+        # line breaks within the strings are treated as whitespace
+        if lines.count("\n") != len(index) - 1:
+            lines = "\n".join([gps_strings[i].replace("\n", " ") for i in index])
+        rows = pattern.findall(lines)
+        # the degrees are not optional, so they are only empty if the pattern did not match
+        deg = pattern.groupindex["lat_deg"] - 1
+        matched = np.array([row[deg] != "" for row in rows], dtype=bool)
+        if not np.any(matched):
+            continue
+        unmatched[index[matched]] = False
+        values = list(zip(*[row for row, match in zip(rows, matched) if match]))
+        for key, group in pattern.groupindex.items():
+            if key in groups:
+                groups[key][index[matched]] = values[group - 1]
+    failed |= unmatched
+
+    points = np.full((count, 2 if height is None else 3), np.nan)
+    for column, part in enumerate(["lat", "lon"]):
+        deg = groups[part + "_deg"]
+        # the degrees, minutes and seconds as float arrays (missing minutes and seconds are 0)
+        values = [_stringsToFloat(np.where(groups[part + "_" + key] == "", "0", groups[part + "_" + key]), failed)
+                  for key in ["deg", "min", "sec"]]
+        value = np.abs(values[0]) + values[1] / 60. + values[2] / 3600.
+        # a negative degree or the sign letter S or W makes the coordinate negative
+        negative = np.array([d[:1] == "-" for d in deg], dtype=bool) | np.isin(groups[part + "_sign"], ["S", "W"])
+        points[:, column] = np.where(negative, -value, value)
+    failed |= np.any(np.isnan(points[:, :2]), axis=1)
+    points[failed, :2] = np.nan
+    if height is not None:
+        points[:, 2] = height
+        points[failed, 2] = np.nan
+    return points, failed
+
+
+def _stringsToFloat(strings, failed):
+    # convert the strings to floats, strings that do not represent a number are set to nan (and later marked as failed)
+    strings = np.where(failed, "nan", strings)
+    try:
+        return strings.astype(float)
+    except ValueError:
+        values = np.full(len(strings), np.nan)
+        for index, string in enumerate(strings):
+            try:
+                values[index] = float(string)
+            except ValueError:
+                pass
+        return values
+
+
 def getBearing(point1, point2):
     r"""
     The angle relative :math:`\beta` to the north direction from point :math:`(\mathrm{lat}_1, \mathrm{lon}_1)` to point :math:`(\mathrm{lat}_2, \mathrm{lon}_2)`:
@@ -454,20 +556,247 @@ def moveDistance(start, distance, bearing):
     return np.array([np.rad2deg(lat2), np.rad2deg(lon2)]).T
 
 
+# the WGS84 reference ellipsoid
+WGS84_a = 6378137.0
+WGS84_f = 1 / 298.257223563
+WGS84_b = WGS84_a * (1 - WGS84_f)
+WGS84_e2 = WGS84_f * (2 - WGS84_f)
+
+
+def ecefFromGPS(points):
+    r"""
+    Convert gps positions on the WGS84 ellipsoid to earth-centered, earth-fixed (ECEF) cartesian coordinates:
+
+    .. math::
+        N &= \frac{a}{\sqrt{1 - e^2 \sin^2(\mathrm{lat})}}\\
+        x &= (N + h) \cdot \cos(\mathrm{lat}) \cdot \cos(\mathrm{lon})\\
+        y &= (N + h) \cdot \cos(\mathrm{lat}) \cdot \sin(\mathrm{lon})\\
+        z &= (N \cdot (1 - e^2) + h) \cdot \sin(\mathrm{lat})
+
+    Parameters
+    ----------
+    points : ndarray
+        the gps positions, lat, lon, (height), dimensions (2), (3), (Nx2), (Nx3)
+
+    Returns
+    -------
+    points : ndarray
+        the ECEF coordinates in m, dimensions (3), (Nx3)
+
+    Examples
+    --------
+
+    >>> import cameratransform as ct
+    >>> ct.ecefFromGPS([52.51666667, 13.4, 34])
+    array([3783630.18341144,  901387.85535764, 5038020.37007035])
+    """
+    lat, lon, height = splitGPS(np.asarray(points, dtype=float))
+    if height is None:
+        height = 0
+    sin_lat = np.sin(lat)
+    cos_lat = np.cos(lat)
+    # the prime vertical radius of curvature
+    N = WGS84_a / np.sqrt(1 - WGS84_e2 * sin_lat ** 2)
+    return np.array([(N + height) * cos_lat * np.cos(lon),
+                     (N + height) * cos_lat * np.sin(lon),
+                     (N * (1 - WGS84_e2) + height) * sin_lat]).T
+
+
+def gpsFromECEF(points):
+    """
+    Convert earth-centered, earth-fixed (ECEF) cartesian coordinates to gps positions on the WGS84 ellipsoid. The
+    conversion uses the closed form solution of Heikkinen (1982), which needs no iterations.
+
+    Parameters
+    ----------
+    points : ndarray
+        the ECEF coordinates in m, dimensions (3), (Nx3)
+
+    Returns
+    -------
+    points : ndarray
+        the gps positions, lat, lon, height, dimensions (3), (Nx3)
+
+    Examples
+    --------
+
+    >>> import cameratransform as ct
+    >>> ct.gpsFromECEF([3783630.18341144, 901387.85535764, 5038020.37007035])
+    array([52.51666667, 13.4       , 34.        ])
+    """
+    points = np.asarray(points, dtype=float)
+    x, y, z = points[..., 0], points[..., 1], points[..., 2]
+    a, b, e2 = WGS84_a, WGS84_b, WGS84_e2
+    # the second eccentricity
+    ep2 = (a ** 2 - b ** 2) / b ** 2
+
+    p = np.sqrt(x ** 2 + y ** 2)
+    F = 54 * b ** 2 * z ** 2
+    G = p ** 2 + (1 - e2) * z ** 2 - e2 * (a ** 2 - b ** 2)
+    c = e2 ** 2 * F * p ** 2 / G ** 3
+    s = np.cbrt(1 + c + np.sqrt(c ** 2 + 2 * c))
+    k = s + 1 + 1 / s
+    P = F / (3 * k ** 2 * G ** 2)
+    Q = np.sqrt(1 + 2 * e2 ** 2 * P)
+    # the radicand vanishes at the poles, clip it to not get nan from rounding errors
+    r0 = -P * e2 * p / (1 + Q) + np.sqrt(np.maximum(0.5 * a ** 2 * (1 + 1 / Q) - P * (1 - e2) * z ** 2 / (Q * (1 + Q)) - 0.5 * P * p ** 2, 0))
+    U = np.sqrt((p - e2 * r0) ** 2 + z ** 2)
+    V = np.sqrt((p - e2 * r0) ** 2 + (1 - e2) * z ** 2)
+    z0 = b ** 2 * z / (a * V)
+
+    height = U * (1 - b ** 2 / (a * V))
+    lat = np.arctan2(z + ep2 * z0, p)
+    lon = np.arctan2(y, x)
+    return np.array([np.rad2deg(lat), np.rad2deg(lon), height]).T
+
+
+class LocalFrame(object):
+    r"""
+    A local tangent plane around a reference gps position, to convert between **gps** and **space** coordinates. The
+    sine and cosine of the reference position are computed once, so that many batches of points can be converted with
+    the same frame.
+
+    With the default earth model "sphere", the conversion uses the same spherical earth model as
+    :py:func:`getDistance`, :py:func:`getBearing` and :py:func:`moveDistance`. A point is placed at the great circle
+    distance :math:`d` from the reference position in the direction of the bearing :math:`\beta`:
+
+    .. math::
+        x &= d \cdot \sin(\beta)\\
+        y &= d \cdot \cos(\beta)
+
+    With the earth model "wgs84", the points are converted to earth-centered, earth-fixed coordinates on the WGS84
+    ellipsoid (:py:func:`ecefFromGPS`) and rotated to the east, north, up axes at the reference position (at height 0).
+
+    Parameters
+    ----------
+    gps0 : ndarray
+        the reference position, lat, lon, (height), dimensions (2), (3)
+    earth_model : str, optional
+        the model of the earth, "sphere" (default) or "wgs84"
+
+    Examples
+    --------
+
+    >>> import cameratransform as ct
+    >>> frame = ct.LocalFrame([52.51666667, 13.4, 0])
+    >>> frame.spaceFromGPS([[52.51676667, 13.4001, 0], [52.51656667, 13.3999, 0]])
+    array([[  6.76653643,  11.11949735,   0.        ],
+           [ -6.76656723, -11.11948798,   0.        ]])
+    >>> frame.gpsFromSpace([[6.76653643, 11.11949735, 0]])
+    array([[52.51676667, 13.4001    ,  0.        ]])
+    """
+    R_earth = 6371e3
+
+    def __init__(self, gps0, earth_model="sphere"):
+        if earth_model not in ["sphere", "wgs84"]:
+            raise ValueError("Unknown earth model %s, use \"sphere\" or \"wgs84\"." % earth_model)
+        self.earth_model = earth_model
+        self.gps0 = np.array(gps0, dtype=float)
+        self.lat0, self.lon0, self.height0 = splitGPS(self.gps0)
+        self.sin_lat0 = np.sin(self.lat0)
+        self.cos_lat0 = np.cos(self.lat0)
+        # the radius for moving away from the reference position includes its height
+        self.R = self.R_earth
+        if self.height0 is not None:
+            self.R = self.R_earth + self.height0
+
+        # the origin and the rotation from ECEF to the east, north, up axes
+        sin_lon0, cos_lon0 = np.sin(self.lon0), np.cos(self.lon0)
+        self.ecef0 = ecefFromGPS(self.gps0[:2])
+        self.R_enu = np.array([[-sin_lon0, cos_lon0, 0],
+                               [-self.sin_lat0 * cos_lon0, -self.sin_lat0 * sin_lon0, self.cos_lat0],
+                               [self.cos_lat0 * cos_lon0, self.cos_lat0 * sin_lon0, self.sin_lat0]])
+
+    def spaceFromGPS(self, points):
+        """
+        Convert points from the **gps** coordinate system to the **space** coordinate system.
+
+        Parameters
+        ----------
+        points : ndarray
+            the points in **gps** coordinates to transform, dimensions (2), (3), (Nx2), (Nx3)
+
+        Returns
+        -------
+        points : ndarray
+            the points in the **space** coordinate system, dimensions (3), (Nx3)
+        """
+        points = np.asarray(points, dtype=float)
+        if self.earth_model == "wgs84":
+            return (ecefFromGPS(points) - self.ecef0) @ self.R_enu.T
+        lat, lon, height = splitGPS(points)
+        sin_lat = np.sin(lat)
+        cos_lat = np.cos(lat)
+        dlon = lon - self.lon0
+
+        # the great circle distance (haversine formula)
+        a = np.sin((lat - self.lat0) / 2.0) ** 2 + self.cos_lat0 * cos_lat * np.sin(dlon / 2.0) ** 2
+        distance = self.R_earth * 2 * np.arcsin(np.sqrt(a))
+        if height is not None and self.height0 is not None:
+            distance = np.sqrt(distance ** 2 + (height - self.height0) ** 2)
+
+        # the direction of the bearing, the bearing of the reference position itself is north
+        X = cos_lat * np.sin(dlon)
+        Y = self.cos_lat0 * sin_lat - self.sin_lat0 * cos_lat * np.cos(dlon)
+        norm = np.hypot(X, Y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sin_bearing = np.where(norm > 0, X / norm, 0)
+            cos_bearing = np.where(norm > 0, Y / norm, 1)
+
+        if height is None:
+            height = np.zeros_like(lat)
+        return np.array([distance * sin_bearing, distance * cos_bearing, height]).T
+
+    def gpsFromSpace(self, points):
+        """
+        Convert points from the **space** coordinate system to the **gps** coordinate system.
+
+        Parameters
+        ----------
+        points : ndarray
+            the points in **space** coordinates to transform, dimensions (2), (3), (Nx2), (Nx3)
+
+        Returns
+        -------
+        points : ndarray
+            the points in the **gps** coordinate system, dimensions (2), (3), (Nx2), (Nx3)
+        """
+        points = np.asarray(points, dtype=float)
+        if self.earth_model == "wgs84":
+            return self._gpsFromSpaceWGS84(points)
+        distance = np.linalg.norm(points[..., :2], axis=-1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sin_bearing = np.where(distance > 0, points[..., 0] / distance, 0)
+            cos_bearing = np.where(distance > 0, points[..., 1] / distance, 1)
+
+        # move the distance in the direction of the bearing from the reference position
+        sin_angle = np.sin(distance / self.R)
+        cos_angle = np.cos(distance / self.R)
+        lat = np.arcsin(self.sin_lat0 * cos_angle + self.cos_lat0 * sin_angle * cos_bearing)
+        lon = self.lon0 + np.arctan2(sin_bearing * sin_angle * self.cos_lat0, cos_angle - self.sin_lat0 * np.sin(lat))
+
+        if points.shape[-1] == 3:
+            return np.array([np.rad2deg(lat), np.rad2deg(lon), points[..., 2]]).T
+        if self.height0 is not None:
+            return np.array([np.rad2deg(lat), np.rad2deg(lon), np.ones_like(lon) * self.height0]).T
+        return np.array([np.rad2deg(lat), np.rad2deg(lon)]).T
+
+    def _gpsFromSpaceWGS84(self, points):
+        if points.shape[-1] == 3:
+            enu = points
+        else:
+            # points without a height are at the height of the reference position
+            height = 0 if self.height0 is None else self.height0
+            enu = np.concatenate((points, np.full(points.shape[:-1] + (1,), height)), axis=-1)
+        gps = gpsFromECEF(self.ecef0 + enu @ self.R_enu)
+        if points.shape[-1] == 3 or self.height0 is not None:
+            return gps
+        return gps[..., :2]
+
+
 def spaceFromGPS(gps, gps0):
-    if len(gps[..., :]) == 2:
-        height = np.zeros_like(gps[..., 0])
-    else:
-        height = gps[..., 2]
-    distance = getDistance(gps0, gps)
-    bearing_rad = np.deg2rad(getBearing(gps0, gps))
-    return np.array([distance * np.sin(bearing_rad), distance * np.cos(bearing_rad), height]).T
+    return LocalFrame(gps0).spaceFromGPS(gps)
 
 
 def gpsFromSpace(space, gps0):
-    bearing = np.rad2deg(np.arctan2(space[..., 0], space[..., 1]))
-    distance = np.linalg.norm(space[..., :2], axis=-1)
-    target = moveDistance(gps0, distance, bearing)
-    if space.shape[-1] == 3:
-        return np.array([target[..., 0], target[..., 1], space[..., 2]]).T
-    return target
+    return LocalFrame(gps0).gpsFromSpace(space)
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# heightmap.py
+
+# Copyright (c) 2017-2019, Richard Gerum
+#
+# This file is part of the cameratransform package.
+#
+# cameratransform is free software: you can redistribute it and/or modify
+# it under the terms of the MIT licence.
+#
+# cameratransform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the license
+# along with cameratransform. If not, see <https://opensource.org/licenses/MIT>
+
+import numpy as np
+
+
+class HeightMap(object):
+    """
+    A digital elevation model (DEM) given as a regular grid of heights in **space** coordinates. The grid covers the
+    given extent, the first row of the data is the row with the largest y coordinate (the same orientation as an image
+    of the top view). The heights are bilinearly interpolated between the centers of the grid cells.
+
+    Rays are intersected with the surface by marching along the ray and refining the first crossing with a bisection.
+    Regions where the ray stays above the terrain are skipped using a pyramid of the maximal heights of patches of the
+    grid, which is built on the first intersection.
+
+    The pyramid and the top views and viewsheds that cameras cache for the height map assume that the heights do not
+    change. If the data is modified in place, call :py:meth:`update` afterwards.
+
+    Parameters
+    ----------
+    data : ndarray, str
+        the heights of the grid in m, dimensions (HxW), or the filename of a .npy file. Files are memory mapped, so
+        only the parts of the grid needed are read from disk.
+    extent : list
+        the extent of the grid in **space** coordinates: [x_min, x_max, y_min, y_max]
+    patch_size : int, optional
+        the size of the patches (in grid cells) of the finest level of the maximum height pyramid, default 16
+
+    Examples
+    --------
+
+    >>> import cameratransform as ct
+    >>> cam = ct.Camera(ct.RectilinearProjection(focallength_px=3729, image=(4608, 2592)),
+    >>>                    ct.SpatialOrientation(elevation_m=15.4, tilt_deg=85))
+
+    load a height map covering 1km x 1km in front of the camera:
+
+    >>> dem = ct.HeightMap("terrain.npy", extent=[-500, 500, 0, 1000])
+
+    and project image points onto the terrain:
+
+    >>> cam.spaceFromImage([[1968, 2291], [1650, 2189]], dem=dem)
+    """
+    pyramid = None
+    height_min = None
+    # increased with every change of the heights, to invalidate the caches that depend on them
+    version = 0
+
+    def __init__(self, data, extent, patch_size=16):
+        self.extent = [float(e) for e in extent]
+        self.patch_size = int(patch_size)
+        self._setData(data)
+
+    def _setData(self, data):
+        if isinstance(data, str):
+            data = np.load(data, mmap_mode="r")
+        if len(data.shape) != 2 or data.shape[0] < 2 or data.shape[1] < 2:
+            raise ValueError("The height map has to be a 2D array with at least 2x2 values.")
+        self.data = data
+
+        self.height, self.width = data.shape
+        # the size of a grid cell in m
+        self.cell_x = (self.extent[1] - self.extent[0]) / self.width
+        self.cell_y = (self.extent[3] - self.extent[2]) / self.height
+
+    def update(self, data=None):
+        """
+        Notify the height map that the heights have changed, either in place or by new data covering the same extent.
+        The maximum height pyramid is rebuilt on the next intersection and the top views and viewsheds cached by the
+        cameras are calculated again.
+
+        Parameters
+        ----------
+        data : ndarray, str, optional
+            the new heights of the grid in m, dimensions (HxW), or the filename of a .npy file. If not given, the
+            current data has been modified in place.
+
+        Examples
+        --------
+
+        >>> dem.data[10:20, 30:40] += 2
+        >>> dem.update()
+        """
+        if data is not None:
+            self._setData(data)
+        self.pyramid = None
+        self.height_min = None
+        self.version += 1
+
+    def _gridFromSpace(self, x, y):
+        # the position in units of grid cells, relative to the center of the first cell
+        return (x - self.extent[0]) / self.cell_x - 0.5, (self.extent[3] - y) / self.cell_y - 0.5
+
+    def _spaceFromGrid(self, u, v):
+        return self.extent[0] + (u + 0.5) * self.cell_x, self.extent[3] - (v + 0.5) * self.cell_y
+
+    def getHeight(self, points):
+        """
+        The height of the terrain at the given positions. Positions outside of the extent return nan.
+
+        Parameters
+        ----------
+        points : ndarray
+            the positions in **space** coordinates, only x and y are used, dimensions (2), (3), (Nx2), (Nx3)
+
+        Returns
+        -------
+        height : number, ndarray
+            the interpolated height of the terrain, dimensions scalar, (N)
+        """
+        points = np.asarray(points, dtype=float)
+        return self._getHeight(points[..., 0], points[..., 1])
+
+    def _getHeight(self, x, y):
+        u, v = self._gridFromSpace(x, y)
+        outside = (u < -0.5) | (u > self.width - 0.5) | (v < -0.5) | (v > self.height - 0.5)
+        # the border half cells are clamped to the outermost cell centers
+        u = np.clip(np.nan_to_num(u), 0, self.width - 1)
+        v = np.clip(np.nan_to_num(v), 0, self.height - 1)
+        col = np.minimum(np.floor(u).astype(int), self.width - 2)
+        row = np.minimum(np.floor(v).astype(int), self.height - 2)
+        fu = u - col
+        fv = v - row
+        # bilinear interpolation between the four neighbouring cell centers
+        height = (self.data[row, col] * (1 - fu) + self.data[row, col + 1] * fu) * (1 - fv) + \
+                 (self.data[row + 1, col] * (1 - fu) + self.data[row + 1, col + 1] * fu) * fv
+        return np.where(outside, np.nan, height)
+
+    def getHeightGrid(self, x, y):
+        """
+        The height of the terrain at the points of a regular grid. This is faster than :py:meth:`getHeight` with
+        the points of the grid, as the interpolation is separated into the two directions.
+
+        Parameters
+        ----------
+        x : ndarray
+            the x coordinates of the columns of the grid in **space** coordinates, dimensions (W)
+        y : ndarray
+            the y coordinates of the rows of the grid in **space** coordinates, dimensions (H)
+
+        Returns
+        -------
+        height : ndarray
+            the interpolated height of the terrain, nan outside of the extent, dimensions (HxW)
+        """
+        u, v = self._gridFromSpace(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+
+        def weights(u, size):
+            # the cells left of the position and the weight of the cell right of it
+            outside = (u < -0.5) | (u > size - 0.5)
+            u = np.clip(np.nan_to_num(u), 0, size - 1)
+            index = np.minimum(np.floor(u).astype(int), size - 2)
+            return index, u - index, outside
+
+        col, fu, outside_x = weights(u, self.width)
+        row, fv, outside_y = weights(v, self.height)
+        # interpolate the needed rows of the grid along x and then along y
+        rows = np.unique(np.concatenate((row, row + 1)))
+        data = np.asarray(self.data[rows], dtype=float)
+        data = data[:, col] * (1 - fu) + data[:, col + 1] * fu
+        index = np.searchsorted(rows, row)
+        height = data[index] * (1 - fv)[:, None] + data[index + 1] * fv[:, None]
+        height[outside_y] = np.nan
+        height[:, outside_x] = np.nan
+        return height
+
+    def _initPyramid(self):
+        # the interpolated surface between four cell centers is bounded by the maximum of the four values, the patches
+        # of the finest level therefore cover the (H-1)x(W-1) grid of the quads between the cell centers
+        patch = self.patch_size
+        columns = -(-(self.width - 1) // patch)
+        level = []
+        height_min = np.inf
+        # process the grid in blocks of rows, to not load the whole (maybe memory mapped) grid at once
+        for start in range(0, self.height - 1, patch):
+            block = np.asarray(self.data[start:start + patch + 1], dtype=np.float32)
+            height_min = min(height_min, np.min(block))
+            quads = np.maximum(np.maximum(block[:-1, :-1], block[1:, :-1]), np.maximum(block[:-1, 1:], block[1:, 1:]))
+            quads = np.pad(quads, ((0, 0), (0, columns * patch - quads.shape[1])), constant_values=-np.inf)
+            level.append(np.max(quads.reshape(quads.shape[0], columns, patch), axis=(0, 2)))
+        level = np.array(level)
+
+        # every coarser level combines 2x2 patches of the previous level
+        pyramid = [level]
+        while level.shape[0] > 1 or level.shape[1] > 1:
+            level = np.pad(level, ((0, level.shape[0] % 2), (0, level.shape[1] % 2)), constant_values=-np.inf)
+            level = np.max(level.reshape(level.shape[0] // 2, 2, level.shape[1] // 2, 2), axis=(1, 3))
+            pyramid.append(level)
+        self.pyramid = pyramid
+        self.height_min = height_min
+
+    def _getSkip(self, origin, direction, t, z):
+        # find the largest patch of the pyramid that the ray passes above and return where the ray leaves it
+        u, v = self._gridFromSpace(origin[:, 0] + t * direction[:, 0], origin[:, 1] + t * direction[:, 1])
+        col = np.clip(np.floor(u).astype(int), 0, self.width - 2)
+        row = np.clip(np.floor(v).astype(int), 0, self.height - 2)
+        t_skip = np.full(t.shape, -np.inf)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for index, level in enumerate(self.pyramid):
+                size = self.patch_size * 2 ** index
+                patch_col, patch_row = col // size, row // size
+                # the bounds of the patch in grid coordinates (the border patches include the clamped border)
+                u_bounds = np.array([patch_col * size, (patch_col + 1) * size], dtype=float)
+                v_bounds = np.array([patch_row * size, (patch_row + 1) * size], dtype=float)
+                u_bounds[0][patch_col == 0] = -0.5
+                u_bounds[1] = np.where(u_bounds[1] >= self.width - 1, self.width - 0.5, u_bounds[1])
+                v_bounds[0][patch_row == 0] = -0.5
+                v_bounds[1] = np.where(v_bounds[1] >= self.height - 1, self.height - 0.5, v_bounds[1])
+                x_bounds, y_bounds = self._spaceFromGrid(u_bounds, v_bounds)
+                # the ray parameter where the ray leaves the patch
+                t_x = np.where(direction[:, 0] > 0, x_bounds[1], x_bounds[0]) - origin[:, 0]
+                t_y = np.where(direction[:, 1] > 0, y_bounds[0], y_bounds[1]) - origin[:, 1]
+                t_exit = np.fmin(np.where(direction[:, 0] != 0, t_x / direction[:, 0], np.inf),
+                                 np.where(direction[:, 1] != 0, t_y / direction[:, 1], np.inf))
+                # the ray is linear, so its lowest point in the patch is at the entry or at the exit
+                z_exit = origin[:, 2] + t_exit * direction[:, 2]
+                z_min = np.where(np.isinf(t_exit), np.where(direction[:, 2] < 0, -np.inf, z), np.fmin(z, z_exit))
+                above = z_min > level[np.minimum(patch_row, level.shape[0] - 1), np.minimum(patch_col, level.shape[1] - 1)]
+                t_skip = np.where(above & (t_exit > t), np.fmax(t_skip, t_exit), t_skip)
+        return t_skip
+
+    def intersect(self, origin, direction, iterations=50):
+        """
+        Intersect rays with the terrain and return the first intersection point of every ray.
+
+        Parameters
+        ----------
+        origin : ndarray
+            the origin point(s) of the ray(s), dimensions: (3) or (R,3)
+        direction : ndarray
+            the direction vector(s) of the ray(s), dimensions: (3) or (R,3)
+        iterations : int, optional
+            the number of bisection steps to refine the intersection, default 50
+
+        Returns
+        -------
+        points : ndarray
+            the intersection point(s) of the ray(s) with the terrain, dimensions: (3) or (R,3). Points have nan values
+            when there is no intersection.
+        """
+        if self.pyramid is None:
+            self._initPyramid()
+        direction = np.array(direction, dtype=float)
+        return_single = len(direction.shape) == 1
+        direction = direction.reshape(-1, 3)
+        origin = np.array(np.broadcast_to(np.array(origin, dtype=float), direction.shape))
+
+        # clip the rays to the box spanned by the extent and the height range of the terrain
+        height_max = np.max(self.pyramid[-1])
+        # pad the height range slightly, so that rays still cross a completely flat terrain
+        padding = 1e-6 * (1 + max(abs(self.height_min), abs(height_max)))
+        box_min = np.array([self.extent[0], self.extent[2], self.height_min - padding])
+        box_max = np.array([self.extent[1], self.extent[3], height_max + padding])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t1 = (box_min - origin) / direction
+            t2 = (box_max - origin) / direction
+        t_start = np.maximum(np.max(np.nan_to_num(np.fmin(t1, t2), nan=-np.inf), axis=1), 0)
+        t_end = np.min(np.nan_to_num(np.fmax(t1, t2), nan=np.inf), axis=1)
+
+        # the step width of the marching, half a grid cell in the x-y plane
+        with np.errstate(divide="ignore"):
+            step = 0.5 * min(self.cell_x, self.cell_y) / np.linalg.norm(direction[:, :2], axis=1)
+
+        def aboveTerrain(index, t):
+            points = origin[index] + t[:, None] * direction[index]
+            height = self._getHeight(points[:, 0], points[:, 1])
+            # positions outside of the grid count as above the terrain
+            return ~(points[:, 2] <= height)
+
+        # the brackets of the intersections, the ray is above the terrain at t_above and below at t_below
+        t_above = np.full(len(direction), np.nan)
+        t_below = np.full(len(direction), np.nan)
+
+        # rays that start below the terrain intersect it at their start
+        index = np.where(t_start <= t_end)[0]
+        t = t_start[index]
+        below = ~aboveTerrain(index, t)
+        t_above[index[below]] = t[below]
+        t_below[index[below]] = t[below]
+        index, t = index[~below], t[~below]
+
+        # march all rays in parallel
+        while len(index):
+            z = origin[index, 2] + t * direction[index, 2]
+            t_skip = self._getSkip(origin[index], direction[index], t, z)
+            # skip the patches that are completely below the ray (slightly beyond, to end up in the next patch)
+            t_next = np.where(np.isfinite(t_skip), t_skip + 1e-4 * np.fmin(step[index], t_end[index] - t_start[index]),
+                              t + step[index])
+            t_next = np.minimum(np.maximum(t_next, t + 1e-12), t_end[index])
+            below = ~aboveTerrain(index, t_next)
+            t_above[index[below]] = t[below]
+            t_below[index[below]] = t_next[below]
+            # continue with the rays that are above the terrain and not at the end of the extent
+            active = ~below & (t_next < t_end[index])
+            index, t = index[active], t_next[active]
+
+        # refine the intersections with bisection
+        index = np.where(np.isfinite(t_below))[0]
+        lower, upper = t_above[index], t_below[index]
+        for i in range(iterations):
+            middle = 0.5 * (lower + upper)
+            above = aboveTerrain(index, middle)
+            lower = np.where(above, middle, lower)
+            upper = np.where(above, upper, middle)
+        t_below[index] = upper
+
+        points = origin + t_below[:, None] * direction
+        if return_single:
+            return points[0]
+        return points
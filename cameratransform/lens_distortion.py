@@ -21,24 +21,36 @@ import numpy as np
 from .parameter_set import ClassWithParameterSet, ParameterSet, Parameter, TYPE_DISTORTION
 import json
 
-def invert_function(x, func):
-    from scipy import interpolate
-    from scipy.interpolate import dfitpack
+def invert_function(x, func, iterations=3):
+    # the inverse of a monotonic function, tabulated at the points x and refined with Newton steps
     y = func(x)
     dy = np.concatenate(([0], np.diff(y)))
     y = y[dy>=0]
     x = x[dy>=0]
-    try:
-        inter = interpolate.InterpolatedUnivariateSpline(y, x)
-    # dfitpack.error
-    except Exception: # pragma: no cover
-        inter = lambda x: x
-    return inter
+    if len(x) < 2:  # pragma: no cover
+        return lambda x: x
+
+    def inverse(values):
+        values = np.asarray(values, dtype=float)
+        # a first guess from the table, extrapolated linearly at both ends
+        guess = np.interp(values, y, x)
+        guess = np.where(values < y[0], x[0] + (values - y[0]) * (x[1] - x[0]) / (y[1] - y[0]), guess)
+        guess = np.where(values > y[-1], x[-1] + (values - y[-1]) * (x[-1] - x[-2]) / (y[-1] - y[-2]), guess)
+        # refine with Newton steps, using the numerical derivative of the function
+        h = 1e-6
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for i in range(iterations):
+                slope = (func(guess + h) - func(guess - h)) / (2 * h)
+                guess = guess - np.where(slope > 0, (func(guess) - values) / slope, 0)
+        return guess
+    return inverse
 
 
 class LensDistortion(ClassWithParameterSet):  # pragma: no cover
     offset = np.array([0, 0])
     scale = 1
+    # whether the points are normalized with the focal length, then the distortion scales with the focal length
+    focallength_relative = True
 
     def __init__(self):
         self.parameters = ParameterSet()
@@ -203,6 +215,8 @@ class ABCDistortion(LensDistortion):
 
     """
     projection = None
+    # the points are normalized with the image size
+    focallength_relative = False
 
     def __init__(self, a=None, b=None, c=None):
         self.parameters = ParameterSet(
@@ -269,3 +283,136 @@ class ABCDistortion(LensDistortion):
         points[np.isnan(points)] = 0
         # rescale back to the image
         return points * self.scale + self.offset
+
+
+class OpenCVLensDistortion(LensDistortion):
+    r"""
+    The full distortion model of OpenCV. In addition to the radial terms of the :py:class:`BrownLensDistortion`, it
+    includes a rational radial part (:math:`k_4, k_5, k_6`), the tangential components (:math:`p_1, p_2`) and the
+    thin-prism components (:math:`s_1, s_2, s_3, s_4`). With this model, calibrations obtained with
+    ``cv2.calibrateCamera`` can be used without loss of information.
+
+    Adjust scale and offset of x and y to be relative to the center:
+
+    .. math::
+        x' &= \frac{x-c_x}{f_x}\\
+        y' &= \frac{y-c_y}{f_y}
+
+    Transform the coordinates with the distortion:
+
+    .. math::
+        r^2 &= x'^2 + y'^2\\
+        d_r &= \frac{1 + k_1 \cdot r^2 + k_2 \cdot r^4 + k_3 \cdot r^6}{1 + k_4 \cdot r^2 + k_5 \cdot r^4 + k_6 \cdot r^6}\\
+        x_\mathrm{distorted}' &= x' \cdot d_r + 2 p_1 x' y' + p_2 (r^2 + 2 x'^2) + s_1 r^2 + s_2 r^4\\
+        y_\mathrm{distorted}' &= y' \cdot d_r + p_1 (r^2 + 2 y'^2) + 2 p_2 x' y' + s_3 r^2 + s_4 r^4
+
+    Readjust scale and offset to obtain again pixel coordinates:
+
+    .. math::
+        x_\mathrm{distorted} &= x_\mathrm{distorted}' \cdot f_x + c_x\\
+        y_\mathrm{distorted} &= y_\mathrm{distorted}' \cdot f_y + c_y
+
+    The inverse transformation has no closed form. It is obtained by a fixed-point iteration, as done by
+    ``cv2.undistortPoints``.
+
+    The coefficients can also be provided as the distortion vector of OpenCV (with 4, 5, 8, or 12 entries) using the
+    ``coefficients`` argument:
+
+    >>> import cameratransform as ct
+    >>> rms, camera_matrix, dist_coefs, rvecs, tvecs = cv2.calibrateCamera(...)
+    >>> lens = ct.OpenCVLensDistortion(coefficients=dist_coefs)
+    """
+    projection = None
+    parameter_names = ["k1", "k2", "p1", "p2", "k3", "k4", "k5", "k6", "s1", "s2", "s3", "s4"]
+
+    # the maximal number of iterations for the inversion and the tolerance (in normalized coordinates) to stop
+    iterations = 20
+    tolerance = 1e-12
+
+    def __init__(self, k1=None, k2=None, p1=None, p2=None, k3=None, k4=None, k5=None, k6=None,
+                 s1=None, s2=None, s3=None, s4=None, coefficients=None):
+        values = [k1, k2, p1, p2, k3, k4, k5, k6, s1, s2, s3, s4]
+        # the coefficients in the order of OpenCV
+        if coefficients is not None:
+            coefficients = np.array(coefficients, dtype=float).ravel()
+            if len(coefficients) not in [4, 5, 8, 12]:
+                raise ValueError("OpenCV distortion coefficients need to have 4, 5, 8, or 12 entries, not %d."
+                                 % len(coefficients))
+            values = list(coefficients) + [None] * (len(values) - len(coefficients))
+        self.parameters = ParameterSet(**{name: Parameter(value, default=0, type=TYPE_DISTORTION)
+                                          for name, value in zip(self.parameter_names, values)})
+        for name in self.parameters.parameters:
+            self.parameters.parameters[name].callback = self._init_scale
+        self._init_scale()
+
+    def setProjection(self, projection):
+        self.projection = projection
+        parameters = {name: self.parameters.parameters[name] for name in self.parameter_names}
+        for name in ["image_width_px", "image_height_px", "focallength_x_px", "focallength_y_px", "center_x_px", "center_y_px"]:
+            parameters[name] = self.projection.parameters.parameters[name]
+        self.parameters = ParameterSet(**parameters)
+        for name in self.parameters.parameters:
+            self.parameters.parameters[name].callback = self._init_scale
+        self._init_scale()
+
+    def _init_scale(self):
+        if self.projection is not None:
+            self.scale = np.array([self.projection.focallength_x_px, self.projection.focallength_y_px])
+            self.offset = np.array([self.projection.center_x_px, self.projection.center_y_px])
+
+    def getCoefficients(self):
+        """
+        The distortion coefficients in the order used by OpenCV (k1, k2, p1, p2, k3, k4, k5, k6, s1, s2, s3, s4).
+
+        Returns
+        -------
+        coefficients : ndarray
+            the distortion coefficients, dimensions (12)
+        """
+        return np.array([getattr(self.parameters, name) for name in self.parameter_names], dtype=float)
+
+    def _distort(self, x, y):
+        k1, k2, p1, p2, k3, k4, k5, k6, s1, s2, s3, s4 = self.getCoefficients()
+        r2 = x * x + y * y
+        r4 = r2 * r2
+        radial = (1 + k1 * r2 + k2 * r4 + k3 * r4 * r2) / (1 + k4 * r2 + k5 * r4 + k6 * r4 * r2)
+        xy2 = 2 * x * y
+        return x * radial + p1 * xy2 + p2 * (r2 + 2 * x * x) + s1 * r2 + s2 * r4, \
+               y * radial + p1 * (r2 + 2 * y * y) + p2 * xy2 + s3 * r2 + s4 * r4
+
+    def imageFromDistorted(self, points):
+        # ensure that the points are provided as an array
+        # and rescale the points to that the center is at 0 and the border at 1
+        points = (np.array(points)-self.offset)/self.scale
+        k1, k2, p1, p2, k3, k4, k5, k6, s1, s2, s3, s4 = self.getCoefficients()
+        x_distorted, y_distorted = points[..., 0], points[..., 1]
+        x, y = x_distorted, y_distorted
+        # iteratively remove the tangential components and divide by the radial component
+        for i in range(self.iterations):
+            r2 = x * x + y * y
+            r4 = r2 * r2
+            radial_inverse = (1 + k4 * r2 + k5 * r4 + k6 * r4 * r2) / (1 + k1 * r2 + k2 * r4 + k3 * r4 * r2)
+            xy2 = 2 * x * y
+            x_new = (x_distorted - p1 * xy2 - p2 * (r2 + 2 * x * x) - s1 * r2 - s2 * r4) * radial_inverse
+            y_new = (y_distorted - p1 * (r2 + 2 * y * y) - p2 * xy2 - s3 * r2 - s4 * r4) * radial_inverse
+            delta = np.abs(np.array([x_new - x, y_new - y]))
+            x, y = x_new, y_new
+            # stop when all points converged (nan points compare as converged)
+            if not np.any(delta > self.tolerance):
+                break
+        points = np.stack([x, y], axis=-1)
+        # set nans to 0
+        points[np.isnan(points)] = 0
+        # rescale back to the image
+        return points * self.scale + self.offset
+
+    def distortedFromImage(self, points):
+        # ensure that the points are provided as an array
+        # and rescale the points to that the center is at 0 and the border at 1
+        points = (np.array(points)-self.offset)/self.scale
+        # transform the points
+        points = np.stack(self._distort(points[..., 0], points[..., 1]), axis=-1)
+        # set nans to 0
+        points[np.isnan(points)] = 0
+        # rescale back to the image
+        return points * self.scale + self.offset
@@ -18,9 +18,6 @@
 # along with cameratransform. If not, see <https://opensource.org/licenses/MIT>
 
 import numpy as np
-import pandas as pd
-from scipy.optimize import minimize
-import matplotlib.pyplot as plt
 from .statistic import metropolis, plotTrace, Model
 
 STATE_DEFAULT = 0
@@ -146,6 +143,10 @@ class ParameterSet(object):
         for call in callbacks:
             call()
 
+    def get_state(self):
+        # the current values of all parameters, e.g. to check whether cached data is still valid
+        return tuple(getattr(self, name) for name in self.parameters)
+
     def get_parameter_defaults(self, names):
         return [self.parameters[n].default for n in names]
 
@@ -244,6 +245,7 @@ class ClassWithParameterSet(object):
         return prob if not np.isnan(prob) else -np.inf
 
     def fit(self, parameter, **kwargs):
+        from scipy.optimize import minimize
         estimates = []
         names = []
         ranges = []
@@ -280,6 +282,7 @@ class ClassWithParameterSet(object):
         return p
 
     def metropolis(self, parameter, step=1, iterations=1e5, burn=0.1):
+        import pandas as pd
         start = []
         parameter_names = []
         additional_parameter_names = []
@@ -315,6 +318,7 @@ class ClassWithParameterSet(object):
         return trace
 
     def fridge(self, parameter, iterations=10000, **kwargs):
+        import pandas as pd
         if 1:
             import mock
             import sys
@@ -364,6 +368,7 @@ class ClassWithParameterSet(object):
         plotTrace(self.parameters.trace, **kwargs)
 
     def plotFitInformation(self, image=None):
+        import matplotlib.pyplot as plt
         if image is not None:
             plt.imshow(image)
         for func in self.info_plot_functions:
@@ -24,7 +24,7 @@ def my_inner(a, b):
     return np.einsum('...k,...k->...', a, b)
 
 
-def ray_intersect_triangle(origin, direction, triangle, use_planes=False):
+def ray_intersect_triangle(origin, direction, triangle, use_planes=False, chunk_size=None, max_memory=None):
     """
     This function can intersect R rays with T triangles and return the intersection points.
     source: http://geomalgorithms.com/a06-_intersect-2.html
@@ -39,6 +39,13 @@ def ray_intersect_triangle(origin, direction, triangle, use_planes=False):
         the triangle(s) to intersect the ray(s), dimensions: (3,3), or (T,3,3)
     use_planes : bool
         whether to allow intersections outside the triangle (or whether to interpret the triangle as a plane).
+    chunk_size : int, optional
+        the number of triangles to intersect with all rays at once. The triangles are processed in blocks of this
+        size, keeping only the nearest intersection of every ray, so that the memory needed does not grow with the
+        number of triangles. Default: all triangles at once.
+    max_memory : int, optional
+        the approximate memory in bytes that may be used for the intermediate arrays. Is used to choose the chunk_size
+        if no chunk_size is given.
 
     Returns
     -------
@@ -57,6 +64,29 @@ def ray_intersect_triangle(origin, direction, triangle, use_planes=False):
     if len(triangle.shape) == 2:
         triangle = triangle.reshape(1, *triangle.shape)
 
+    if chunk_size is None:
+        if max_memory is not None:
+            # the intermediate arrays need about 16 floats for every pair of a ray and a triangle
+            chunk_size = max(1, int(max_memory // (16 * 8 * len(direction))))
+        else:
+            chunk_size = max(1, len(triangle))
+
+    # iterate over blocks of triangles and keep the nearest intersection for every ray
+    factor = np.full(direction.shape[0], np.inf)
+    for start in range(0, len(triangle), chunk_size):
+        rI = _ray_intersect_triangle_factors(origin, direction, triangle[start:start + chunk_size], use_planes)
+        rI[np.isnan(rI)] = np.inf
+        factor = np.minimum(factor, np.min(rI, axis=0))
+    factor[np.isinf(factor)] = np.nan
+    point = origin + factor[..., None] * direction
+
+    if return_single:
+        return point[0]
+    return point
+
+
+def _ray_intersect_triangle_factors(origin, direction, triangle, use_planes):
+    # the factors of the direction vectors to reach the intersections, dimensions (T,R), nan where there is none
     v0 = triangle[..., 0, :]
     v1 = triangle[..., 1, :]
     v2 = triangle[..., 2, :]
@@ -66,7 +96,8 @@ def ray_intersect_triangle(origin, direction, triangle, use_planes=False):
     b = np.inner(normal, direction)
     a = my_inner(normal[..., None, :], v0[..., None, :] - origin[None, ..., :])
 
-    rI = a / b
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rI = a / b
     # ray is parallel to the plane
     rI[(b == 0.0)*(a != 0.0)] = np.nan
     # ray is parallel and lies in the plane
@@ -79,25 +110,183 @@ def ray_intersect_triangle(origin, direction, triangle, use_planes=False):
         w = origin + rI[..., None] * direction - v0[..., None, :]
         denom = my_inner(u, v) * my_inner(u, v) - my_inner(u, u) * my_inner(v, v)
 
-        si = (my_inner(u, v)[..., None] * my_inner(w, v[..., None, :]) - my_inner(v, v)[..., None] * my_inner(w, u[..., None, :])) / denom[:, None]
-        rI[((si < 0)+(si > 1.0)).astype(bool)] = np.nan
+        with np.errstate(divide="ignore", invalid="ignore"):
+            si = (my_inner(u, v)[..., None] * my_inner(w, v[..., None, :]) - my_inner(v, v)[..., None] * my_inner(w, u[..., None, :])) / denom[:, None]
+            rI[((si < 0)+(si > 1.0)).astype(bool)] = np.nan
 
-        ti = (my_inner(u, v)[..., None] * my_inner(w, u[..., None, :]) - my_inner(u, u)[..., None] * my_inner(w, v[..., None, :])) / denom[:, None]
-        rI[((ti < 0.0) + (si + ti > 1.0)).astype(bool)] = np.nan
+            ti = (my_inner(u, v)[..., None] * my_inner(w, u[..., None, :]) - my_inner(u, u)[..., None] * my_inner(w, v[..., None, :])) / denom[:, None]
+            rI[((ti < 0.0) + (si + ti > 1.0)).astype(bool)] = np.nan
+    return rI
 
-    def nanargmin(a, axis):
-        from numpy.lib.nanfunctions import _replace_nan
-        a, mask = _replace_nan(a, np.inf)
-        res = np.argmin(a, axis=axis)
-        return res
 
-    index = nanargmin(rI, axis=0)
-    rI = rI[index, np.arange(len(index))]
-    point = origin + rI[..., None] * direction
+class BoundingVolumeHierarchy:
+    """
+    A bounding volume hierarchy (a binary tree of axis aligned bounding boxes) of a triangle mesh. The hierarchy is
+    built once and can then be used to intersect batches of rays with the mesh. In contrast to
+    :py:func:`ray_intersect_triangle`, the rays are only tested against triangles whose bounding boxes they hit, so
+    neither time nor memory scale with the product of rays and triangles.
 
-    if return_single:
-        return point[0]
-    return point
+    Parameters
+    ----------
+    triangles : ndarray
+        the triangles of the mesh, consisting of three 3D points each, dimensions: (3,3), or (T,3,3)
+    leaf_size : int, optional
+        the maximal number of triangles stored in a leaf of the tree, at least 1, default 8
+
+    Examples
+    --------
+
+    >>> import cameratransform as ct
+    >>> cam = ct.Camera(ct.RectilinearProjection(focallength_px=3729, image=(4608, 2592)),
+    >>>                    ct.SpatialOrientation(elevation_m=15.4, tilt_deg=85))
+
+    build the hierarchy once and use it for all further projections onto the mesh:
+
+    >>> mesh = ct.ray.BoundingVolumeHierarchy(triangles)
+    >>> cam.spaceFromImage([[1968, 2291], [1650, 2189]], mesh=mesh)
+    """
+
+    def __init__(self, triangles, leaf_size=8):
+        if leaf_size < 1:
+            raise ValueError("The leaf size has to be at least 1, not %s." % leaf_size)
+        triangles = np.array(triangles, dtype=float)
+        if len(triangles.shape) == 2:
+            triangles = triangles.reshape(1, *triangles.shape)
+
+        centroids = np.mean(triangles, axis=1)
+        triangles_min = np.min(triangles, axis=1)
+        triangles_max = np.max(triangles, axis=1)
+        # pad the boxes slightly, so that flat boxes (e.g. of a horizontal triangle) are reliably hit
+        padding = 1e-9 * max(1, np.max(np.abs(triangles))) if len(triangles) else 0
+
+        # the order of the triangles, the leafs of the tree reference continuous ranges of this order
+        order = np.arange(len(triangles))
+        nodes_min, nodes_max, nodes_left, nodes_right, nodes_start, nodes_count = [], [], [], [], [], []
+
+        def addNode(start, end):
+            indices = order[start:end]
+            nodes_min.append(np.min(triangles_min[indices], axis=0) - padding)
+            nodes_max.append(np.max(triangles_max[indices], axis=0) + padding)
+            nodes_left.append(-1)
+            nodes_right.append(-1)
+            nodes_start.append(start)
+            nodes_count.append(end - start)
+            return len(nodes_min) - 1
+
+        stack = [addNode(0, len(triangles))] if len(triangles) else []
+        while stack:
+            node = stack.pop()
+            start, count = nodes_start[node], nodes_count[node]
+            # small nodes remain leafs
+            if count <= leaf_size:
+                continue
+            # split the node at the median of the axis where the centroids have the largest extent
+            indices = order[start:start + count]
+            axis = np.argmax(np.ptp(centroids[indices], axis=0))
+            half = count // 2
+            order[start:start + count] = indices[np.argpartition(centroids[indices, axis], half)]
+            nodes_left[node] = addNode(start, start + half)
+            nodes_right[node] = addNode(start + half, start + count)
+            stack.extend([nodes_left[node], nodes_right[node]])
+
+        self.nodes_min = np.array(nodes_min).reshape(-1, 3)
+        self.nodes_max = np.array(nodes_max).reshape(-1, 3)
+        self.nodes_left = np.array(nodes_left, dtype=int)
+        self.nodes_right = np.array(nodes_right, dtype=int)
+        self.nodes_start = np.array(nodes_start, dtype=int)
+        self.nodes_count = np.array(nodes_count, dtype=int)
+
+        # store the triangles in the order of the leafs (as origin and edge vectors)
+        self.triangle_index = order
+        self.triangles = triangles[order]
+        self.v0 = self.triangles[:, 0]
+        self.edge1 = self.triangles[:, 1] - self.v0
+        self.edge2 = self.triangles[:, 2] - self.v0
+
+    def _intersectTriangles(self, origin, direction, triangle):
+        # Möller-Trumbore intersection of each ray with the corresponding triangle
+        edge1 = self.edge1[triangle]
+        edge2 = self.edge2[triangle]
+        pvec = np.cross(direction, edge2)
+        det = my_inner(edge1, pvec)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inv_det = 1 / det
+            tvec = origin - self.v0[triangle]
+            u = my_inner(tvec, pvec) * inv_det
+            qvec = np.cross(tvec, edge1)
+            v = my_inner(direction, qvec) * inv_det
+            t = my_inner(edge2, qvec) * inv_det
+        valid = (det != 0) & (u >= 0) & (u <= 1) & (v >= 0) & (u + v <= 1) & (t >= 0)
+        return np.where(valid, t, np.inf)
+
+    def intersect(self, origin, direction, return_index=False):
+        """
+        Intersect the rays with the mesh and return the nearest intersection point for every ray.
+
+        Parameters
+        ----------
+        origin : ndarray
+            the origin point(s) of the ray(s), dimensions: (3) or (R,3)
+        direction : ndarray
+            the direction vector(s) of the ray(s), dimensions: (3) or (R,3)
+        return_index : bool, optional
+            whether to also return the index of the triangle that was hit (-1 if no triangle was hit).
+
+        Returns
+        -------
+        points : ndarray
+            the intersection point(s) of the ray(s) with the mesh, dimensions: (3) or (R,3). Points have nan values
+            when there is no intersection.
+        """
+        direction = np.array(direction, dtype=float)
+        return_single = len(direction.shape) == 1
+        direction = direction.reshape(-1, 3)
+        origin = np.broadcast_to(np.array(origin, dtype=float), direction.shape)
+
+        best_t = np.full(len(direction), np.inf)
+        best_triangle = np.full(len(direction), -1)
+
+        # the pairs of rays and nodes that still have to be tested, start with every ray at the root node
+        rays = np.arange(len(direction)) if len(self.nodes_min) else np.zeros(0, dtype=int)
+        nodes = np.zeros(len(rays), dtype=int)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inv_direction = 1 / direction
+        while len(rays):
+            # slab test of the rays with the boxes of the nodes
+            with np.errstate(invalid="ignore"):
+                t1 = (self.nodes_min[nodes] - origin[rays]) * inv_direction[rays]
+                t2 = (self.nodes_max[nodes] - origin[rays]) * inv_direction[rays]
+            # nan values occur for rays parallel to a slab starting at its border, these do not restrict the ray
+            t_enter = np.max(np.nan_to_num(np.fmin(t1, t2), nan=-np.inf), axis=1)
+            t_exit = np.min(np.nan_to_num(np.fmax(t1, t2), nan=np.inf), axis=1)
+            hit = (t_exit >= np.maximum(t_enter, 0)) & (t_enter <= best_t[rays])
+            rays, nodes = rays[hit], nodes[hit]
+
+            # test the rays with all triangles of the leafs they reached
+            leaf = self.nodes_left[nodes] < 0
+            leaf_rays, leaf_nodes = rays[leaf], nodes[leaf]
+            counts = self.nodes_count[leaf_nodes]
+            pair = np.repeat(np.arange(len(leaf_rays)), counts)
+            triangle = self.nodes_start[leaf_nodes][pair] + np.arange(len(pair)) - np.repeat(np.cumsum(counts) - counts, counts)
+            ray_candidates = leaf_rays[pair]
+            t = self._intersectTriangles(origin[ray_candidates], direction[ray_candidates], triangle)
+            np.minimum.at(best_t, ray_candidates, t)
+            winner = (t == best_t[ray_candidates]) & np.isfinite(t)
+            best_triangle[ray_candidates[winner]] = triangle[winner]
+
+            # descend to the children of the inner nodes
+            rays, nodes = rays[~leaf], nodes[~leaf]
+            rays = np.concatenate((rays, rays))
+            nodes = np.concatenate((self.nodes_left[nodes], self.nodes_right[nodes]))
+
+        best_t[np.isinf(best_t)] = np.nan
+        points = origin + best_t[:, None] * direction
+        index = np.where(best_triangle >= 0, self.triangle_index[np.maximum(best_triangle, 0)] if len(self.triangle_index) else -1, -1)
+        if return_single:
+            points, index = points[0], index[0]
+        if return_index:
+            return points, index
+        return points
 
 
 def intersectionOfTwoLines(p1, v1, p2, v2):
@@ -144,6 +333,56 @@ def intersectionOfTwoLines(p1, v1, p2, v2):
         return np.mean([p1 + res[..., 0] * v1, p2 + res[..., 1] * v2], axis=0)[0]
 
 
+def intersectionOfLines(origins, directions, mask=None):
+    """
+    Get the point closest to the intersection of K lines in the least squares sense, i.e. the point with the minimal sum
+    of squared distances to the lines. A batch of N points can be processed at once, every point is computed from the
+    K lines that are not masked out.
+
+    Parameters
+    ----------
+    origins : ndarray
+        the origin points of the lines, dimensions: (Kx3), (KxNx3)
+    directions : ndarray
+        the direction vectors of the lines, dimensions: (Kx3), (KxNx3)
+    mask : ndarray, optional
+        which lines to use for each point, dimensions: (K), (KxN). Default: all lines.
+
+    Returns
+    -------
+    intersection : ndarray
+        the intersection point(s), nan if less than two lines are available or if they are parallel, dimensions: (3),
+        (Nx3)
+    """
+    directions = np.asarray(directions, dtype=float)
+    return_single = len(directions.shape) == 2
+    if return_single:
+        directions = directions[:, None, :]
+    origins = np.broadcast_to(np.asarray(origins, dtype=float).reshape(directions.shape[0], -1, 3), directions.shape)
+    if mask is None:
+        mask = np.ones(directions.shape[:2], dtype=bool)
+    mask = np.broadcast_to(np.asarray(mask, dtype=bool).reshape(directions.shape[0], -1), directions.shape[:2])
+    mask = mask & np.all(np.isfinite(directions), axis=2) & np.all(np.isfinite(origins), axis=2)
+
+    # the projection matrices onto the planes perpendicular to the lines, I - v v^T with normalized v
+    with np.errstate(divide="ignore", invalid="ignore"):
+        v = directions / np.linalg.norm(directions, axis=2)[..., None]
+    v = np.where(mask[..., None], v, 0)
+    projection = np.eye(3) - v[..., :, None] * v[..., None, :]
+    projection[~mask] = 0
+    # sum the normal equations of all lines and solve the 3x3 systems of all points at once
+    A = np.sum(projection, axis=0)
+    b = np.sum(np.einsum("knij,knj->kni", projection, np.where(mask[..., None], origins, 0)), axis=0)
+    # systems with less than two (non-parallel) lines are singular
+    valid = (np.sum(mask, axis=0) >= 2) & (np.abs(np.linalg.det(A)) > 1e-12)
+    A[~valid] = np.eye(3)
+    intersection = np.linalg.solve(A, b[..., None])[..., 0]
+    intersection[~valid] = np.nan
+    if return_single:
+        return intersection[0]
+    return intersection
+
+
 def distanceOfTwoLines(p1, v1, p2, v2):
     """
     The distance between two lines. The lines are given by one point (p1 and p2) and a direction vector v (v1 and v2).
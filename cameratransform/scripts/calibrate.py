@@ -22,11 +22,12 @@ camera calibration for distorted images with chess board samples
 reads distorted images, calculates the calibration and write undistorted images
 
 usage:
-    calibrate.py [--debug <output path>] [--square_size] [<image mask>]
+    calibrate.py [--debug <output path>] [--square_size] [--full_model] [<image mask>]
 
 default values:
     --debug:    ./output/
     --square_size: 1.0
+    --full_model: fit also the rational (k4-k6) and thin prism (s1-s4) coefficients
     <image mask> defaults to ../data/left*.jpg
 '''
 
@@ -103,7 +104,7 @@ def processImage(fn, pattern_size, w=None, h=None, pattern_points=None, output_d
 
 if __name__ == '__main__':
     # load the arguments
-    args, img_mask = getopt.getopt(sys.argv[1:], '', ['debug=', 'square_size=', 'threads='])
+    args, img_mask = getopt.getopt(sys.argv[1:], '', ['debug=', 'square_size=', 'threads=', 'full_model'])
     args = dict(args)
     args.setdefault('--debug', './output/')
     args.setdefault('--square_size', 1.0)
@@ -161,16 +162,21 @@ if __name__ == '__main__':
 
     # calculate camera distortion
     print("fit calibration...")
+    flags = 0
+    if '--full_model' in args:
+        flags |= cv.CALIB_RATIONAL_MODEL | cv.CALIB_THIN_PRISM_MODEL
     rms, camera_matrix, dist_coefs, rvecs, tvecs = cv.calibrateCamera(obj_points, img_points, (w, h), None, None,
-                                                                      flags=cv.CALIB_ZERO_TANGENT_DIST)
+                                                                      flags=flags)
 
-    # split the fitted components
-    k1, k2, t1, t2, k3 = dist_coefs.ravel()
+    # split the fitted components (the order is k1, k2, p1, p2, k3[, k4, k5, k6[, s1, s2, s3, s4]])
+    coefficients = dist_coefs.ravel()
+    names = ["k1", "k2", "p1", "p2", "k3", "k4", "k5", "k6", "s1", "s2", "s3", "s4"]
     print("\nRMS:", rms)
     print("camera matrix:\n", camera_matrix.astype("int"))
-    print("distortion coefficients: ", dist_coefs.ravel())
-    print("focallength_x_px=%f, focallength_y_px=%f, center_x_px=%d, center_y_px=%d, k1=%f, k2=%f, k3=%f"
-          % (camera_matrix[0, 0], camera_matrix[1, 1], camera_matrix[0, 2], camera_matrix[1, 2], k1, k2, k3))
+    print("distortion coefficients: ", coefficients)
+    print("focallength_x_px=%f, focallength_y_px=%f, center_x_px=%d, center_y_px=%d"
+          % (camera_matrix[0, 0], camera_matrix[1, 1], camera_matrix[0, 2], camera_matrix[1, 2]))
+    print("OpenCVLensDistortion(%s)" % ", ".join("%s=%f" % (name, value) for name, value in zip(names, coefficients)))
 
     # undistort the image with the calibration
     print('')
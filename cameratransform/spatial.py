@@ -22,6 +22,52 @@ from .parameter_set import ParameterSet, Parameter, ClassWithParameterSet, TYPE_
 import json
 
 
+def rotationMatrix(tilt_deg, roll_deg, heading_deg):
+    r"""
+    The rotation matrices :math:`R = R_{\mathrm{roll}} \cdot R_{\mathrm{tilt}} \cdot R_{\mathrm{heading}}` (see
+    :py:class:`SpatialOrientation`) for arrays of angles, e.g. for the orientations of a pan-tilt-zoom camera in every
+    frame of a video. All matrices are computed at once.
+
+    Parameters
+    ----------
+    tilt_deg : number, ndarray
+        the tilt angles in degrees, dimensions scalar, (N)
+    roll_deg : number, ndarray
+        the roll angles in degrees, dimensions scalar, (N)
+    heading_deg : number, ndarray
+        the heading angles in degrees, dimensions scalar, (N)
+
+    Returns
+    -------
+    R : ndarray
+        the rotation matrices from **space** to **camera** coordinates, dimensions (3x3), (Nx3x3)
+
+    Examples
+    --------
+
+    >>> import cameratransform as ct
+    >>> R = ct.rotationMatrix(tilt_deg=[85, 80, 75], roll_deg=0, heading_deg=[0, 10, 20])
+    >>> R.shape
+    (3, 3, 3)
+    """
+    tilt, roll, heading = np.broadcast_arrays(np.deg2rad(tilt_deg), np.deg2rad(roll_deg), np.deg2rad(heading_deg))
+    sin_tilt, cos_tilt = np.sin(tilt), np.cos(tilt)
+    sin_roll, cos_roll = np.sin(roll), np.cos(roll)
+    sin_head, cos_head = np.sin(heading), np.cos(heading)
+    # the product of the roll, tilt and heading matrices written out
+    return np.moveaxis(np.array([
+        [cos_roll * cos_head + sin_roll * cos_tilt * sin_head,
+         -cos_roll * sin_head + sin_roll * cos_tilt * cos_head,
+         sin_roll * sin_tilt],
+        [-sin_roll * cos_head + cos_roll * cos_tilt * sin_head,
+         sin_roll * sin_head + cos_roll * cos_tilt * cos_head,
+         cos_roll * sin_tilt],
+        [-sin_tilt * sin_head,
+         -sin_tilt * cos_head,
+         cos_tilt],
+    ]), (0, 1), (-2, -1))
+
+
 class SpatialOrientation(ClassWithParameterSet):
     r"""
     The orientation can be represented as a matrix multiplication in *projective coordinates*. First, we define rotation
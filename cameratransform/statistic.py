@@ -18,10 +18,7 @@
 # along with cameratransform. If not, see <https://opensource.org/licenses/MIT>
 
 import numpy as np
-from scipy import stats
 from math import log10, floor
-import matplotlib.pyplot as plt
-import tqdm
 
 
 def print_mean_std(x, y):
@@ -56,6 +53,7 @@ class normal_bounded(np.ndarray):
         self.max = max
 
     def __add__(self, other):
+        from scipy import stats
         try:
             return stats.truncnorm.rvs((self.min-other)/self.sigma, (self.max-other)/self.sigma, other, self.sigma, size=other.shape)
         except AttributeError:
@@ -66,6 +64,7 @@ class normal_bounded(np.ndarray):
 
 
 def metropolis(getLogProb, start, step=1, iterations=1e5, burn=0.1, prior_trace=None):
+    import tqdm
     if burn < 1:
         burn = int(iterations*burn)
     else:
@@ -153,6 +152,7 @@ def metropolis(getLogProb, start, step=1, iterations=1e5, burn=0.1, prior_trace=
 
 
 def plotTrace(trace, N=None, show_mean_median=True, axes=None, just_distributions=False, skip=1):
+    import matplotlib.pyplot as plt
     from scipy.stats import gaussian_kde
 
     def getAxes(name, N, width):
@@ -261,6 +261,7 @@ class FitParameter:
     dtype = float
 
     def __init__(self, name, distribution=None, lower=None, upper=None, step=1, value=None, mean=None, std=None):
+        from scipy import stats
         self.__name__ = name
         if distribution is not None:
             self.distribution = distribution
@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# topview.py
+
+# Copyright (c) 2017-2019, Richard Gerum
+#
+# This file is part of the cameratransform package.
+#
+# cameratransform is free software: you can redistribute it and/or modify
+# it under the terms of the MIT licence.
+#
+# cameratransform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the license
+# along with cameratransform. If not, see <https://opensource.org/licenses/MIT>
+
+import copy
+import threading
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .heightmap import HeightMap
+
+
+class TopViewPyramid(object):
+    """
+    A multi-resolution top view of a camera image, split into square tiles (like the tiles of a web map). The tiles of
+    level L have a pixel size of scaling * 2**L m, level 0 being the finest level. Tiles are projected with
+    :py:meth:`~cameratransform.Camera.getTopViewOfImage` when they are first needed and the most recently used tiles
+    are kept in a cache. Top views of any extent and scaling are composed from the tiles of the level that has at
+    least the requested resolution, so zoomed out views only project coarse tiles. For cameras which need a projected
+    grid (see :py:meth:`~cameratransform.Camera.getTopViewOfImage`), the grids of the tiles are cached by the pyramid
+    as well, so they are kept for new images and do not replace the cached grid of the camera.
+
+    The tile (L, x, y) covers the **space** coordinates x * tile_size * scaling * 2**L to
+    (x + 1) * tile_size * scaling * 2**L, and the same for y. The first row of a tile has the largest y coordinate.
+    The cached tiles are cleared when the image or the parameters of the camera change, the cached grids when the
+    parameters of the camera or the heights of the height map (see :py:meth:`~cameratransform.HeightMap.update`) change.
+
+    Parameters
+    ----------
+    camera : :py:class:`~cameratransform.Camera`
+        the camera which took the image.
+    image : ndarray
+        the image of the camera.
+    scaling : number
+        the side length in m of the pixels of the finest level.
+    Z : number, :py:class:`~cameratransform.HeightMap`, optional
+        the height of the plane on which to project or the terrain, default 0
+    tile_size : int, optional
+        the side length of the tiles in pixels, default 256
+    max_tiles : int, optional
+        the maximal number of tiles to keep in the cache, default 256
+
+    Examples
+    --------
+
+    >>> import cameratransform as ct
+    >>> cam = ct.Camera(ct.RectilinearProjection(focallength_px=3729, image=(4608, 2592)),
+    >>>                    ct.SpatialOrientation(elevation_m=15.4, tilt_deg=85))
+    >>> pyramid = ct.TopViewPyramid(cam, image, scaling=0.05)
+
+    get an overview of the area in front of the camera and a detailed view of a part of it:
+
+    >>> overview = pyramid.getTopView([-150, 150, 0, 300], scaling=0.5)
+    >>> detail = pyramid.getTopView([-10, 10, 40, 60], scaling=0.05)
+    """
+    last_state = None
+
+    def __init__(self, camera, image, scaling, Z=0, tile_size=256, max_tiles=256):
+        self.camera = camera
+        self.scaling = scaling
+        self.Z = Z
+        self.tile_size = int(tile_size)
+        self.max_tiles = int(max_tiles)
+        self.tiles = OrderedDict()
+        self.maps = OrderedDict()
+        self.setImage(image)
+
+    def _getState(self):
+        # the maps depend on the camera and on the heights
+        return self.camera._getParameterState() + (getattr(self.Z, "version", None),)
+
+    def setImage(self, image):
+        """
+        Set a new image (e.g. the next frame of a video) and clear the cached tiles.
+
+        Parameters
+        ----------
+        image : ndarray
+            the image of the camera.
+        """
+        # add the alpha channel once, instead of for every tile in getTopViewOfImage
+        if len(image.shape) == 3 and image.shape[2] == 3:
+            image = np.dstack((image, np.ones(shape=(image.shape[0], image.shape[1], 1), dtype="uint8") * 255))
+        self.image = image
+        self.tiles.clear()
+        state = self._getState()
+        if state != self.last_state:
+            self.maps.clear()
+            self.last_state = state
+
+    def getLevel(self, scaling):
+        """
+        The level of the pyramid which is used for top views with the given scaling, i.e. the coarsest level which
+        has at least the requested resolution.
+
+        Parameters
+        ----------
+        scaling : number
+            the side length of the pixels of the top view in m.
+
+        Returns
+        -------
+        level : int
+            the level of the pyramid.
+        """
+        # a small tolerance, so that the scalings of the levels themselves give their level
+        return max(int(np.floor(np.log2(scaling / self.scaling) + 1e-9)), 0)
+
+    def getTileExtent(self, level, x, y):
+        """
+        The extent of a tile in **space** coordinates.
+
+        Parameters
+        ----------
+        level : int
+            the level of the tile.
+        x, y : int
+            the index of the tile.
+
+        Returns
+        -------
+        extent : list
+            the extent of the tile [x_min, x_max, y_min, y_max]
+        """
+        size = self.tile_size * self.scaling * 2 ** level
+        return [x * size, (x + 1) * size, y * size, (y + 1) * size]
+
+    def getTile(self, level, x, y):
+        """
+        The top view of a tile, projected when it is first requested and then taken from the cache.
+
+        Parameters
+        ----------
+        level : int
+            the level of the tile.
+        x, y : int
+            the index of the tile.
+
+        Returns
+        -------
+        tile : ndarray
+            the top view of the tile, dimensions (tile_size x tile_size) plus the channels of the top view.
+        """
+        # the cached tiles are not valid any more if the camera or the heights have changed
+        state = self._getState()
+        if state != self.last_state:
+            self.tiles.clear()
+            self.maps.clear()
+            self.last_state = state
+
+        key = (level, x, y)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+
+        scaling = self.scaling * 2 ** level
+        x_min, x_max, y_min, y_max = self.getTileExtent(level, x, y)
+        # end the extent half a pixel before the next tile, so that rounding can not add a pixel
+        extent = [x_min, x_max - 0.5 * scaling, y_min, y_max - 0.5 * scaling]
+        if self.camera._isUndistortedRectilinear() and np.ndim(self.Z) == 0 and not isinstance(self.Z, HeightMap):
+            # the image is warped with the ground homography, no grid is needed
+            tile = self.camera.getTopViewOfImage(self.image, extent, scaling=scaling, Z=self.Z, skip_size_check=True)
+        else:
+            import cv2
+            tile = cv2.remap(self.image, *self._getMap(key, extent, scaling), interpolation=cv2.INTER_NEAREST,
+                             borderValue=[0, 1, 0, 0])
+        self._addToCache(self.tiles, key, tile)
+        return tile
+
+    def _getMap(self, key, extent, scaling):
+        # the projected grid of a tile, the same as Camera._getMap, but cached for every tile
+        if key in self.maps:
+            self.maps.move_to_end(key)
+            return self.maps[key]
+        extent, scaling = self.camera._getTopViewExtent(extent, scaling, self.Z)
+        x0, top, width, height = self.camera._getTopViewGrid(extent, scaling)
+        tile_map = self.camera._projectGrid(np.arange(height)[:, None], np.arange(width)[None, :], x0, top, scaling,
+                                            self.Z).astype(np.float32)
+        self._addToCache(self.maps, key, tile_map)
+        return tile_map
+
+    def _addToCache(self, cache, key, value):
+        cache[key] = value
+        # remove the least recently used entries
+        while len(cache) > self.max_tiles:
+            cache.popitem(last=False)
+
+    def getTopView(self, extent, scaling, do_plot=False, alpha=None):
+        """
+        Compose a top view of the given extent from the tiles of the pyramid. The pixels of the top view are taken
+        from the nearest pixels of the level given by :py:meth:`getLevel`. As in
+        :py:meth:`~cameratransform.Camera.getTopViewOfImage`, x_min and y_min are rounded to multiples of the scaling.
+
+        Parameters
+        ----------
+        extent : list
+            the extent of the top view in m: [x_min, x_max, y_min, y_max].
+        scaling : number
+            the side length of the pixels of the top view in m.
+        do_plot : bool, optional
+            whether to directly plot the resulting image in a matplotlib figure.
+        alpha : number, optional
+            an alpha value used when plotting the image.
+
+        Returns
+        -------
+        image : ndarray
+            the top view of the extent
+        """
+        level = self.getLevel(scaling)
+        level_scaling = self.scaling * 2 ** level
+
+        # the grid of the top view, aligned to multiples of the scaling
+        x0 = int(np.round(extent[0] / scaling))
+        y0 = int(np.round(extent[2] / scaling))
+        width = max(int(np.ceil((extent[1] - x0 * scaling) / scaling)), 0)
+        height = max(int(np.ceil((extent[3] - y0 * scaling) / scaling)), 0)
+        # the nearest pixels of the level (the first row has the largest y coordinate)
+        columns = np.floor((x0 + np.arange(width)) * scaling / level_scaling + 0.5).astype(int)
+        rows = np.floor((y0 + height - 1 - np.arange(height)) * scaling / level_scaling + 0.5).astype(int)
+
+        image = None
+        tile_columns, tile_rows = columns // self.tile_size, rows // self.tile_size
+        for x in np.unique(tile_columns):
+            for y in np.unique(tile_rows):
+                tile = self.getTile(level, x, y)
+                if image is None:
+                    image = np.zeros((height, width) + tile.shape[2:], dtype=tile.dtype)
+                index_x = np.where(tile_columns == x)[0]
+                index_y = np.where(tile_rows == y)[0]
+                image[np.ix_(index_y, index_x)] = tile[np.ix_(self.tile_size - 1 - rows[index_y] % self.tile_size,
+                                                              columns[index_x] % self.tile_size)]
+        if image is None:
+            image = np.zeros((height, width) + self.image.shape[2:], dtype=self.image.dtype)
+
+        if do_plot:
+            import matplotlib.pyplot as plt
+            plt.imshow(image, extent=[x0 * scaling, (x0 + width) * scaling, y0 * scaling, (y0 + height) * scaling],
+                       alpha=alpha)
+        return image
+
+
+class TopViewBuilder(object):
+    """
+    Builds the map of a top view of a camera in a background thread, so that a change of the camera parameters does
+    not block the projection of images. When the parameters change, a coarse map with a pixel size of
+    coarse_factor * scaling is calculated immediately and its top views are upsampled until the full map is ready.
+
+    The map is built for a copy of the camera, so the camera can be changed while the map is being built. The
+    :py:meth:`update` method returns a :py:class:`concurrent.futures.Future` of the full map, in asyncio code it can be
+    awaited with :py:func:`asyncio.wrap_future`.
+
+    Parameters
+    ----------
+    camera : :py:class:`~cameratransform.Camera`
+        the camera which takes the images.
+    extent : list, optional
+        the extent of the top view in m: [x_min, x_max, y_min, y_max], see
+        :py:meth:`~cameratransform.Camera.getTopViewOfImage`.
+    scaling : number, optional
+        the side length of the pixels of the top view in m, see :py:meth:`~cameratransform.Camera.getTopViewOfImage`.
+    Z : number, ndarray, :py:class:`~cameratransform.HeightMap`, optional
+        the height of the plane on which to project or the terrain, see
+        :py:meth:`~cameratransform.Camera.getTopViewOfImage`, default 0
+    coarse_factor : int, optional
+        the size of the pixels of the coarse map in pixels of the top view, default 8
+    executor : :py:class:`concurrent.futures.Executor`, optional
+        the executor to build the maps, e.g. to share one between multiple cameras. Default: a thread pool with one
+        thread for this builder, which is shut down by :py:meth:`close` (or when the builder is used as a context
+        manager).
+
+    Examples
+    --------
+
+    >>> import cameratransform as ct
+    >>> cam = ct.Camera(ct.RectilinearProjection(focallength_px=3729, image=(4608, 2592)),
+    >>>                    ct.SpatialOrientation(elevation_m=15.4, tilt_deg=85))
+    >>> builder = ct.TopViewBuilder(cam, [-150, 150, 50, 300], scaling=0.1)
+
+    after changing the camera, the top view is directly available from a coarse map:
+
+    >>> cam.tilt_deg = 80
+    >>> top_view = builder.getTopViewOfImage(image)
+
+    and the full map can be awaited:
+
+    >>> await asyncio.wrap_future(builder.update())
+    >>> top_view = builder.getTopViewOfImage(image)
+    >>> builder.close()
+    """
+    # the current map, whether it is the full map, the shape of the full map and its extent, replaced as a whole
+    current = (None, False, None, None)
+    generation = 0
+    future = None
+    last_state = None
+
+    def __init__(self, camera, extent=None, scaling=None, Z=0, coarse_factor=8, executor=None):
+        self.camera = camera
+        self.extent = extent
+        self.scaling = scaling
+        self.Z = Z
+        self.coarse_factor = int(coarse_factor)
+        self.own_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=1)
+        self.executor = executor
+        self.lock = threading.Lock()
+
+    @property
+    def map(self):
+        return self.current[0]
+
+    @property
+    def full(self):
+        return self.current[1]
+
+    @property
+    def shape(self):
+        return self.current[2]
+
+    @property
+    def last_extent(self):
+        return self.current[3]
+
+    def close(self):
+        """
+        Cancel the map that is being built and shut down the executor, if it was created by the builder.
+        """
+        if self.future is not None:
+            self.future.cancel()
+        if self.own_executor:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _getState(self):
+        # the map depends on the camera and on the heights
+        return self.camera._getParameterState() + (getattr(self.Z, "version", None),)
+
+    def _getSnapshot(self):
+        # copy the parts of the camera together, so that the lens of the copy stays linked to the copied projection
+        projection, orientation, lens = copy.deepcopy((self.camera.projection, self.camera.orientation, self.camera.lens))
+        return type(self.camera)(projection, orientation, lens)
+
+    def _getCoarseMap(self, camera, extent, scaling):
+        # the grid of the map, as in Camera._getMap, the first row has the largest y coordinate
+        k = self.coarse_factor
+        x0, top, width, height = camera._getTopViewGrid(extent, scaling)
+
+        # every pixel of the coarse map covers k x k pixels of the map, project the centers of these blocks
+        columns = np.arange(-(-width // k)) * k + (k - 1) / 2
+        rows = np.arange(-(-height // k)) * k + (k - 1) / 2
+        points = np.empty((len(rows), len(columns), 3))
+        points[..., 0] = (x0 + columns) * scaling
+        points[..., 1] = (top - rows[:, None]) * scaling
+        points[..., 2] = camera._getGridHeights(self.Z, rows[:, None], columns[None, :], x0, top, scaling)
+        return camera.imageFromSpace(points.reshape(-1, 3)).T.reshape((2,) + points.shape[:2]).astype(np.float32)
+
+    def update(self):
+        """
+        Start building the map if the parameters of the camera or the heights of the height map have changed since
+        the last update. Until the map is built, a coarse map is used.
+
+        Returns
+        -------
+        future : :py:class:`concurrent.futures.Future`
+            the future of the full map
+        """
+        state = self._getState()
+        if state == self.last_state:
+            return self.future
+
+        camera = self._getSnapshot()
+        extent, scaling = camera._getTopViewExtent(self.extent, self.scaling, self.Z)
+        coarse_map = self._getCoarseMap(camera, extent, scaling)
+        x0, top, width, height = camera._getTopViewGrid(extent, scaling)
+
+        with self.lock:
+            # maps of previous updates are not needed anymore, their generation is outdated before the coarse map
+            # of this update is used
+            self.generation += 1
+            generation = self.generation
+            if self.future is not None:
+                self.future.cancel()
+            future = self.executor.submit(camera._getMap, extent, scaling, self.Z)
+            self.future = future
+            self.current = (coarse_map, False, (height, width), extent)
+            self.last_state = state
+
+        def done(future):
+            if future.cancelled() or future.exception() is not None:
+                return
+            # only use the map if no newer update has been started in the meantime
+            with self.lock:
+                if generation == self.generation:
+                    self.current = (future.result(), True, (height, width), extent)
+        future.add_done_callback(done)
+        return future
+
+    def getTopViewOfImage(self, image, do_plot=False, alpha=None):
+        """
+        Project an image to the top view with the current map (see
+        :py:meth:`~cameratransform.Camera.getTopViewOfImage`). If the full map for the current camera parameters is
+        not yet built, the coarse map is used.
+
+        Parameters
+        ----------
+        image : ndarray
+            the image as a numpy array.
+        do_plot : bool, optional
+            whether to directly plot the resulting image in a matplotlib figure.
+        alpha : number, optional
+            an alpha value used when plotting the image.
+
+        Returns
+        -------
+        image : ndarray
+            the top view projected image
+        """
+        import cv2
+        self.update()
+        # the map and its properties are read together, as the full map can be set by another thread
+        (x, y), full, shape, extent = self.current
+        # ensure that the image has an alpha channel (to enable alpha for the points outside the image)
+        if len(image.shape) == 3 and image.shape[2] == 3:
+            image = np.dstack((image, np.ones(shape=(image.shape[0], image.shape[1], 1), dtype="uint8") * 255))
+        image = cv2.remap(image, x, y, interpolation=cv2.INTER_NEAREST, borderValue=[0, 1, 0, 0])
+        if not full:
+            # every pixel of the coarse top view covers k x k pixels of the top view
+            k = self.coarse_factor
+            image = cv2.resize(image, (image.shape[1] * k, image.shape[0] * k),
+                               interpolation=cv2.INTER_NEAREST)[:shape[0], :shape[1]]
+        if do_plot:
+            import matplotlib.pyplot as plt
+            plt.imshow(image, extent=extent, alpha=alpha)
+        return image
@@ -26,14 +26,15 @@ setup(name='cameratransform',
       author_email='richard.gerum@fau.de',
       license='MIT',
       packages=['cameratransform'],
+      # the coordinate transformations only need numpy, everything else is optional
       install_requires=[
           'numpy',
-          'pandas',
-          'scipy',
-          'tqdm'
       ],
       extras_require={
-        'projecting_top_view':  ["cv2", "matplotlib"],
-        'exif_extraction':  ["pillow", "requests"]
+        'fitting': ["scipy", "pandas", "tqdm"],
+        'plotting': ["matplotlib"],
+        'projecting_top_view':  ["opencv-python", "matplotlib"],
+        'exif_extraction':  ["pillow", "requests"],
+        'all': ["scipy", "pandas", "tqdm", "matplotlib", "opencv-python", "pillow", "requests"],
       }
       )
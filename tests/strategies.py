@@ -115,7 +115,8 @@ def orientation(draw, elevation=st.floats(0, 1000), tilt_deg=st.floats(0, 90), r
 
 
 def lens():
-    return st.one_of(st.just(ct.NoDistortion), st.just(ct.BrownLensDistortion), st.just(ct.ABCDistortion))
+    return st.one_of(st.just(ct.NoDistortion), st.just(ct.BrownLensDistortion), st.just(ct.ABCDistortion),
+                     st.just(ct.OpenCVLensDistortion))
 
 
 @st.composite
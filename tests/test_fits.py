@@ -137,6 +137,36 @@ class TestFits(unittest.TestCase):
         camera.plotFitInformation(im)
 
 
+    def test_bundleAdjustment(self):
+        random = np.random.RandomState(1234)
+        orientations = [dict(pos_x_m=random.uniform(-20, 20), pos_y_m=random.uniform(-20, 0), elevation_m=random.uniform(5, 15),
+                             heading_deg=random.uniform(-10, 10), tilt_deg=random.uniform(75, 85)) for i in range(4)]
+        camGroup = ct.CameraGroup(ct.RectilinearProjection(focallength_px=2000, image=(4000, 3000)),
+                                  [ct.SpatialOrientation(**orientation) for orientation in orientations])
+        points_space = np.array([random.uniform(-30, 30, 200), random.uniform(40, 120, 200), random.uniform(-2, 5, 200)]).T
+        points = np.array(camGroup.imagesFromSpace(points_space), dtype=float)
+        visibility = random.rand(4, 200) > 0.3
+
+        # disturb the heading and tilt of the cameras and refine them again (the first camera is fixed)
+        parameters = ["C%d_%s" % (i, name) for i in range(1, 4) for name in ["heading_deg", "tilt_deg"]]
+        for i in range(1, 4):
+            camGroup[i].heading_deg += random.normal(0, 1)
+            camGroup[i].tilt_deg += random.normal(0, 1)
+        result = camGroup.bundleAdjustment(points, visibility, parameters=parameters, iterations=0)
+        self.assertEqual(result.nit, 0)
+        self.assertFalse(result.success)
+        result = camGroup.bundleAdjustment(points, visibility, parameters=parameters)
+
+        self.assertTrue(result.success)
+        self.assertLess(result.error, 1e-3)
+        for i in range(1, 4):
+            self.assertAlmostEqual(camGroup[i].heading_deg, orientations[i]["heading_deg"], 3)
+            self.assertAlmostEqual(camGroup[i].tilt_deg, orientations[i]["tilt_deg"], 3)
+        valid = np.sum(visibility, axis=0) >= 2
+        np.testing.assert_almost_equal(result.points[valid], points_space[valid], 2)
+        self.assertTrue(np.all(np.isnan(result.points[~valid])))
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -118,6 +118,71 @@ class TestParameterSet(unittest.TestCase):
             difference_angle += 360
         np.testing.assert_almost_equal(difference_angle, 0, 0)
 
+    @given(st.floats(-80, 80), st.floats(-180, 180), st.floats(0, 100),
+           st.lists(st.tuples(st.floats(1, 5000), st.floats(-180, 180), st.floats(0, 100)), min_size=1, max_size=10))
+    def test_localFrame(self, lat, lon, height, moves):
+        gps0 = np.array([lat, lon, height])
+        distance, bearing, point_height = np.array(moves).T
+        gps = ct.moveDistance(gps0, distance, bearing)
+        gps[:, 2] = point_height
+
+        # the frame gives the same points as the distance and bearing to the reference position
+        space = ct.LocalFrame(gps0).spaceFromGPS(gps)
+        distance = ct.getDistance(gps0, gps)
+        bearing = np.deg2rad(ct.getBearing(gps0, gps))
+        np.testing.assert_almost_equal(space, np.array([distance * np.sin(bearing), distance * np.cos(bearing), point_height]).T, 6)
+
+        # and moving the distance in the direction of the bearing
+        gps_2 = ct.LocalFrame(gps0).gpsFromSpace(space)
+        bearing = np.rad2deg(np.arctan2(space[:, 0], space[:, 1]))
+        np.testing.assert_almost_equal(gps_2[:, :2], ct.moveDistance(gps0, np.linalg.norm(space[:, :2], axis=1), bearing)[:, :2])
+
+        # the camera keeps its frame until the gps position changes
+        cam = ct.Camera(ct.RectilinearProjection(focallength_px=1000, image=(100, 100)), ct.SpatialOrientation(elevation_m=height))
+        cam.setGPSpos(lat, lon)
+        frame = cam._getLocalFrame()
+        np.testing.assert_almost_equal(cam.spaceFromGPS(gps), space, 6)
+        self.assertIs(cam._getLocalFrame(), frame)
+        cam.elevation_m = height + 1
+        self.assertIsNot(cam._getLocalFrame(), frame)
+
+    @given(st.floats(-90, 90), st.floats(-180, 180), st.floats(-500, 9000),
+           st_np.arrays(np.float64, (10, 3), elements=st.floats(-5000, 5000)))
+    def test_wgs84(self, lat, lon, height, space):
+        # known points of the ellipsoid
+        np.testing.assert_almost_equal(ct.ecefFromGPS([0, 0, 0]), [ct.WGS84_a, 0, 0], 6)
+        np.testing.assert_almost_equal(ct.ecefFromGPS([90, 0, 0]), [0, 0, ct.WGS84_b], 6)
+
+        # the closed form inverse
+        gps = ct.gpsFromECEF(ct.ecefFromGPS([lat, lon, height]))
+        np.testing.assert_almost_equal(gps[0], lat, 8)
+        np.testing.assert_almost_equal(gps[2], height, 4)
+        if abs(lat) < 89.9:
+            np.testing.assert_almost_equal(np.sin(np.deg2rad(gps[1] - lon)), 0, 8)
+
+        # the local frame converts back and forth
+        frame = ct.LocalFrame([lat, lon, height], earth_model="wgs84")
+        np.testing.assert_almost_equal(frame.spaceFromGPS(frame.gpsFromSpace(space)), space, 4)
+        # the axes point east, north and up
+        np.testing.assert_almost_equal(frame.spaceFromGPS([lat, lon, 10]), [0, 0, 10], 4)
+        if abs(lat) < 80:
+            east = frame.spaceFromGPS([lat, lon + 1e-4, 0])
+            self.assertGreater(east[0], abs(east[1]) * 100)
+
+        self.assertRaises(ValueError, lambda: ct.LocalFrame([lat, lon], earth_model="flat"))
+
+    def test_cameraEarthModel(self):
+        cam = ct.Camera(ct.RectilinearProjection(focallength_px=3729, image=(4608, 2592)),
+                        ct.SpatialOrientation(elevation_m=15.4, tilt_deg=85))
+        cam.setGPSpos(52.51666667, 13.4)
+        points = [[1968, 2291], [1650, 2189], [2304, 1340]]
+        gps_sphere = cam.gpsFromImage(points)
+        cam.earth_model = "wgs84"
+        gps_wgs84 = cam.gpsFromImage(points)
+        # the models differ only slightly
+        np.testing.assert_almost_equal(gps_wgs84[:, :2], gps_sphere[:, :2], 4)
+        np.testing.assert_almost_equal(cam.imageFromGPS(gps_wgs84), points, 4)
+
     def test_gpsDifferentFormats(self):
         ct.gpsFromString("060° 37′ 36″")
         ct.gpsFromString("85° 19′ 14″ N, 000° 02′ 43″ E")
@@ -132,6 +197,21 @@ class TestParameterSet(unittest.TestCase):
 
         gps_tuple = ct.gpsFromString([["66°39'56.12862''S  140°01'20.39562''", 13.769], ["66°39'58.73922''S  140°01'09.55709''", 13.769]])
 
+    @given(st.lists(st.tuples(st.floats(-90, 90), st.floats(-90, 90)), min_size=1, max_size=10),
+           st.sampled_from(["%2d° %2d' %6.3f\" %s", "%2d° %2.3f' %s", "%2.3f°"]))
+    def test_gpsFromStrings(self, positions, format):
+        gps_strings = [" ".join(ct.formatGPS(lat, lon, format=format)) for lat, lon in positions]
+        # the bulk parser returns the same values as the single string parser
+        points, failed = ct.gpsFromStrings(gps_strings)
+        np.testing.assert_almost_equal(points, [ct.gpsFromString(s) for s in gps_strings])
+        np.testing.assert_equal(failed, False)
+
+        # invalid strings give nan rows and are marked as failed
+        points, failed = ct.gpsFromStrings(gps_strings + ["no position", ""], height=10)
+        np.testing.assert_equal(failed, [False] * len(positions) + [True, True])
+        np.testing.assert_almost_equal(points[:len(positions), 2], 10)
+        self.assertTrue(np.all(np.isnan(points[len(positions):])))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -95,6 +95,41 @@ class TestParameterSet(unittest.TestCase):
         cone_image[cone_image[:, 1] == 0] = np.nan
         assert np.all(np.isnan(cone_image))
 
+    def test_generateLUT(self):
+        cameras = [ct.Camera(ct.RectilinearProjection(focallength_px=50, image=(40, 30)),
+                             ct.SpatialOrientation(elevation_m=10, tilt_deg=60)),
+                   ct.Camera(ct.RectilinearProjection(focallength_px=40, image=(40, 30)),
+                             ct.SpatialOrientation(elevation_m=3, tilt_deg=50, roll_deg=5, heading_deg=30),
+                             ct.BrownLensDistortion(0.1, 0.02))]
+        for cam in cameras:
+            # the area of every pixel projected separately
+            x, y = np.meshgrid(np.arange(40), np.arange(30))
+            squares = np.array([x, y]).T.reshape(-1, 1, 2) + np.array([[-0.5, -0.5], [0.5, -0.5], [0.5, 0.5], [-0.5, 0.5]])
+            area = ct.ray.areaOfQuadrilateral(cam.spaceFromImage(squares.reshape(-1, 2)).reshape(-1, 4, 3))
+            area = area.reshape(40, 30).T
+            area[np.isnan(area)] = 0
+
+            for chunk_size in [1, 7, None]:
+                LUT = cam.generateLUT(whole_image=True, chunk_size=chunk_size)
+                self.assertEqual(LUT.dtype, np.float32)
+                np.testing.assert_allclose(LUT, area, rtol=1e-4)
+                np.testing.assert_allclose(cam.generateLUT(chunk_size=chunk_size), LUT[:, 20], rtol=1e-4)
+
+                # the area from the derivatives of the rays is close to the area of the projected pixels
+                LUT_jacobian = cam.generateLUT(whole_image=True, method="jacobian", chunk_size=chunk_size)
+                np.testing.assert_allclose(LUT_jacobian, LUT, rtol=0.02)
+
+    def test_groundBorderCache(self):
+        cam = ct.Camera(ct.RectilinearProjection(focallength_px=300, image=(64, 48)),
+                        ct.SpatialOrientation(elevation_m=10, tilt_deg=60))
+        border = cam._getGroundBorder()
+        np.testing.assert_almost_equal(border, cam.spaceFromImage(cam.getImageBorder()))
+        # the cached border is reused as long as the parameters do not change
+        self.assertIs(cam._getGroundBorder(), border)
+        cam.tilt_deg = 70
+        np.testing.assert_almost_equal(cam._getGroundBorder(), cam.spaceFromImage(cam.getImageBorder()))
+        np.testing.assert_almost_equal(cam._getGroundBorder(Z=1), cam.spaceFromImage(cam.getImageBorder(), Z=1))
+
     @given(ct_st.camera())
     def test_cameraOrigin(self, cam):
         origin, ray = cam.getRay([0, 0])
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# test_imports.py
+
+# Copyright (c) 2017-2019, Richard Gerum
+#
+# This file is part of the cameratransform package.
+#
+# cameratransform is free software: you can redistribute it and/or modify
+# it under the terms of the MIT licence.
+#
+# cameratransform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the license
+# along with cameratransform. If not, see <https://opensource.org/licenses/MIT>
+
+import sys
+import os
+import unittest
+import subprocess
+
+# the packages which should only be imported when they are used
+optional_modules = ["matplotlib", "cv2", "pandas", "scipy", "tqdm"]
+
+
+def importInNewProcess(statement):
+    # import in a fresh interpreter and return the loaded optional modules
+    code = "import sys\n" \
+           "%s\n" \
+           "print(','.join(name for name in %r if name in sys.modules))" % (statement, optional_modules)
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    modules = output.decode().splitlines()[-1]
+    return [name for name in modules.split(",") if name]
+
+
+def importTimes(statement):
+    # the cumulative import times in us of the modules imported by the statement, measured with python -X importtime
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], stderr=subprocess.PIPE, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stderr
+    times = {}
+    for line in output.decode().splitlines():
+        if line.startswith("import time:") and not line.endswith("package"):
+            self_time, cumulative, name = line[len("import time:"):].split("|")
+            times.setdefault(name.strip(), int(cumulative))
+    return times
+
+
+class TestImports(unittest.TestCase):
+
+    def test_lazyImports(self):
+        # importing the package does not import the plotting, OpenCV, pandas or fitting dependencies
+        self.assertEqual(importInNewProcess("import cameratransform"), [])
+        # and the package itself takes less time to import than numpy (the fastest of three runs, to reduce the noise)
+        own_times, numpy_times = [], []
+        for i in range(3):
+            times = importTimes("import cameratransform")
+            own_times.append(times["cameratransform"] - times["numpy"])
+            numpy_times.append(times["numpy"])
+        self.assertLess(min(own_times), min(numpy_times))
+        # neither does creating a camera and transforming points
+        self.assertEqual(importInNewProcess("import cameratransform as ct\n"
+                                            "cam = ct.Camera(ct.RectilinearProjection(focallength_px=3729, image=(4608, 2592)))\n"
+                                            "cam.spaceFromImage([[1968, 2291]])"), [])
+
+    def test_numpyOnly(self):
+        # the coordinate transformations work when only numpy is installed
+        code = "import sys\n" \
+               "sys.modules.update((name, None) for name in %r)\n" \
+               "import numpy as np\n" \
+               "import cameratransform as ct\n" \
+               "for lens in [ct.NoDistortion(), ct.BrownLensDistortion(0.1, 0.02), ct.ABCDistortion(0.01, 0.02, 0.03),\n" \
+               "             ct.OpenCVLensDistortion(0.1, 0.01, 0.001, 0.002)]:\n" \
+               "    cam = ct.Camera(ct.RectilinearProjection(focallength_px=3729, image=(4608, 2592)),\n" \
+               "                    ct.SpatialOrientation(elevation_m=15.4, tilt_deg=85), lens)\n" \
+               "    cam.setGPSpos(\"66°39'53.4\\\"S  140°00'34.8\\\"\")\n" \
+               "    points = [[1968, 2291], [1650, 2189]]\n" \
+               "    np.testing.assert_almost_equal(cam.imageFromSpace(cam.spaceFromImage(points)), points, 3)\n" \
+               "    cam.imageFromGPS(cam.gpsFromImage(points))\n" \
+               "    cam.spaceFromImage(points, dem=ct.HeightMap(np.zeros((10, 10)), [-50, 50, 0, 100]))\n" \
+               "    cam.generateLUT()\n" \
+               "print(','.join(name for name in %r if sys.modules.get(name) is not None))" % (optional_modules, optional_modules)
+        output = subprocess.check_output([sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(output.decode().strip(), "")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -106,6 +106,63 @@ class TestParameterSet(unittest.TestCase):
             except Exception:
                 np.testing.assert_almost_equal(origin, intersection)
 
+    @given(st.integers(0, 2**16), st.integers(1, 60), st.integers(1, 10))
+    def test_rayIntersectTriangleChunked(self, seed, count, chunk_size):
+        random = np.random.RandomState(seed)
+        triangles = random.uniform(-10, 10, size=(count, 3, 3))
+        origin = np.array([0.1, 0.2, 20])
+        directions = random.uniform(-1, 1, size=(20, 3))
+        directions[:, 2] = -1
+        # processing the triangles in blocks has to give the same nearest intersections
+        intersection = ct.ray.ray_intersect_triangle(origin, directions, triangles)
+        np.testing.assert_almost_equal(ct.ray.ray_intersect_triangle(origin, directions, triangles, chunk_size=chunk_size), intersection)
+        np.testing.assert_almost_equal(ct.ray.ray_intersect_triangle(origin, directions, triangles, max_memory=chunk_size * 1e4), intersection)
+
+    @given(st.integers(0, 2**16), st.integers(1, 60), st.integers(1, 8))
+    def test_boundingVolumeHierarchy(self, seed, count, leaf_size):
+        random = np.random.RandomState(seed)
+        # triangles with a real area at different heights
+        triangles = random.uniform(-10, 10, size=(count, 1, 3)) + np.array([[0, 0, 0], [3.7, 0.5, 0.3], [1.7, 4.5, -0.3]])
+        origin = np.array([0.1, 0.2, 20])
+        directions = random.uniform(-0.7, 0.7, size=(20, 3))
+        directions[:, 2] = -1
+
+        mesh = ct.ray.BoundingVolumeHierarchy(triangles, leaf_size=leaf_size)
+        # leafs without triangles would split the nodes forever
+        self.assertRaises(ValueError, lambda: ct.ray.BoundingVolumeHierarchy(triangles, leaf_size=0))
+        points, index = mesh.intersect(origin, directions, return_index=True)
+        # compare with the brute force intersection of the rays with all triangles
+        for point, i, direction in zip(points, index, directions):
+            intersection = ct.ray.ray_intersect_triangle(origin, direction, triangles)
+            np.testing.assert_almost_equal(point, intersection, 6)
+            if np.any(np.isnan(point)):
+                self.assertEqual(i, -1)
+            else:
+                np.testing.assert_almost_equal(ct.ray.ray_intersect_triangle(origin, direction, triangles[i]), point, 6)
+
+    @given(st.floats(-0.3, 0.3), st.floats(-0.3, 0.3), st.floats(-5, 5), st.integers(2, 40), st.integers(1, 8))
+    def test_heightMap(self, slope_x, slope_y, offset, size, patch_size):
+        # a tilted plane is exactly represented by the bilinear interpolation of the height map
+        extent = [-50, 50, 0, 100]
+        x, y = np.meshgrid(np.linspace(-50, 50, size + 1)[:-1] + 50 / size, np.linspace(100, 0, size + 1)[:-1] - 50 / size)
+        dem = ct.HeightMap(slope_x * x + slope_y * y + offset, extent, patch_size=patch_size)
+
+        origin = np.array([1, -10, 40])
+        directions = np.array(np.meshgrid(np.linspace(-0.5, 0.5, 5), [1], np.linspace(-0.1, -1, 5))).reshape(3, -1).T
+        points = dem.intersect(origin, directions)
+
+        # the intersection with the plane
+        normal = np.array([-slope_x, -slope_y, 1])
+        factor = (offset - np.dot(origin, normal)) / np.dot(directions, normal)
+        expected = origin + factor[:, None] * directions
+        # only compare between the outermost cell centers, the border half cells are clamped
+        border = 50 / size
+        inside = (factor > 0) & (np.abs(expected[:, 0]) < 50 - border) & (np.abs(expected[:, 1] - 50) < 50 - border)
+        np.testing.assert_almost_equal(points[inside], expected[inside], 4)
+        # intersections have to lie on the terrain
+        valid = ~np.isnan(points[:, 0])
+        np.testing.assert_almost_equal(points[valid, 2], dem.getHeight(points[valid]), 4)
+
     @given(ct_st.lines())
     def test_lineDistance(self, line):
         p1, v1, p2, v2, center, distance, c1, c2 = line
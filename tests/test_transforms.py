@@ -24,10 +24,12 @@ import unittest
 import numpy as np
 import sys
 import os
+import warnings
 
-from hypothesis import given, reproduce_failure, assume, note, strategies as st
+from hypothesis import given, reproduce_failure, assume, note, settings, strategies as st
 from hypothesis.extra import numpy as st_np
 import uuid
+import itertools
 
 import mock
 
@@ -126,11 +128,13 @@ class TestTransforms(unittest.TestCase):
 
     @given(ct_st.camera())
     def test_saveLoad(self, cam):
+        cam.earth_model = "wgs84"
         with TempFile() as filename:
             cam.save(filename)
             cam2 = ct.load_camera(filename)
             for key in cam.parameters.parameters:
                 self.assertAlmostEqual(getattr(cam, key), getattr(cam2, key), 3)
+            self.assertEqual(cam2.earth_model, "wgs84")
 
             cam.projection.save(filename)
             cam2.focallength = 999
@@ -165,6 +169,44 @@ class TestTransforms(unittest.TestCase):
         pos2 = np.round(cam.lens.imageFromDistorted(pos1)).astype(int)
         np.testing.assert_almost_equal(pos2, pos0, 0, err_msg="Transforming from distorted to undistorted image fails.")
 
+    @given(ct_st.projection(), st_np.arrays(dtype="float", shape=(12,), elements=st.floats(-0.01, 0.01)))
+    def test_lensOpenCV(self, proj, coefficients):
+        cam = ct.Camera(projection=proj, lens=ct.OpenCVLensDistortion(coefficients=coefficients))
+        y = [proj.image_height_px*0.5]*100
+        x = np.linspace(0, 1, 100)*proj.image_width_px
+        pos0 = np.array([x, y]).T
+        pos1 = cam.lens.distortedFromImage(pos0)
+        pos2 = cam.lens.imageFromDistorted(pos1)
+        np.testing.assert_almost_equal(pos2, pos0, 2, err_msg="Transforming from distorted to undistorted image fails.")
+
+        # points with more dimensions keep their shape
+        np.testing.assert_almost_equal(cam.lens.distortedFromImage(pos0.reshape(2, 50, 2)), pos1.reshape(2, 50, 2))
+        np.testing.assert_almost_equal(cam.lens.imageFromDistorted(pos1.reshape(2, 50, 2)), pos2.reshape(2, 50, 2))
+        # points which are all nan do not warn during the inversion
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            np.testing.assert_equal(cam.lens.imageFromDistorted(np.full((3, 2), np.nan)), [[proj.center_x_px, proj.center_y_px]] * 3)
+
+        # the coefficients have to survive saving and loading
+        with TempFile() as filename:
+            cam.save(filename)
+            cam2 = ct.load_camera(filename)
+            self.assertIsInstance(cam2.lens, ct.OpenCVLensDistortion)
+            np.testing.assert_almost_equal(cam2.lens.getCoefficients(), coefficients)
+            np.testing.assert_almost_equal(cam2.lens.distortedFromImage(pos0), pos1)
+
+        # compare with the implementation of OpenCV
+        try:
+            import cv2
+            K = np.array([[proj.focallength_x_px, 0, proj.center_x_px], [0, proj.focallength_y_px, proj.center_y_px], [0, 0, 1]])
+        except ImportError:
+            return
+        if isinstance(cv2, mock.MagicMock):
+            return
+        normed = np.hstack(((pos0 - [proj.center_x_px, proj.center_y_px]) / [proj.focallength_x_px, proj.focallength_y_px], np.ones((100, 1))))
+        pos1_cv2 = cv2.projectPoints(normed, np.zeros(3), np.zeros(3), K, coefficients)[0][:, 0]
+        np.testing.assert_almost_equal(pos1, pos1_cv2, 4, err_msg="Distortion does not match OpenCV.")
+
     @given(ct_st.camera_image_points(), st.floats(0, 100))
     def test_transWorldToCam(self, params, Z):
         cam, p = params
@@ -207,6 +249,431 @@ class TestTransforms(unittest.TestCase):
             np.testing.assert_almost_equal(p, p2, 1, err_msg="Transforming from camera to world and back doesn't return "
                                                          "the original point.")
 
+    @given(ct_st.camera_image_points(camera=ct_st.camera(projection=ct_st.projection(projection_type=st.just(ct.RectilinearProjection)))),
+           st.floats(-10, 10))
+    def test_groundHomography(self, params, Z):
+        cam, p = params
+        assume(abs(Z - cam.elevation_m) > 1e-3)
+        p = np.array(p, dtype=float).reshape(-1, 2)
+        # the same points as with the intersection of the rays with the plane
+        offset, direction = cam.getRay(p)
+        factor = (Z - offset[2]) / direction[:, 2]
+        points = offset + direction * factor[:, None]
+        points[factor < 0] = np.nan
+        # rays nearly parallel to the plane are ill-conditioned in both calculations
+        steep = np.abs(direction[:, 2]) > 1e-3 * np.linalg.norm(direction, axis=1)
+        np.testing.assert_allclose(cam.spaceFromImage(p, Z=Z)[steep], points[steep], rtol=1e-6, atol=1e-6)
+
+        # the homography maps the points back to the image
+        H = cam.getGroundHomography(Z)
+        image = np.dot(np.hstack((points[:, :2], np.ones((len(p), 1)))), H.T)
+        self.assertTrue(np.all(image[~np.isnan(points[:, 0]), 2] > 0))
+        np.testing.assert_almost_equal((image[:, :2] / image[:, 2:])[steep], np.where(np.isnan(points[:, :2]), np.nan, p)[steep], 1)
+
+        # lenses with zero distortion coefficients have the same homography
+        for lens in [ct.BrownLensDistortion(0, 0, 0), ct.ABCDistortion(0, 0, 0), ct.OpenCVLensDistortion(0, 0, 0, 0)]:
+            np.testing.assert_almost_equal(ct.Camera(cam.projection, cam.orientation, lens).getGroundHomography(Z), H)
+
+        # for distorted lenses there is no homography
+        cam = ct.Camera(cam.projection, cam.orientation, ct.BrownLensDistortion(0.1))
+        self.assertRaises(ValueError, lambda: cam.getGroundHomography(Z))
+
+    @given(st.floats(0, 30), st.floats(-180, 180))
+    @settings(deadline=None)
+    def test_topViewHomography(self, tilt, heading):
+        try:
+            import cv2
+        except ImportError:
+            return
+        if isinstance(cv2, mock.MagicMock):
+            return
+        cam = ct.Camera(ct.RectilinearProjection(focallength_px=100, image=(160, 120)),
+                        ct.SpatialOrientation(elevation_m=10, tilt_deg=60 + tilt, heading_deg=heading))
+        y, x = np.mgrid[0:120, 0:160]
+        image = np.dstack((x, y, x + y)).astype(np.uint8)
+        # the warped top view matches the top view from the projected grid
+        top_view = cam.getTopViewOfImage(image, [-50, 50, -50, 50], scaling=0.5)
+        self.assertIsNone(cam.map)
+        x, y = cam._getMap(extent=[-50, 50, -50, 50], scaling=0.5)
+        top_view2 = cv2.remap(np.dstack((image, np.full((120, 160), 255, np.uint8))), x, y,
+                              interpolation=cv2.INTER_NEAREST, borderValue=[0, 1, 0, 0])
+        self.assertEqual(top_view.shape, top_view2.shape)
+        # pixels exactly between two image pixels may be rounded differently
+        self.assertLess(np.mean(np.any(top_view != top_view2, axis=2)), 0.01)
+
+    @given(st.lists(st.tuples(st.integers(-30, 30), st.integers(-30, 30)), min_size=1, max_size=5))
+    def test_topViewPan(self, pans):
+        def getCamera():
+            return ct.Camera(ct.RectilinearProjection(focallength_px=100, image=(160, 120)),
+                             ct.SpatialOrientation(elevation_m=10, tilt_deg=70), ct.BrownLensDistortion(0.1))
+        cam = getCamera()
+        cam._getMap(extent=[-20, 20, 0, 40], scaling=0.5)
+        # count the number of points that are projected
+        projected = []
+        imageFromSpace = cam.imageFromSpace
+        cam.imageFromSpace = lambda points: projected.append(len(points)) or imageFromSpace(points)
+        x, y = 0, 0
+        for dx, dy in pans:
+            x, y = x + dx * 0.5, y + dy * 0.5
+            extent = [-20 + x, 20 + x, y, 40 + y]
+            projected.clear()
+            # the panned map is the same as a new map, but only the new strips are projected
+            np.testing.assert_equal(cam._getMap(extent=extent, scaling=0.5), getCamera()._getMap(extent=extent, scaling=0.5))
+            self.assertEqual(sum(projected), 80 * 80 - max(80 - abs(dx), 0) * max(80 - abs(dy), 0))
+
+        # extents are aligned to the grid of the scaling
+        np.testing.assert_equal(cam._getMap(extent=[-20.1, 20, 0.2, 40], scaling=0.5),
+                                getCamera()._getMap(extent=[-20, 20, 0, 40], scaling=0.5))
+
+    @given(st.sampled_from([lambda: ct.NoDistortion(), lambda: ct.BrownLensDistortion(0.1)]), st.integers(0, 2),
+           st.integers(-20, 20), st.integers(-20, 20))
+    @settings(deadline=None)
+    def test_topViewPyramid(self, lens, level, x, y):
+        try:
+            import cv2
+        except ImportError:
+            return
+        if isinstance(cv2, mock.MagicMock):
+            return
+        cam = ct.Camera(ct.RectilinearProjection(focallength_px=100, image=(160, 120)),
+                        ct.SpatialOrientation(elevation_m=10, tilt_deg=70), lens())
+        y_image, x_image = np.mgrid[0:120, 0:160]
+        image = np.dstack((x_image, y_image, x_image + y_image)).astype(np.uint8)
+        pyramid = ct.TopViewPyramid(cam, image, scaling=0.25, tile_size=16, max_tiles=20)
+
+        # the top view at the scaling of a level is the same as the direct top view
+        scaling = 0.25 * 2 ** level
+        self.assertEqual(pyramid.getLevel(scaling), level)
+        self.assertEqual(pyramid.getLevel(scaling * 1.5), level)
+        extent = [x * scaling, (x + 50) * scaling, y * scaling + 10, (y + 40) * scaling + 10]
+        top_view = pyramid.getTopView(extent, scaling)
+        # the pyramid keeps its own grids and does not replace the cached grid of the camera
+        self.assertIsNone(cam.map)
+        top_view2 = cam.getTopViewOfImage(image, extent, scaling=scaling)
+        self.assertEqual(top_view.shape, top_view2.shape)
+        # pixels exactly between two image pixels may be rounded differently by the homography of the tiles
+        self.assertLess(np.mean(np.any(top_view != top_view2, axis=2)), 0.01)
+        self.assertLessEqual(len(pyramid.tiles), 20)
+
+        # the tiles are cached until the camera changes
+        tile = pyramid.getTile(level, 0, 1)
+        self.assertIs(pyramid.getTile(level, 0, 1), tile)
+        x_min, x_max, y_min, y_max = pyramid.getTileExtent(level, 0, 1)
+        np.testing.assert_equal(tile, cam.getTopViewOfImage(image, [x_min, x_max - scaling / 2, y_min, y_max - scaling / 2], scaling=scaling))
+
+        # the grids of the tiles are kept for a new image
+        maps = dict(pyramid.maps)
+        pyramid.setImage(image[::-1, ::-1])
+        self.assertIsNot(pyramid.getTile(level, 0, 1), tile)
+        self.assertEqual(len(maps), len(pyramid.maps))
+        for key in maps:
+            self.assertIs(pyramid.maps[key], maps[key])
+        cam.heading_deg = 10
+        self.assertIsNot(pyramid.getTile(level, 0, 1), tile)
+
+    @given(st.floats(-2, 2), st.floats(-0.1, 0.1), st.integers(-30, 30))
+    def test_topViewTerrain(self, offset, slope, pan):
+        cam = ct.Camera(ct.RectilinearProjection(focallength_px=100, image=(160, 120)),
+                        ct.SpatialOrientation(elevation_m=10, tilt_deg=70), ct.BrownLensDistortion(0.1))
+        extent = [-20, 20, 10, 50]
+        # a raster or height map with a constant height is the same as a plane
+        flat = cam._getMap(extent=extent, scaling=0.5, Z=offset).copy()
+        np.testing.assert_almost_equal(cam._getMap(extent=extent, scaling=0.5, Z=np.full((80, 80), offset)), flat, 3)
+        dem = ct.HeightMap(np.full((10, 10), offset), [-100, 100, -100, 100])
+        np.testing.assert_almost_equal(cam._getMap(extent=extent, scaling=0.5, Z=dem), flat, 3)
+        self.assertRaises(ValueError, lambda: cam._getMap(extent=extent, scaling=0.5, Z=np.zeros((10, 10))))
+
+        # a sloped terrain projects every grid point at its height
+        x, y = np.meshgrid(np.linspace(-100, 100, 41), np.linspace(100, -100, 41))
+        dem = ct.HeightMap(offset + slope * (x + y), [-102.5, 102.5, -102.5, 102.5])
+        terrain_map = cam._getMap(extent=extent, scaling=0.5, Z=dem)
+        x, y = np.meshgrid(np.arange(-20, 20, 0.5), np.arange(10, 50, 0.5)[::-1])
+        points = np.array([x.ravel(), y.ravel(), offset + slope * (x.ravel() + y.ravel())]).T
+        np.testing.assert_almost_equal(terrain_map.reshape(2, -1).T, cam.imageFromSpace(points), 2)
+        np.testing.assert_almost_equal(dem.getHeightGrid(x[0], y[:, 0]), points[:, 2].reshape(x.shape))
+
+        # panning the terrain map only projects the new strips
+        projected = []
+        imageFromSpace = cam.imageFromSpace
+        cam.imageFromSpace = lambda points: projected.append(len(points)) or imageFromSpace(points)
+        extent2 = [-20 + pan * 0.5, 20 + pan * 0.5, 10, 50]
+        np.testing.assert_almost_equal(cam._getMap(extent=extent2, scaling=0.5, Z=dem),
+                                       ct.Camera(cam.projection, cam.orientation, cam.lens)._getMap(extent=extent2, scaling=0.5, Z=dem), 4)
+        self.assertEqual(sum(projected), 80 * min(abs(pan), 80))
+
+        # a raster is only projected where its heights changed
+        raster = np.full((80, 80), offset)
+        cam._getMap(extent=extent, scaling=0.5, Z=raster)
+        raster[10:20, 30:35] += 1
+        projected.clear()
+        cam._getMap(extent=extent, scaling=0.5, Z=raster)
+        self.assertEqual(sum(projected), 50)
+
+        # a height map is projected again after its heights are updated
+        terrain_map = cam._getMap(extent=extent, scaling=0.5, Z=dem).copy()
+        dem.data += 1
+        dem.update()
+        np.testing.assert_almost_equal(cam._getMap(extent=extent, scaling=0.5, Z=dem),
+                                       ct.Camera(cam.projection, cam.orientation, cam.lens)._getMap(extent=extent, scaling=0.5, Z=dem), 4)
+        self.assertFalse(np.allclose(cam._getMap(extent=extent, scaling=0.5, Z=dem), terrain_map))
+        dem.update(np.full((10, 10), offset))
+        np.testing.assert_almost_equal(cam._getMap(extent=extent, scaling=0.5, Z=dem), flat, 3)
+
+    @given(st.floats(-2, 2), st.floats(5, 20))
+    @settings(deadline=None)
+    def test_viewshed(self, offset, wall_height):
+        cam = ct.Camera(ct.RectilinearProjection(focallength_px=100, image=(160, 120)),
+                        ct.SpatialOrientation(elevation_m=10, tilt_deg=80))
+        extent = [-20, 20, 10, 90]
+        # on a flat terrain everything in the field of view is visible
+        flat = ct.HeightMap(np.full((100, 100), offset), [-100, 100, 0, 200])
+        visible = cam.viewshed(flat, extent, scaling=0.5)
+        x, y = np.meshgrid(np.arange(-20, 20, 0.5), np.arange(10, 90, 0.5)[::-1])
+        points = cam.imageFromSpace(np.array([x.ravel(), y.ravel(), np.full(x.size, offset)]).T)
+        in_image = (points[:, 0] >= 0) & (points[:, 0] <= 160) & (points[:, 1] >= 0) & (points[:, 1] <= 120)
+        np.testing.assert_equal(visible, in_image.reshape(x.shape))
+        self.assertIs(cam.viewshed(flat, extent, scaling=0.5), visible)
+
+        # a wall hides the terrain behind it
+        data = np.full((100, 100), offset)
+        data[60:65] = offset + wall_height
+        wall = ct.HeightMap(data, [-100, 100, 0, 200])
+        visible_wall = cam.viewshed(wall, extent, scaling=0.5)
+        self.assertFalse(np.any(visible_wall[y > 80]))
+        np.testing.assert_equal(visible_wall[y < 60], visible[y < 60])
+
+        # the viewshed is calculated again when the heights are updated
+        np.testing.assert_equal(cam.viewshed(flat, extent, scaling=0.5), visible)
+        flat.data[60:65] = offset + wall_height
+        flat.update()
+        np.testing.assert_equal(cam.viewshed(flat, extent, scaling=0.5), visible_wall)
+
+    def test_coverage(self):
+        # two cameras looking straight down, the lower one has the better resolution where both see the ground
+        cameras = [ct.Camera(ct.RectilinearProjection(focallength_px=100, image=(160, 120)),
+                             ct.SpatialOrientation(elevation_m=elevation, tilt_deg=0, pos_x_m=x))
+                   for elevation, x in [(10, 0), (20, 5)]]
+        count, resolution, camera_index = ct.getCoverage(cameras, [-30, 30, -30, 30], scaling=0.5, tile_size=17)
+        x, y = np.meshgrid(np.arange(-30, 30, 0.5), np.arange(-30, 30, 0.5)[::-1])
+        points = np.array([x.ravel(), y.ravel(), np.zeros(x.size)]).T
+        seen = []
+        for cam in cameras:
+            image_points = cam.imageFromSpace(points)
+            seen.append(((image_points[:, 0] >= 0) & (image_points[:, 0] <= 160) &
+                         (image_points[:, 1] >= 0) & (image_points[:, 1] <= 120)).reshape(x.shape))
+        np.testing.assert_equal(count, np.sum(seen, axis=0))
+        np.testing.assert_equal(camera_index, np.where(seen[0], 0, np.where(seen[1], 1, -1)))
+        np.testing.assert_almost_equal(resolution, np.where(seen[0], 0.1, np.where(seen[1], 0.2, np.nan)), 4)
+
+        # the tiles do not change the result
+        for result, result_tiled in zip(ct.getCoverage(cameras, [-30, 30, -30, 30], scaling=0.5),
+                                        (count, resolution, camera_index)):
+            np.testing.assert_equal(result, result_tiled)
+
+        # a distorted camera does not see the points behind it
+        cam = ct.Camera(ct.RectilinearProjection(focallength_px=100, image=(160, 120)),
+                        ct.SpatialOrientation(elevation_m=10, tilt_deg=80), ct.BrownLensDistortion(0.1))
+        count = ct.getCoverage([cam], [-50, 50, -50, 50], scaling=1)[0]
+        x, y = np.meshgrid(np.arange(-50, 50, 1.), np.arange(-50, 50, 1.)[::-1])
+        points = np.array([x.ravel(), y.ravel(), np.zeros(x.size)]).T
+        image_points = cam.imageFromSpace(points)
+        in_front = ~np.isnan(cam.projection.imageFromCamera(cam.orientation.cameraFromSpace(points))[:, 0])
+        seen = in_front & (image_points[:, 0] >= 0) & (image_points[:, 0] <= 160) & \
+               (image_points[:, 1] >= 0) & (image_points[:, 1] <= 120)
+        self.assertTrue(np.any(~in_front))
+        np.testing.assert_equal(count, seen.reshape(x.shape))
+
+    def test_footprintIndex(self):
+        # cameras looking down or at the horizon in different directions
+        rng = np.random.RandomState(0)
+        cameras = [ct.Camera(ct.RectilinearProjection(focallength_px=100, image=(160, 120)),
+                             ct.SpatialOrientation(elevation_m=rng.uniform(5, 20), tilt_deg=rng.uniform(0, 89),
+                                                   heading_deg=rng.uniform(0, 360), pos_x_m=rng.uniform(-200, 200),
+                                                   pos_y_m=rng.uniform(-200, 200))) for i in range(20)]
+        index = ct.FootprintIndex(cameras, z_range=(0, 5), max_distance=300)
+        points = np.array([rng.uniform(-300, 300, 5000), rng.uniform(-300, 300, 5000), rng.uniform(0, 5, 5000)]).T
+
+        def checkQuery(points):
+            # project the points to all cameras, the points within the maximal distance have to be found
+            point_index, camera_index, image_points = index.query(points)
+            pairs = list(zip(point_index, camera_index))
+            self.assertEqual(pairs, sorted(pairs))
+            for camera_index, cam in enumerate(cameras):
+                image_points = cam.imageFromSpace(points)
+                distance = (points - cam.orientation.t) @ cam.getRay([80, 60], normed=True)[1]
+                in_front = ~np.isnan(cam.projection.imageFromCamera(cam.orientation.cameraFromSpace(points))[:, 0])
+                visible = in_front & (image_points[:, 0] >= 0) & (image_points[:, 0] <= 160) & \
+                          (image_points[:, 1] >= 0) & (image_points[:, 1] <= 120)
+                found = np.isin(np.arange(len(points)), [p for p, c in pairs if c == camera_index])
+                self.assertFalse(np.any(found & ~visible))
+                self.assertFalse(np.any(visible & (distance <= 300) & ~found))
+
+        checkQuery(points)
+        point_index, camera_index, image_points = index.query(points)
+        np.testing.assert_almost_equal(image_points[0], cameras[camera_index[0]].imageFromSpace(points[point_index[0]]))
+        # only the candidates are projected
+        self.assertLess(len(index.getCandidates(points)[0]), len(points) * len(cameras) / 2)
+
+        # the footprints follow the cameras
+        cameras[0].heading_deg += 90
+        checkQuery(points)
+
+        # distorted cameras do not see the points behind them
+        cameras[:] = [ct.Camera(cam.projection, cam.orientation, ct.BrownLensDistortion(0.1)) for cam in cameras]
+        index = ct.FootprintIndex(cameras, z_range=(0, 5), max_distance=300)
+        checkQuery(points)
+
+    def test_visible(self):
+        rng = np.random.RandomState(0)
+        points = np.array([rng.uniform(-500, 500, 10000), rng.uniform(-500, 500, 10000), rng.uniform(0, 20, 10000)]).T
+        for projection, lens in [(ct.RectilinearProjection, None), (ct.RectilinearProjection, ct.BrownLensDistortion(0.2, 0.05)),
+                                 (ct.CylindricalProjection, None)]:
+            cam = ct.Camera(projection(focallength_px=100, image=(160, 120)),
+                            ct.SpatialOrientation(elevation_m=10, tilt_deg=80, heading_deg=30), lens)
+            # the points in the image and in front of the camera
+            image_points = cam.imageFromSpace(points)
+            in_front = ~np.isnan(cam.projection.imageFromCamera(cam.orientation.cameraFromSpace(points))[:, 0])
+            visible = in_front & (image_points[:, 0] >= 0) & (image_points[:, 0] <= 160) & \
+                      (image_points[:, 1] >= 0) & (image_points[:, 1] <= 120)
+            self.assertTrue(0 < np.sum(visible) < len(points))
+
+            np.testing.assert_equal(cam.visible(points), visible)
+            self.assertEqual(cam.visible(points[np.argmax(visible)]), True)
+            clipped = cam.imageFromSpace(points, clip_to_image=True)
+            np.testing.assert_equal(clipped[visible], image_points[visible])
+            self.assertTrue(np.all(np.isnan(clipped[~visible])))
+
+    def test_topViewBuilder(self):
+        try:
+            import cv2
+        except ImportError:
+            return
+        if isinstance(cv2, mock.MagicMock):
+            return
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        cam = ct.Camera(ct.RectilinearProjection(focallength_px=100, image=(160, 120)),
+                        ct.SpatialOrientation(elevation_m=10, tilt_deg=70), ct.BrownLensDistortion(0.1))
+        y, x = np.mgrid[0:120, 0:160]
+        image = np.dstack((x, y, x + y)).astype(np.uint8)
+        # block the executor, to check the state before the full map is built
+        executor = ThreadPoolExecutor(max_workers=1)
+        release = threading.Event()
+        executor.submit(release.wait)
+        builder = ct.TopViewBuilder(cam, [-20, 20, 10, 50], scaling=0.25, coarse_factor=4, executor=executor)
+
+        # the coarse map is used directly, its pixels are at the centers of 4x4 pixels of the full map
+        future = builder.update()
+        top_view = builder.getTopViewOfImage(image)
+        self.assertFalse(builder.full)
+        self.assertEqual(top_view.shape, (160, 160, 4))
+        full_map = cam._getMap([-20, 20, 10, 50], scaling=0.25)
+        np.testing.assert_allclose(builder.map, full_map.reshape(2, 40, 4, 40, 4)[:, :, 1:3, :, 1:3].mean(axis=(2, 4)), atol=0.5)
+
+        # a change of the camera starts a new map and the old one is not built
+        cam.heading_deg = 10
+        future2 = builder.update()
+        self.assertIsNot(future2, future)
+        self.assertTrue(future.cancelled())
+        self.assertIs(builder.update(), future2)
+        release.set()
+        future2.result()
+        executor.shutdown()
+        self.assertTrue(builder.full)
+        np.testing.assert_equal(builder.getTopViewOfImage(image), cam.getTopViewOfImage(image, [-20, 20, 10, 50], scaling=0.25))
+
+        # a build that finishes after a newer update does not replace the coarse map of the newer update
+        executor = ThreadPoolExecutor(max_workers=1)
+        release, release2 = threading.Event(), threading.Event()
+        executor.submit(release.wait)
+        with ct.TopViewBuilder(cam, [-20, 20, 10, 50], scaling=0.25, coarse_factor=4, executor=executor) as builder:
+            future = builder.update()
+            # the old build can not be cancelled anymore and finishes while the new one waits
+            future.cancel = lambda: False
+            blocker = executor.submit(release2.wait)
+            cam.heading_deg = 20
+            future2 = builder.update()
+            release.set()
+            future.result()
+            while not blocker.running():
+                pass
+            self.assertFalse(builder.full)
+            self.assertEqual(builder.getTopViewOfImage(image).shape, (160, 160, 4))
+            release2.set()
+            future2.result()
+            executor.shutdown()
+            self.assertTrue(builder.full)
+            np.testing.assert_equal(builder.map, cam._getMap([-20, 20, 10, 50], scaling=0.25))
+
+        # the own executor of a builder is shut down when it is closed
+        with ct.TopViewBuilder(cam, [-20, 20, 10, 50], scaling=0.25) as builder:
+            builder.update().result()
+        self.assertRaises(RuntimeError, lambda: builder.executor.submit(lambda: None))
+
+    @given(st.sampled_from([ct.RectilinearProjection, ct.CylindricalProjection, ct.EquirectangularProjection]),
+           st.sampled_from([lambda: ct.NoDistortion(), lambda: ct.BrownLensDistortion(0.1, 0.02),
+                            lambda: ct.OpenCVLensDistortion(0.1, 0.01, 0.001, 0.002)]),
+           st.sampled_from([np.float32, np.float64]), st.integers(0, 2**16))
+    def test_rayTable(self, projection, lens, dtype, seed):
+        random = np.random.RandomState(seed)
+        # a new lens for every example, as the camera links the lens to its projection
+        cam = ct.Camera(projection(focallength_px=300, image=(320, 240)), ct.SpatialOrientation(elevation_m=10, tilt_deg=80), lens())
+        # points in the image, at integer positions, on the border and outside of the image
+        p = np.vstack((random.uniform(0, [320, 240], (50, 2)), np.round(random.uniform(0, [320, 240], (50, 2))),
+                       [[0, 0], [320, 240], [-10, 5], [330, 250]]))
+        offset, rays = cam.getRay(p, normed=True)
+        points = cam.spaceFromImage(p, Y=10)
+
+        cam.enableRayTable(dtype)
+        offset2, rays2 = cam.getRay(p, normed=True)
+        np.testing.assert_almost_equal(offset2, offset)
+        np.testing.assert_almost_equal(rays2, rays, 4 if dtype == np.float32 else 5)
+        np.testing.assert_almost_equal(cam.spaceFromImage(p, Y=10), points, 2)
+        np.testing.assert_almost_equal(cam.getRay(p[0])[1], cam.getRay(p[:1])[1][0])
+
+        # the table is kept when the orientation changes, but not when the intrinsic parameters change
+        table = cam.ray_table
+        cam.heading_deg = 10
+        cam.getRay(p)
+        self.assertIs(cam.ray_table, table)
+        cam.focallength_x_px = 350
+        cam.getRay(p)
+        self.assertIsNot(cam.ray_table, table)
+        cam.disableRayTable()
+        cam.focallength_x_px = 300
+        cam.heading_deg = 0
+        np.testing.assert_almost_equal(cam.getRay(p, normed=True)[1], rays)
+
+    @given(ct_st.camera(),
+           st.sampled_from([lambda: ct.NoDistortion(), lambda: ct.BrownLensDistortion(0.1, 0.02),
+                            lambda: ct.ABCDistortion(0.01, 0.02, 0.03),
+                            lambda: ct.OpenCVLensDistortion(0.1, 0.01, 0.001, 0.002)]),
+           st.integers(0, 2**16), st.integers(1, 5))
+    def test_frames(self, cam, lens, seed, frames):
+        random = np.random.RandomState(seed)
+        # the lens distortions scale differently with the focal length
+        cam = ct.Camera(cam.projection, cam.orientation, lens())
+        frame_parameters = dict(heading_deg=random.uniform(-30, 30, frames), tilt_deg=random.uniform(60, 85, frames),
+                                roll_deg=random.uniform(-5, 5, frames), elevation_m=random.uniform(5, 15, frames),
+                                focallength_x_px=cam.focallength_x_px * random.uniform(0.5, 2, frames),
+                                focallength_y_px=cam.focallength_y_px * random.uniform(0.5, 2, frames))
+        p = np.array([random.uniform(-10, 10, (frames, 10)), random.uniform(20, 50, (frames, 10)), np.zeros((frames, 10))]).T.swapaxes(0, 1)
+        state = cam.parameters.get_state()
+        p_image = cam.imageFromSpaceFrames(p, **frame_parameters)
+        p_space = cam.spaceFromImageFrames(p_image, **frame_parameters)
+        # the camera is not changed
+        self.assertEqual(cam.parameters.get_state(), state)
+
+        # every frame is the same as setting the parameters of the camera
+        for index in range(frames):
+            for name, values in frame_parameters.items():
+                setattr(cam, name, values[index])
+            # relative to the values, as strong distortions can move the points far out of small images
+            np.testing.assert_allclose(p_image[index], cam.imageFromSpace(p[index]), rtol=1e-9, atol=1e-4)
+            np.testing.assert_allclose(p_space[index], cam.spaceFromImage(p_image[index]), rtol=1e-9, atol=1e-4)
+
+        self.assertRaises(ValueError, lambda: cam.imageFromSpaceFrames(p, image_width_px=[100] * frames))
+
     @given(ct_st.projection(), ct_st.projection(), ct_st.orientation(), ct_st.orientation())
     def test_cameraGroup(self, proj1, proj2, orientation1, orientation2):
         def length(obj):
@@ -229,6 +696,54 @@ class TestTransforms(unittest.TestCase):
                     else:
                         assert cam.orientation == orientations
 
+    @given(st.integers(0, 2**16), st.integers(2, 5))
+    def test_triangulate(self, seed, count):
+        random = np.random.RandomState(seed)
+        camGroup = ct.CameraGroup(ct.RectilinearProjection(focallength_px=3863, image=(4608, 3456)),
+                                  [ct.SpatialOrientation(pos_x_m=random.uniform(-5, 5), elevation_m=random.uniform(5, 15),
+                                                         heading_deg=random.uniform(-5, 5)) for i in range(count)])
+        p = np.array([random.uniform(-10, 10, 100), random.uniform(50, 150, 100), random.uniform(-2, 2, 100)]).T
+        points = np.array(camGroup.imagesFromSpace(p))
+        # hide some of the points in some of the cameras
+        visibility = random.rand(count, 100) > 0.3
+
+        p2, error = camGroup.triangulate(points, visibility)
+        valid = np.sum(visibility & ~np.isnan(points[..., 0]), axis=0) >= 2
+        np.testing.assert_almost_equal(p2[valid], p[valid], 4)
+        np.testing.assert_almost_equal(error[valid], 0, 4)
+        self.assertTrue(np.all(np.isnan(p2[~valid])))
+
+        # for two cameras the result is the intersection of the two rays
+        p1, v1 = camGroup[0].getRay(points[0])
+        p2, v2 = camGroup[1].getRay(points[1])
+        np.testing.assert_almost_equal(ct.ray.intersectionOfLines([p1, p2], [v1, v2]), ct.ray.intersectionOfTwoLines(p1, v1, p2, v2), 4)
+
+        # the points of the first two cameras of a larger group can be given alone
+        np.testing.assert_almost_equal(camGroup.spaceFromImages(points[0], points[1]), ct.ray.intersectionOfTwoLines(p1, v1, p2, v2), 4)
+        np.testing.assert_almost_equal(camGroup.discanteBetweenRays(points[1], points[0], camera_indices=(1, 0)), 0, 4)
+
+    @given(st.integers(0, 2**16), st.integers(2, 4))
+    def test_epipolarDistances(self, seed, count):
+        random = np.random.RandomState(seed)
+        camGroup = ct.CameraGroup([ct.RectilinearProjection(focallength_px=random.uniform(2000, 4000), image=(4608, 3456))
+                                   for i in range(count)],
+                                  [ct.SpatialOrientation(pos_x_m=random.uniform(-5, 5), elevation_m=random.uniform(5, 15),
+                                                         tilt_deg=random.uniform(70, 90), heading_deg=random.uniform(-5, 5))
+                                   for i in range(count)])
+        p = np.array([random.uniform(-10, 10, 20), random.uniform(50, 150, 20), random.uniform(-2, 2, 20)]).T
+        points = np.array(camGroup.imagesFromSpace(p), dtype=float)
+        points += random.normal(0, 3, points.shape)
+        pairs = list(itertools.combinations(range(count), 2))
+        i, j = np.array(pairs).T
+
+        # the distances from the fundamental matrices are the distances to the projected rays
+        distances = camGroup.epipolarDistances(points)
+        self.assertEqual(distances.shape, (len(pairs), 2, 20))
+        np.testing.assert_allclose(distances, camGroup._epipolarDistancesFromRays(points, i, j), rtol=1e-4, atol=1e-6)
+
+        # the exact projections lie on the epipolar lines
+        np.testing.assert_almost_equal(camGroup.epipolarDistances(camGroup.imagesFromSpace(p)), 0, 4)
+
     @given(ct_st.camera_down_with_world_points())
     def test_stereoCamera(self, params):
         return